@@ -0,0 +1,303 @@
+# cliente_http.py
+"""
+Cliente HTTP para APIs externas (tipo de cambio), compartido por el monolito y currency-service.
+
+- Una requests.Session por proceso con pool de conexiones keep-alive (HTTP_POOL_MAX): no se
+  abre una conexión TLS nueva en cada llamada.
+- Presupuesto de tiempo por llamada (timeout total) repartido entre intentos: cada intento
+  usa un timeout de conexión corto (HTTP_CONNECT_TIMEOUT_S) y el resto del presupuesto para
+  leer. Los reintentos (HTTP_REINTENTOS) esperan un backoff exponencial con jitter completo
+  y solo se hacen si queda presupuesto.
+- Circuit breaker: tras HTTP_CIRCUITO_FALLOS llamadas fallidas seguidas a un mismo host el
+  circuito se abre y las llamadas fallan al instante (CircuitoAbierto) durante
+  HTTP_CIRCUITO_ABIERTO_S; luego se deja pasar una sola llamada de prueba (semiabierto) que
+  lo cierra o lo vuelve a abrir. Mientras está abierto, fx_service sirve las últimas tasas.
+
+`get_async` hace lo mismo sin bloquear el event loop (vistas async de currency-service):
+usa httpx.AsyncClient si httpx está instalado, y si no, la Session en un hilo. Ambos
+caminos comparten los circuitos, así el estado es uno solo por proceso.
+
+El estado de los circuitos se ve con `get_cliente().estado()` (endpoints .../fx/estado/).
+"""
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_MAX = int(os.getenv("HTTP_POOL_MAX", "10"))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "1.5"))
+HTTP_REINTENTOS = int(os.getenv("HTTP_REINTENTOS", "2"))
+HTTP_BACKOFF_S = float(os.getenv("HTTP_BACKOFF_S", "0.2"))
+HTTP_CIRCUITO_FALLOS = int(os.getenv("HTTP_CIRCUITO_FALLOS", "5"))
+HTTP_CIRCUITO_ABIERTO_S = float(os.getenv("HTTP_CIRCUITO_ABIERTO_S", "30"))
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+# respuestas que vale la pena reintentar (el resto de los 4xx no cambian al repetir)
+_REINTENTABLES = {429, 500, 502, 503, 504}
+_MIN_INTENTO_S = 0.25  # con menos presupuesto que esto no se hace otro intento
+_MIN_TIMEOUT_S = 0.001  # piso de los timeouts de cada intento (requests rechaza valores <= 0)
+
+
+def httpx_disponible():
+    return importlib.util.find_spec("httpx") is not None
+
+
+class RespuestaAsync:
+    """Lo que usa fx_service de una respuesta (status_code, raise_for_status, json), igual con httpx o requests."""
+
+    def __init__(self, url, status_code, contenido):
+        self.url, self.status_code, self._contenido = url, status_code, contenido
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} desde {self.url}", response=self)
+
+    def json(self):
+        return json.loads(self._contenido)
+
+
+class CircuitoAbierto(requests.RequestException):
+    """El host viene fallando: la llamada se rechaza sin tocar la red."""
+
+
+class Circuito:
+    """Circuit breaker de un host. Seguro entre hilos."""
+
+    def __init__(self, nombre, fallos_max=None, abierto_s=None):
+        self.nombre = nombre
+        self.fallos_max = HTTP_CIRCUITO_FALLOS if fallos_max is None else fallos_max
+        self.abierto_s = HTTP_CIRCUITO_ABIERTO_S if abierto_s is None else abierto_s
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallos = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+        self.metricas = {"llamadas": 0, "fallos": 0, "rechazadas": 0, "aperturas": 0}
+
+    def permitir(self):
+        """True si la llamada puede salir. En semiabierto deja pasar solo una a la vez."""
+        with self._lock:
+            if self._estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.abierto_s:
+                self._estado = SEMIABIERTO
+            if self._estado == CERRADO or (self._estado == SEMIABIERTO and not self._prueba_en_curso):
+                self._prueba_en_curso = self._estado == SEMIABIERTO
+                self.metricas["llamadas"] += 1
+                return True
+            self.metricas["rechazadas"] += 1
+            return False
+
+    def liberar(self):
+        """
+        Suelta la llamada de prueba si quien la tenía terminó sin exito() ni fallo() (excepción
+        inesperada, cancelación): si no, el circuito quedaría semiabierto rechazando todo.
+        Después de exito() o fallo() no hace nada (el circuito ya no está semiabierto).
+        """
+        with self._lock:
+            if self._estado == SEMIABIERTO:
+                self._prueba_en_curso = False
+
+    def exito(self):
+        with self._lock:
+            if self._estado != CERRADO:
+                logger.info("Circuito %s cerrado: el host volvió a responder", self.nombre)
+            self._estado, self._fallos, self._prueba_en_curso = CERRADO, 0, False
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self.metricas["fallos"] += 1
+            self._prueba_en_curso = False
+            if self._estado == SEMIABIERTO or self._fallos >= self.fallos_max:
+                if self._estado != ABIERTO:
+                    self.metricas["aperturas"] += 1
+                    logger.warning("Circuito %s abierto tras %s fallos seguidos; se reintenta en %s s",
+                                   self.nombre, self._fallos, self.abierto_s)
+                self._estado, self._abierto_desde = ABIERTO, time.monotonic()
+
+    def estado(self):
+        with self._lock:
+            reabre_en = None
+            if self._estado == ABIERTO:
+                reabre_en = round(max(0.0, self._abierto_desde + self.abierto_s - time.monotonic()), 1)
+            return {"estado": self._estado, "fallos_seguidos": self._fallos, "reabre_en_s": reabre_en,
+                    **self.metricas}
+
+
+class ClienteHTTP:
+    """Session con pool keep-alive, reintentos con jitter dentro de un presupuesto y un circuito por host."""
+
+    def __init__(self, pool_max=None, connect_timeout_s=None, reintentos=None, backoff_s=None,
+                 fallos_max=None, abierto_s=None):
+        self.connect_timeout_s = HTTP_CONNECT_TIMEOUT_S if connect_timeout_s is None else connect_timeout_s
+        self.reintentos = HTTP_REINTENTOS if reintentos is None else reintentos
+        self.backoff_s = HTTP_BACKOFF_S if backoff_s is None else backoff_s
+        self._circuito_args = (fallos_max, abierto_s)
+        self._circuitos = {}
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        # los reintentos los maneja este cliente (con presupuesto y circuito), no urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_max or HTTP_POOL_MAX, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._pool_max = pool_max or HTTP_POOL_MAX
+        self._async = {}  # event loop -> (httpx.AsyncClient, generador que lo cierra): un cliente por loop
+        self._async_lock = threading.Lock()
+
+    def circuito(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._circuitos:
+                self._circuitos[host] = Circuito(host, *self._circuito_args)
+            return self._circuitos[host]
+
+    def get(self, url, timeout=5.0, **kwargs):
+        """
+        GET con presupuesto total `timeout` (segundos) para todos los intentos. Devuelve la
+        Response (2xx/3xx/4xx no reintentables) o lanza requests.RequestException; CircuitoAbierto
+        si el circuito del host está abierto.
+        """
+        circuito = self.circuito(url)
+        if not circuito.permitir():
+            raise CircuitoAbierto(f"Circuito abierto para {circuito.nombre}")
+
+        try:
+            limite = time.monotonic() + timeout
+            intento = 0
+            while True:
+                conectar, leer = self._timeouts(limite)
+                try:
+                    r = self.session.get(url, timeout=(conectar, leer), **kwargs)
+                    if r.status_code not in _REINTENTABLES:
+                        circuito.exito()
+                        return r
+                    error = requests.HTTPError(f"{r.status_code} desde {url}", response=r)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                except requests.RequestException:
+                    circuito.fallo()  # URL inválida, etc.: no se reintenta
+                    raise
+
+                intento += 1
+                espera = self._espera(intento, limite)
+                if espera is None:
+                    circuito.fallo()
+                    raise error
+                logger.info("Reintento %s/%s de %s tras %s", intento, self.reintentos, url, error)
+                time.sleep(espera)
+        finally:
+            circuito.liberar()
+
+    def _timeouts(self, limite):
+        """(conexión, lectura) del intento con lo que queda del presupuesto, nunca <= 0 (timeout<=0 incluido)."""
+        restante = max(limite - time.monotonic(), _MIN_TIMEOUT_S * 2)
+        conectar = max(min(self.connect_timeout_s, restante / 2), _MIN_TIMEOUT_S)
+        return conectar, max(restante - conectar, _MIN_TIMEOUT_S)
+
+    def _espera(self, intento, limite):
+        """Backoff exponencial con jitter completo antes del intento siguiente (None = no reintentar)."""
+        espera = random.uniform(0, self.backoff_s * 2 ** (intento - 1))
+        if intento > self.reintentos or limite - (time.monotonic() + espera) < _MIN_INTENTO_S:
+            return None
+        return espera
+
+    async def _cliente_async(self):
+        """
+        httpx.AsyncClient del event loop en curso (un cliente no sirve desde otro loop). Lo cierra
+        un async generator de ese loop: al terminar (asyncio.run, apagado de uvicorn, cada
+        async_to_sync) `shutdown_asyncgens` lo finaliza y hace `aclose()`. Los de loops que se
+        cerraron sin eso se descartan en la próxima llamada.
+        """
+        import httpx
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            for cerrado in [l for l in self._async if l.is_closed()]:
+                del self._async[cerrado]
+            if loop in self._async:
+                return self._async[loop][0]
+            limites = httpx.Limits(max_connections=self._pool_max, max_keepalive_connections=self._pool_max)
+            cliente = httpx.AsyncClient(limits=limites)
+            vida = self._vida_cliente_async(loop, cliente)
+            self._async[loop] = (cliente, vida)
+        await vida.__anext__()  # primera iteración: el loop registra el generador para finalizarlo
+        return cliente
+
+    async def _vida_cliente_async(self, loop, cliente):
+        try:
+            yield
+        finally:
+            with self._async_lock:
+                if self._async.get(loop, (None,))[0] is cliente:
+                    del self._async[loop]
+            await cliente.aclose()
+
+    async def get_async(self, url, timeout=5.0):
+        """Como `get`, sin bloquear el event loop. Devuelve una RespuestaAsync."""
+        if not httpx_disponible():
+            r = await asyncio.to_thread(self.get, url, timeout)
+            return RespuestaAsync(url, r.status_code, r.content)
+
+        import httpx
+        circuito = self.circuito(url)
+        if not circuito.permitir():
+            raise CircuitoAbierto(f"Circuito abierto para {circuito.nombre}")
+        try:
+            cliente = await self._cliente_async()
+            limite = time.monotonic() + timeout
+            intento = 0
+            while True:
+                conectar, leer = self._timeouts(limite)
+                try:
+                    r = await cliente.get(url, timeout=httpx.Timeout(leer, connect=conectar))
+                    if r.status_code not in _REINTENTABLES:
+                        circuito.exito()
+                        return RespuestaAsync(url, r.status_code, r.content)
+                    error = requests.HTTPError(f"{r.status_code} desde {url}")
+                except httpx.TransportError as e:  # incluye timeouts
+                    error = requests.ConnectionError(f"{type(e).__name__}: {e}")
+                except httpx.HTTPError as e:
+                    circuito.fallo()
+                    raise requests.RequestException(str(e)) from e
+
+                intento += 1
+                espera = self._espera(intento, limite)
+                if espera is None:
+                    circuito.fallo()
+                    raise error
+                logger.info("Reintento %s/%s de %s tras %s", intento, self.reintentos, url, error)
+                await asyncio.sleep(espera)
+        finally:
+            circuito.liberar()  # también si el request se cancela mientras espera
+
+    def estado(self):
+        with self._lock:
+            circuitos = list(self._circuitos.values())
+        return {c.nombre: c.estado() for c in circuitos}
+
+
+_cliente = None
+_cliente_pid = None
+_cliente_lock = threading.Lock()
+
+
+def get_cliente():
+    """Cliente del proceso, creado al primer uso (y de nuevo tras un fork: el pool no se comparte)."""
+    global _cliente, _cliente_pid
+    if _cliente is None or _cliente_pid != os.getpid():
+        with _cliente_lock:
+            if _cliente is None or _cliente_pid != os.getpid():
+                _cliente = ClienteHTTP()
+                _cliente_pid = os.getpid()
+    return _cliente
@@ -3,5 +3,7 @@ from . import views
 
 urlpatterns = [
     path('ping/', views.ping, name='ping'),
+    path('fx/estado/', views.fx_estado, name='fx-estado'),
     path('convertir-moneda/', views.convertir_moneda, name='convertir-moneda'),
+    path('convertir-moneda/lote/', views.convertir_moneda_lote, name='convertir-moneda-lote'),
 ]
@@ -1,8 +1,13 @@
 from django.shortcuts import render  # si no lo usas, puedes borrarlo
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+import asyncio
 import logging
-import requests
+
+import fx_service
 
 logger = logging.getLogger(__name__)
 
@@ -11,27 +16,34 @@ def ping(request):
     return Response({'message': 'currency-service OK'})
 
 @api_view(['GET'])
-def convertir_moneda(request):
+def fx_estado(request):
+    # circuit breaker del proveedor y métricas de la caché de este proceso
+    return Response(fx_service.estado())
+
+# Las vistas de conversión son async (servir con currency_service/asgi.py): mientras esperan
+# al proveedor no ocupan un hilo, y los requests concurrentes comparten una sola descarga
+# (fx_service.obtener_tasas_async). DRF no tiene vistas async, por eso usan JsonResponse.
+
+@require_GET
+async def convertir_moneda(request):
     monto_str = request.GET.get("monto", "").strip()
     if not monto_str:
         logger.warning("Intento de conversión sin monto")
-        return Response({"error": "Debe indicar un monto numérico"}, status=400)
+        return JsonResponse({"error": "Debe indicar un monto numérico"}, status=400)
     try:
         monto = float(monto_str)
     except ValueError:
         logger.warning("Monto inválido: %s", monto_str)
-        return Response({"error": "El monto debe ser un número válido"}, status=400)
+        return JsonResponse({"error": "El monto debe ser un número válido"}, status=400)
 
     moneda = request.GET.get("moneda", "CLP")
 
-    url = "https://api.exchangerate-api.com/v4/latest/USD"
+    # caché compartida con el monolito (fx_service en la raíz del repo)
     try:
-        r = requests.get(url, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-    except requests.RequestException:
+        data = await fx_service.obtener_tasas_async()
+    except fx_service.TasasNoDisponibles:
         logger.error("Fallo al llamar API de tipo de cambio", exc_info=True)
-        return Response(
+        return JsonResponse(
             {"error": "No se pudo contactar la API de tipo de cambio"},
             status=502,
         )
@@ -39,7 +51,7 @@ def convertir_moneda(request):
     rates = data.get("rates", {})
     if moneda not in rates:
         logger.warning("Moneda no soportada: %s", moneda)
-        return Response(
+        return JsonResponse(
             {"error": f"Moneda no soportada: {moneda}"},
             status=400,
         )
@@ -50,7 +62,7 @@ def convertir_moneda(request):
 
     logger.info("Conversión exitosa %s %s -> %s USD", monto, moneda, round(resultado, 4))
 
-    return Response(
+    return JsonResponse(
         {
             "monto": monto,
             "moneda": moneda,
@@ -58,5 +70,45 @@ def convertir_moneda(request):
             "usd_por_moneda": usd_por_moneda,
             "fecha": data.get("date"),
             "tasa_base": "USD",
+            "desactualizado": data["desactualizado"],
+        }
+    )
+
+
+@csrf_exempt
+@require_POST
+async def convertir_moneda_lote(request):
+    # cuerpo crudo: acepta JSON y CSV
+    try:
+        montos, monedas, destinos = fx_service.leer_lote(
+            fx_service.cuerpo_lote(request), request.content_type,
+            moneda=request.GET.get("moneda", "CLP"), destino=request.GET.get("destino", "USD"),
+        )
+    except ValueError as e:
+        logger.warning("Lote de conversión inválido: %s", e)
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        data = await fx_service.obtener_tasas_async()
+    except fx_service.TasasNoDisponibles:
+        logger.error("Fallo al llamar API de tipo de cambio", exc_info=True)
+        return JsonResponse(
+            {"error": "No se pudo contactar la API de tipo de cambio"},
+            status=502,
+        )
+
+    # el cálculo (NumPy) va en un hilo para no frenar al resto de los requests
+    resultados, errores = await asyncio.to_thread(
+        fx_service.convertir_lote, montos, monedas, destinos, data.get("rates", {}),
+    )
+    logger.info("Conversión por lotes: %s ítems, %s con error", len(resultados), len(errores))
+
+    return JsonResponse(
+        {
+            "resultados": resultados,
+            "errores": errores,
+            "fecha": data.get("date"),
+            "tasa_base": "USD",
+            "desactualizado": data["desactualizado"],
         }
     )
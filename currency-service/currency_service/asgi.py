@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Las vistas de conversión (converter.views) son async: servidas desde aquí, un proceso
+atiende miles de requests concurrentes mientras esperan al proveedor de tipo de cambio.
+    uvicorn currency_service.asgi:application --port 8001
 """
 
 import os
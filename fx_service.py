@@ -0,0 +1,545 @@
+# fx_service.py
+"""
+Tipos de cambio (base USD) con caché compartida entre procesos.
+
+Lo usan el monolito (mercados/views.py) y currency-service. La respuesta del proveedor
+se guarda en un archivo JSON (FX_CACHE_DIR) que ven todos los workers de la máquina, más
+una copia en memoria por proceso:
+
+- Vigente (edad < FX_TTL_S): se devuelve sin tocar la red.
+- Vencida: se devuelve igual (stale-while-revalidate) y un solo worker la refresca en
+  segundo plano. El "solo uno" se coordina con un lockfile creado con O_CREAT | O_EXCL,
+  que funciona igual en Linux y Windows.
+- Sin caché (primer uso) o más vieja que FX_STALE_MAX_S: se espera el refresco; si otro
+  worker ya lo está haciendo, se espera su resultado en vez de pedir de nuevo. Si el
+  proveedor falla se devuelve la última copia, marcada como desactualizada, y no se vuelve
+  a intentar hasta pasados FX_REINTENTO_S (así un proveedor caído no recibe un intento por request).
+
+`obtener_tasas_async` es la versión para vistas async (currency-service bajo ASGI): no
+bloquea el event loop y los requests concurrentes que encuentran la caché vencida esperan
+una misma descarga (un solo futuro compartido) en vez de salir cada uno al proveedor.
+
+`obtener_matriz` entrega la matriz N×N de tipos cruzados de todas las monedas del
+proveedor; se arma una sola vez por cada refresco de las tasas y su `version` sirve de ETag.
+
+`convertir_lote` convierte muchos montos de una vez con NumPy (endpoints POST .../lote/ de
+ambos servicios); `leer_lote` interpreta el cuerpo JSON o CSV de esos endpoints.
+
+FX_URL es configurable: además de http(s) acepta file:///ruta/tasas.json para pruebas o
+uso sin conexión (mismo formato que exchangerate-api: {"base", "date", "rates"}).
+"""
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import numpy as np
+
+from cliente_http import CircuitoAbierto, get_cliente, httpx_disponible
+
+logger = logging.getLogger(__name__)
+
+FX_URL = os.getenv("FX_URL", "https://api.exchangerate-api.com/v4/latest/USD")
+FX_TTL_S = float(os.getenv("FX_TTL_S", "600"))
+FX_STALE_MAX_S = float(os.getenv("FX_STALE_MAX_S", "86400"))
+FX_TIMEOUT_S = float(os.getenv("FX_TIMEOUT_S", "5"))  # presupuesto por refresco, reintentos incluidos
+FX_REINTENTO_S = float(os.getenv("FX_REINTENTO_S", "30"))  # espera tras un refresco fallido
+FX_CACHE_DIR = os.getenv("FX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nuam_fx"))
+FX_LOTE_MAX = int(os.getenv("FX_LOTE_MAX", "200000"))  # ítems por request en los endpoints de lote
+FX_LOTE_MAX_BYTES = int(os.getenv("FX_LOTE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class TasasNoDisponibles(Exception):
+    """No hay tasas en caché utilizables y el proveedor no respondió."""
+
+
+# ------------------ proveedor ------------------
+
+def descargar(url=None, timeout=None):
+    """
+    Tasas desde `url` (http(s) o file://). Valida que traiga un dict `rates` no vacío.
+    `timeout` es el presupuesto total de la llamada, reintentos incluidos.
+    """
+    url = url or FX_URL
+    if urlparse(url).scheme == "file":
+        return _validar(_leer_json_local(url))
+    # pool keep-alive, reintentos y circuit breaker compartidos (cliente_http.py)
+    r = get_cliente().get(url, timeout=timeout or FX_TIMEOUT_S)
+    r.raise_for_status()
+    return _validar(r.json())
+
+
+async def descargar_async(url=None, timeout=None):
+    """Como `descargar`, con el cliente async (httpx si está instalado)."""
+    url = url or FX_URL
+    if urlparse(url).scheme == "file":
+        return _validar(await asyncio.to_thread(_leer_json_local, url))
+    r = await get_cliente().get_async(url, timeout=timeout or FX_TIMEOUT_S)
+    r.raise_for_status()
+    return _validar(r.json())
+
+
+def _leer_json_local(url):
+    with open(url2pathname(urlparse(url).path), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _validar(data):
+    if not isinstance(data.get("rates"), dict) or not data["rates"]:
+        raise ValueError("Respuesta del proveedor de tipo de cambio sin 'rates'")
+    return data
+
+
+# ------------------ matriz de tipos cruzados ------------------
+
+class MatrizCruzada:
+    """
+    Tipos cruzados de todas las monedas de una respuesta del proveedor (base USD).
+    `valores[i, j]` = unidades de la moneda j por 1 unidad de la moneda i, así que cualquier
+    par se lee en tiempo constante. `version` cambia con cada refresco (sirve de ETag).
+    """
+
+    def __init__(self, data, obtenido_en):
+        self.monedas = list(data["rates"])
+        self.indice = {m: i for i, m in enumerate(self.monedas)}
+        por_usd = np.fromiter(data["rates"].values(), dtype=float, count=len(self.monedas))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.valores = por_usd[np.newaxis, :] / por_usd[:, np.newaxis]
+        self.fecha = data.get("date")
+        self.obtenido_en = obtenido_en
+        self.version = hashlib.sha1(f"{self.fecha}|{obtenido_en!r}".encode()).hexdigest()[:16]
+
+    def __contains__(self, moneda):
+        return moneda in self.indice
+
+    def tasa(self, desde, hacia):
+        """Unidades de `hacia` por 1 unidad de `desde` (KeyError si alguna no está)."""
+        return float(self.valores[self.indice[desde], self.indice[hacia]])
+
+    def columna(self, base):
+        """Valor de 1 unidad de cada moneda expresado en `base`: {moneda: valor}."""
+        return dict(zip(self.monedas, self.valores[:, self.indice[base]].tolist()))
+
+
+# ------------------ caché ------------------
+
+class CacheTasas:
+    """Caché de un proveedor (una URL) en memoria + archivo, con refresco single-flight."""
+
+    def __init__(self, url=None, directorio=None, ttl_s=None, stale_max_s=None, timeout_s=None, proveedor=descargar,
+                 proveedor_async=descargar_async, reintento_s=None):
+        self.url = url or FX_URL
+        self.ttl_s = FX_TTL_S if ttl_s is None else ttl_s
+        self.stale_max_s = FX_STALE_MAX_S if stale_max_s is None else stale_max_s
+        self.timeout_s = timeout_s or FX_TIMEOUT_S
+        self.reintento_s = FX_REINTENTO_S if reintento_s is None else reintento_s
+        self.proveedor = proveedor
+        self.proveedor_async = proveedor_async
+        directorio = directorio or FX_CACHE_DIR
+        os.makedirs(directorio, exist_ok=True)
+        nombre = "".join(c if c.isalnum() else "_" for c in self.url)[-80:]
+        self.path = os.path.join(directorio, f"{nombre}.json")
+        self.lock_path = f"{self.path}.lock"
+        self._memoria = None  # (obtenido_en, data)
+        self._matriz = None   # MatrizCruzada de la última entrada leída
+        self._refrescando = threading.Lock()
+        self._tarea = None    # refresco async en curso (asyncio.Task), compartido por los requests
+        self._fallo_en = None  # time.monotonic() del último refresco fallido
+        self.metricas = {"memoria": 0, "archivo": 0, "vencidas": 0, "descargas": 0, "errores": 0}
+
+    # ---- archivo ----
+
+    def _leer_archivo(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                guardado = json.load(f)
+            return guardado["obtenido_en"], guardado["data"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _escribir_archivo(self, obtenido_en, data):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"obtenido_en": obtenido_en, "data": data}, f)
+        os.replace(tmp, self.path)  # atómico: los lectores ven el archivo viejo o el nuevo
+
+    # ---- lockfile ----
+
+    def _tomar_lock(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._sacar_lock_viejo():
+                    continue
+                return False
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return True
+        return False  # otro worker lo tomó apenas se sacó el viejo
+
+    def _sacar_lock_viejo(self):
+        """
+        Saca el lockfile si es de un worker que murió refrescando (más viejo que dos timeouts).
+        Se renombra antes de borrarlo: de los workers que lo ven viejo a la vez, uno solo logra
+        llevárselo, y si lo que se llevó no es el lock que vio viejo (otro worker ya lo había
+        reemplazado) lo devuelve. True si lo sacó.
+        """
+        try:
+            visto = os.stat(self.lock_path)
+            if time.time() - visto.st_mtime <= 2 * self.timeout_s + 1:
+                return False
+            apartado = f"{self.lock_path}.{os.getpid()}.{threading.get_ident()}"
+            os.rename(self.lock_path, apartado)
+        except OSError:
+            return False  # ya no está: otro worker lo sacó o lo soltó
+        try:
+            llevado = os.stat(apartado)
+            if (llevado.st_ino, llevado.st_mtime_ns) != (visto.st_ino, visto.st_mtime_ns):
+                try:
+                    os.link(apartado, self.lock_path)  # devolverlo, salvo que ya haya otro lock
+                except OSError:
+                    pass
+                return False
+            return True
+        finally:
+            try:
+                os.remove(apartado)
+            except OSError:
+                pass
+
+    def _soltar_lock(self):
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+    # ---- refresco ----
+
+    def _en_espera(self):
+        """True durante FX_REINTENTO_S tras un refresco fallido: se sirve lo que haya sin reintentar."""
+        fallo = self._fallo_en
+        return fallo is not None and time.monotonic() - fallo < self.reintento_s
+
+    def _fallo(self):
+        self.metricas["errores"] += 1
+        self._fallo_en = time.monotonic()
+
+    def _refrescar(self):
+        """Descarga y guarda (quien tenga el lockfile). Devuelve (obtenido_en, data) o None si falló."""
+        try:
+            data = self.proveedor(self.url, timeout=self.timeout_s)
+        except CircuitoAbierto as e:
+            # el proveedor viene fallando: se sigue sirviendo la última copia sin ensuciar el log
+            self._fallo()
+            logger.warning("Tipos de cambio sin refrescar: %s", e)
+            return None
+        except Exception:
+            self._fallo()
+            logger.error("Fallo al refrescar tipos de cambio desde %s", self.url, exc_info=True)
+            return None
+        finally:
+            self._soltar_lock()
+        return self._guardar(data)
+
+    def _guardar(self, data):
+        self.metricas["descargas"] += 1
+        self._fallo_en = None
+        entrada = (time.time(), data)
+        self._memoria = entrada
+        try:
+            self._escribir_archivo(*entrada)
+        except OSError:
+            logger.warning("No se pudo escribir la caché de tipos de cambio en %s", self.path, exc_info=True)
+        return entrada
+
+    def _refrescar_en_segundo_plano(self):
+        if self._en_espera():
+            return  # el último intento falló hace poco
+        if not self._refrescando.acquire(blocking=False):
+            return  # otro hilo de este proceso ya lo está haciendo
+        if not self._tomar_lock():
+            self._refrescando.release()
+            return  # otro proceso ya lo está haciendo
+
+        def tarea():
+            try:
+                self._refrescar()
+            finally:
+                self._refrescando.release()
+
+        threading.Thread(target=tarea, name="fx-refresco", daemon=True).start()
+
+    def _esperar_refresco(self):
+        """Sin caché utilizable: refrescar o esperar a que otro worker termine."""
+        limite = time.monotonic() + self.timeout_s + 1
+        with self._refrescando:
+            while True:
+                entrada = self._leer_archivo()
+                if entrada and time.time() - entrada[0] < self.stale_max_s:
+                    self._memoria = entrada
+                    return entrada
+                if self._en_espera():
+                    return None  # falló hace poco (quizás en otro hilo que se esperó aquí)
+                if self._tomar_lock():
+                    return self._refrescar()
+                if time.monotonic() > limite:
+                    return None
+                time.sleep(0.05)
+
+    def tasas(self):
+        """
+        Datos del proveedor ({"base", "date", "rates", ...}) más `obtenido_en` y
+        `desactualizado`. Lanza TasasNoDisponibles si no hay nada que devolver.
+        """
+        entrada = self._memoria
+        if entrada and time.time() - entrada[0] < self.ttl_s:
+            self.metricas["memoria"] += 1
+        else:
+            archivo = self._leer_archivo()
+            if archivo and (entrada is None or archivo[0] > entrada[0]):
+                entrada = self._memoria = archivo  # otro worker ya refrescó
+                self.metricas["archivo"] += 1
+            edad = time.time() - entrada[0] if entrada else None
+            if edad is None or edad >= self.stale_max_s:
+                entrada = self._esperar_refresco() or (entrada if edad is not None else None)
+            elif edad >= self.ttl_s:
+                self.metricas["vencidas"] += 1
+                self._refrescar_en_segundo_plano()
+        return self._respuesta(entrada)
+
+    def _respuesta(self, entrada):
+        if entrada is None:
+            raise TasasNoDisponibles(f"No se pudieron obtener tipos de cambio desde {self.url}")
+        obtenido_en, data = entrada
+        return {**data, "obtenido_en": obtenido_en, "desactualizado": time.time() - obtenido_en >= self.ttl_s}
+
+    # ---- versión async ----
+
+    async def tasas_async(self):
+        """
+        Como `tasas`, para vistas async. Con la copia en memoria vigente no hay ninguna espera;
+        si está vencida, todos los requests concurrentes comparten una sola tarea de refresco.
+        """
+        entrada = self._memoria
+        if entrada and time.time() - entrada[0] < self.ttl_s:
+            self.metricas["memoria"] += 1
+            return self._respuesta(entrada)
+        tarea = self._tarea
+        if (tarea is None or tarea.done()) and self._en_espera():
+            return self._respuesta(entrada)  # el último intento falló hace poco: lo que haya, sin reintentar
+        if tarea is None or tarea.done():
+            tarea = self._tarea = asyncio.ensure_future(self._refrescar_async())
+        if entrada and time.time() - entrada[0] < self.stale_max_s:
+            self.metricas["vencidas"] += 1
+            return self._respuesta(entrada)  # la tarea sigue en segundo plano
+        # shield: si un cliente corta su request, la descarga sigue para los demás
+        return self._respuesta(await asyncio.shield(tarea) or entrada)
+
+    async def _refrescar_async(self):
+        """Refresco coordinado con los demás procesos por el mismo lockfile. Devuelve la entrada o None."""
+        limite = time.monotonic() + self.timeout_s + 1
+        while True:
+            archivo = await asyncio.to_thread(self._leer_archivo)
+            if archivo and (self._memoria is None or archivo[0] > self._memoria[0]):
+                self._memoria = archivo
+                self.metricas["archivo"] += 1
+            if self._memoria and time.time() - self._memoria[0] < self.ttl_s:
+                return self._memoria  # otro proceso ya refrescó
+            if self._tomar_lock():
+                break
+            if time.monotonic() > limite:
+                return None
+            await asyncio.sleep(0.05)
+        try:
+            data = await self.proveedor_async(self.url, timeout=self.timeout_s)
+        except CircuitoAbierto as e:
+            self._fallo()
+            logger.warning("Tipos de cambio sin refrescar: %s", e)
+            return None
+        except Exception:
+            self._fallo()
+            logger.error("Fallo al refrescar tipos de cambio desde %s", self.url, exc_info=True)
+            return None
+        finally:
+            self._soltar_lock()
+        return await asyncio.to_thread(self._guardar, data)
+
+    def matriz(self):
+        """(MatrizCruzada, tasas()). La matriz se rearma solo cuando cambian las tasas."""
+        data = self.tasas()
+        matriz = self._matriz
+        if matriz is None or matriz.obtenido_en != data["obtenido_en"]:
+            matriz = self._matriz = MatrizCruzada(data, data["obtenido_en"])
+        return matriz, data
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(url=None):
+    """Caché del proceso para `url` (FX_URL por defecto)."""
+    url = url or FX_URL
+    with _caches_lock:
+        if url not in _caches:
+            _caches[url] = CacheTasas(url)
+        return _caches[url]
+
+
+def obtener_tasas(url=None):
+    """Tasas vigentes (o la última copia buena mientras se refresca). Ver CacheTasas.tasas."""
+    return get_cache(url).tasas()
+
+
+async def obtener_tasas_async(url=None):
+    """Versión async de `obtener_tasas` (single-flight dentro del proceso). Ver CacheTasas.tasas_async."""
+    return await get_cache(url).tasas_async()
+
+
+def estado(url=None):
+    """Circuitos del cliente HTTP y métricas de la caché, para monitoreo."""
+    cache = get_cache(url)
+    entrada = cache._memoria or cache._leer_archivo()
+    return {
+        "url": cache.url,
+        "circuitos": get_cliente().estado(),
+        "cliente_async": "httpx" if httpx_disponible() else "hilos",
+        "cache": {**cache.metricas, "edad_s": round(time.time() - entrada[0], 1) if entrada else None},
+    }
+
+
+def obtener_matriz(url=None):
+    """(MatrizCruzada, tasas) de la caché del proceso. Ver CacheTasas.matriz."""
+    return get_cache(url).matriz()
+
+
+# ------------------ conversión por lotes ------------------
+
+def cuerpo_lote(request):
+    """
+    Cuerpo crudo de un request de lote (Django o DRF). Se lee del stream para no chocar con
+    DATA_UPLOAD_MAX_MEMORY_SIZE (2,5 MB), con su propio tope FX_LOTE_MAX_BYTES.
+    """
+    try:
+        largo = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        largo = 0
+    if largo > FX_LOTE_MAX_BYTES:
+        raise ValueError(f"El cuerpo supera {FX_LOTE_MAX_BYTES} bytes")
+    return request.read()
+
+
+def leer_lote(cuerpo, content_type="", moneda="CLP", destino="USD"):
+    """
+    Cuerpo de un POST de conversión por lotes -> (montos, monedas, destinos), en el orden recibido.
+
+    - JSON: lista de objetos {"monto", "moneda", "destino"} o lista de montos.
+    - CSV (Content-Type text/csv): encabezado con `monto` y opcionalmente `moneda`, `destino`.
+
+    `moneda` y `destino` son los valores por defecto de los ítems que no los traen. Los
+    montos se devuelven tal cual (la validación es por ítem en `convertir_lote`). Lanza
+    ValueError si el cuerpo no se puede interpretar o supera FX_LOTE_MAX ítems.
+    """
+    texto = cuerpo.decode("utf-8-sig") if isinstance(cuerpo, bytes) else cuerpo
+    if "csv" in content_type:
+        filas = list(csv.DictReader(io.StringIO(texto)))
+        if filas and "monto" not in filas[0]:
+            raise ValueError("El CSV debe tener una columna 'monto'")
+    else:
+        try:
+            filas = json.loads(texto)
+        except ValueError:
+            raise ValueError("El cuerpo debe ser una lista JSON o un CSV (Content-Type: text/csv)")
+        if not isinstance(filas, list):
+            raise ValueError("El cuerpo JSON debe ser una lista de conversiones")
+    if len(filas) > FX_LOTE_MAX:
+        raise ValueError(f"Máximo {FX_LOTE_MAX} conversiones por request")
+
+    montos, monedas, destinos = [], [], []
+    for fila in filas:
+        if isinstance(fila, dict):
+            montos.append(fila.get("monto"))
+            monedas.append(str(fila.get("moneda") or moneda))
+            destinos.append(str(fila.get("destino") or destino))
+        else:
+            montos.append(fila)
+            monedas.append(moneda)
+            destinos.append(destino)
+    return montos, monedas, destinos
+
+
+def _indices(codigos, tabla):
+    """Posición de cada código en `tabla` (-1 si la moneda no está en las tasas)."""
+    return np.fromiter((tabla.get(c, -1) for c in codigos), dtype=np.int64, count=len(codigos))
+
+
+def convertir_lote(montos, monedas, destinos, rates, decimales=4):
+    """
+    Convierte montos[i] de monedas[i] a destinos[i] con las tasas `rates` (base USD), en
+    una sola pasada vectorizada. Devuelve (resultados, errores): `resultados` en el mismo
+    orden que la entrada, con None en los ítems fallidos, y `errores` una lista de
+    {"indice", "error"}. Un monto es válido si es int, float o un texto numérico; booleanos,
+    listas, objetos y null son errores del ítem.
+    """
+    n = len(montos)
+    if n == 0:
+        return [], []
+    tabla = {c: i for i, c in enumerate(rates)}
+    tasas = np.fromiter(rates.values(), dtype=float, count=len(rates))
+    tasas = np.append(tasas, np.nan)  # índice -1: moneda no soportada
+
+    valores = None
+    # np.asarray aceptaría True (1.0) o listas anidadas: solo va directo si todos los tipos sirven
+    if all(type(m) in _TIPOS_MONTO for m in montos):
+        try:
+            valores = np.asarray(montos, dtype=float)
+        except (ValueError, OverflowError):
+            pass
+    if valores is None:
+        # algún monto inválido: convertir uno a uno y dejar NaN en los inválidos
+        valores = np.array([_a_float(m) for m in montos], dtype=float)
+    origen = _indices(monedas, tabla)
+    destino = _indices(destinos, tabla)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        resultado = np.round(valores * tasas[destino] / tasas[origen], decimales)
+    ok = np.isfinite(resultado)
+
+    if ok.all():
+        return resultado.tolist(), []
+    errores = []
+    monto_malo = ~np.isfinite(valores)
+    for i in np.flatnonzero(~ok).tolist():
+        if monto_malo[i]:
+            error = "El monto debe ser un número válido"
+        elif origen[i] < 0:
+            error = f"Moneda no soportada: {monedas[i]}"
+        elif destino[i] < 0:
+            error = f"Moneda no soportada: {destinos[i]}"
+        else:
+            error = "Conversión no válida"
+        errores.append({"indice": i, "error": error})
+    salida = resultado.astype(object)
+    salida[~ok] = None
+    return salida.tolist(), errores
+
+
+_TIPOS_MONTO = (int, float, str)  # exactos: bool es subclase de int y no se acepta
+
+
+def _a_float(valor):
+    if type(valor) not in _TIPOS_MONTO or valor == "":
+        return np.nan
+    try:
+        return float(valor)
+    except (ValueError, OverflowError):
+        return np.nan
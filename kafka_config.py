@@ -1,2 +1,23 @@
-KAFKA_BOOTSTRAP_SERVERS = "localhost:9092"
-KAFKA_TOPIC_EMPRESAS = "nuam.empresas.ingreso"
+import os
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+KAFKA_TOPIC_EMPRESAS = os.getenv("KAFKA_TOPIC_EMPRESAS", "nuam.empresas.ingreso")
+
+# Producer: agrupa mensajes (linger/batch) y los comprime
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "20"))
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "lz4")
+# Máximo de mensajes esperando en la cola local del producer (p.ej. con el broker caído)
+KAFKA_COLA_MAX = int(os.getenv("KAFKA_COLA_MAX", "100000"))
+# Qué hacer si la cola está llena: "descartar" (no espera nunca) o "esperar" (hasta KAFKA_ESPERA_MAX_S)
+KAFKA_DESBORDE = os.getenv("KAFKA_DESBORDE", "descartar")
+KAFKA_ESPERA_MAX_S = float(os.getenv("KAFKA_ESPERA_MAX_S", "1.0"))
+# Tiempo máximo que un mensaje puede esperar al broker antes de darse por perdido
+KAFKA_MESSAGE_TIMEOUT_MS = int(os.getenv("KAFKA_MESSAGE_TIMEOUT_MS", "30000"))
+
+# Consumidor que materializa el modelo de lectura (manage.py consumir_empresas)
+KAFKA_GRUPO_LECTURA = os.getenv("KAFKA_GRUPO_LECTURA", "nuam-lectura-empresas")
+
+# Transporte del producer: "kafka" (confluent_kafka) o "memoria" (broker en proceso, para pruebas y benchmarks)
+KAFKA_TRANSPORTE = os.getenv("KAFKA_TRANSPORTE", "kafka")
+# Latencia simulada de confirmación del transporte "memoria"
+KAFKA_MEMORIA_LATENCIA_MS = float(os.getenv("KAFKA_MEMORIA_LATENCIA_MS", "2"))
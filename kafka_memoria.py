@@ -0,0 +1,294 @@
+# kafka_memoria.py
+"""
+Broker de Kafka en memoria, para pruebas y benchmarks sin un broker real.
+
+Imita la parte de confluent_kafka que usa NUAM: topics con particiones (la clave decide
+la partición), un Producer con `produce/poll/flush` que confirma cada mensaje tras una
+latencia simulada, y un Consumer de grupo con `subscribe/consume/commit/seek/close`,
+offsets confirmados por grupo y rebalanceo (reparto round-robin de las particiones,
+revocando todas) cada vez que un consumidor entra o sale del grupo.
+"""
+import heapq
+import itertools
+import threading
+import time
+import zlib
+
+from confluent_kafka import OFFSET_INVALID, KafkaError, KafkaException, TopicPartition
+
+
+class MensajeMemoria:
+    """Mensaje con la misma interfaz de lectura que confluent_kafka.Message."""
+
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_headers")
+
+    def __init__(self, topic, partition, offset, key, value, headers):
+        self._topic, self._partition, self._offset = topic, partition, offset
+        self._key, self._value, self._headers = key, value, headers
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def error(self):
+        return None
+
+    def __len__(self):
+        return len(self._value or b"")
+
+
+class BrokerMemoria:
+    """Topics, offsets confirmados y miembros de cada grupo. Seguro entre hilos."""
+
+    def __init__(self, particiones=3):
+        self.particiones = particiones
+        self._lock = threading.RLock()
+        self._topics = {}       # topic -> [mensajes de la partición 0, 1, ...]
+        self._confirmados = {}  # (grupo, topic, partición) -> offset
+        self._miembros = {}     # grupo -> [consumidores, en orden de ingreso]
+        self._generacion = {}   # grupo -> n.º de rebalanceos
+        self._sin_clave = 0
+
+    def _log(self, topic):
+        if topic not in self._topics:
+            self._topics[topic] = [[] for _ in range(self.particiones)]
+        return self._topics[topic]
+
+    def particion(self, key):
+        if key is None:
+            self._sin_clave += 1
+            return self._sin_clave % self.particiones
+        return zlib.crc32(key) % self.particiones
+
+    def producir(self, topic, value, key=None, headers=None, partition=None):
+        with self._lock:
+            p = self.particion(key) if partition is None else partition
+            log = self._log(topic)[p]
+            msg = MensajeMemoria(topic, p, len(log), key, value, headers)
+            log.append(msg)
+            return msg
+
+    def mensajes(self, topic):
+        with self._lock:
+            return [m for log in self._log(topic) for m in log]
+
+    def leer(self, topic, particion, desde, n):
+        with self._lock:
+            return self._log(topic)[particion][desde:desde + n]
+
+    def fin(self, topic, particion):
+        with self._lock:
+            return len(self._log(topic)[particion])
+
+    # ---- grupos ----
+
+    def confirmar(self, grupo, topic, particion, offset):
+        with self._lock:
+            self._confirmados[(grupo, topic, particion)] = offset
+
+    def confirmado(self, grupo, topic, particion):
+        with self._lock:
+            return self._confirmados.get((grupo, topic, particion))
+
+    def generacion(self, grupo):
+        with self._lock:
+            return self._generacion.get(grupo, 0)
+
+    def unir(self, consumidor):
+        with self._lock:
+            self._miembros.setdefault(consumidor.grupo, []).append(consumidor)
+            self._generacion[consumidor.grupo] = self.generacion(consumidor.grupo) + 1
+
+    def salir(self, consumidor):
+        with self._lock:
+            miembros = self._miembros.get(consumidor.grupo, [])
+            if consumidor in miembros:
+                miembros.remove(consumidor)
+                self._generacion[consumidor.grupo] = self.generacion(consumidor.grupo) + 1
+
+    def asignacion(self, consumidor):
+        """Particiones que le tocan a `consumidor` en la generación actual de su grupo."""
+        with self._lock:
+            miembros = self._miembros.get(consumidor.grupo, [])
+            if consumidor not in miembros:
+                return []
+            topics = sorted({t for m in miembros for t in m.topics})
+            todas = [(t, p) for t in topics for p in range(self.particiones)]
+            i = miembros.index(consumidor)
+            return [tp for k, tp in enumerate(todas) if k % len(miembros) == i and tp[0] in consumidor.topics]
+
+
+_broker_global = None
+_broker_lock = threading.Lock()
+
+
+def broker_global():
+    """Broker compartido por todo el proceso (el que usa KAFKA_TRANSPORTE=memoria)."""
+    global _broker_global
+    with _broker_lock:
+        if _broker_global is None:
+            _broker_global = BrokerMemoria()
+        return _broker_global
+
+
+class ProducerMemoria:
+    """
+    Producer sobre un BrokerMemoria (subconjunto de confluent_kafka.Producer). Cada mensaje
+    queda en el log al producirse y su confirmación llega `latencia_ack_s` después, en el
+    primer `poll()`/`flush()` posterior. Con la cola llena lanza BufferError, como librdkafka.
+    """
+
+    def __init__(self, broker=None, config=None, latencia_ack_s=0.0):
+        self.broker = broker or broker_global()
+        self.latencia_ack_s = latencia_ack_s
+        self.cola_max = int((config or {}).get("queue.buffering.max.messages", 100000))
+        self._lock = threading.Lock()
+        self._pendientes = []  # heap de (vence, n.º, mensaje, callback)
+        self._en_curso = 0     # confirmaciones sacadas del heap cuyo callback aún no termina
+        self._orden = itertools.count()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pendientes) + self._en_curso
+
+    def produce(self, topic, value=None, key=None, headers=None, on_delivery=None, partition=None, **kwargs):
+        with self._lock:
+            if len(self._pendientes) >= self.cola_max:
+                raise BufferError("Local: Queue full")
+            msg = self.broker.producir(topic, value, key=key, headers=headers, partition=partition)
+            heapq.heappush(self._pendientes, (time.monotonic() + self.latencia_ack_s, next(self._orden), msg, on_delivery))
+
+    def _vencidos(self):
+        ahora = time.monotonic()
+        with self._lock:
+            listos = []
+            while self._pendientes and self._pendientes[0][0] <= ahora:
+                listos.append(heapq.heappop(self._pendientes))
+            self._en_curso += len(listos)
+            proximo = self._pendientes[0][0] - ahora if self._pendientes else None
+        return listos, proximo
+
+    def poll(self, timeout=0):
+        listos, proximo = self._vencidos()
+        if not listos and proximo is not None and timeout:
+            time.sleep(min(proximo, timeout) if timeout > 0 else proximo)
+            listos, _ = self._vencidos()
+        elif not listos and timeout and timeout > 0:
+            time.sleep(min(timeout, 0.05))
+        try:
+            for _, _, msg, cb in listos:
+                if cb is not None:
+                    cb(None, msg)
+        finally:
+            with self._lock:
+                self._en_curso -= len(listos)
+        return len(listos)
+
+    def flush(self, timeout=None):
+        limite = None if timeout is None else time.monotonic() + timeout
+        while len(self):
+            restante = None if limite is None else limite - time.monotonic()
+            if restante is not None and restante <= 0:
+                break
+            self.poll(0.1 if restante is None else min(restante, 0.1))
+        return len(self)
+
+
+class ConsumerMemoria:
+    """Consumer de grupo sobre un BrokerMemoria (subconjunto de confluent_kafka.Consumer)."""
+
+    def __init__(self, broker, config):
+        self.broker = broker
+        self.grupo = config["group.id"]
+        self.desde_inicio = config.get("auto.offset.reset", "latest") in ("earliest", "smallest", "beginning")
+        self.topics = []
+        self._callbacks = {}
+        self._generacion = None
+        self._posiciones = {}  # (topic, partición) -> próximo offset a leer
+        self._cerrado = False
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None, on_lost=None):
+        self.topics = list(topics)
+        self._callbacks = {"assign": on_assign, "revoke": on_revoke}
+        self.broker.unir(self)
+
+    def _rebalancear(self):
+        generacion = self.broker.generacion(self.grupo)
+        if generacion == self._generacion:
+            return
+        revocar = self.assignment()
+        if revocar and self._callbacks.get("revoke"):
+            self._callbacks["revoke"](self, revocar)
+        self._generacion = generacion
+        self._posiciones = {}
+        for t, p in self.broker.asignacion(self):
+            offset = self.broker.confirmado(self.grupo, t, p)
+            if offset is None:
+                offset = 0 if self.desde_inicio else self.broker.fin(t, p)
+            self._posiciones[(t, p)] = offset
+        if self._callbacks.get("assign"):
+            self._callbacks["assign"](self, self.assignment())
+
+    def consume(self, num_messages=1, timeout=-1):
+        if self._cerrado:
+            raise RuntimeError("Consumer cerrado")
+        self._rebalancear()
+        salida = []
+        for (t, p), pos in self._posiciones.items():
+            lote = self.broker.leer(t, p, pos, num_messages - len(salida))
+            self._posiciones[(t, p)] = pos + len(lote)
+            salida.extend(lote)
+            if len(salida) >= num_messages:
+                break
+        if not salida and timeout and timeout > 0:
+            time.sleep(min(timeout, 0.01))
+        return salida
+
+    def assignment(self):
+        return [TopicPartition(t, p) for t, p in self._posiciones]
+
+    def seek(self, tp):
+        if (tp.topic, tp.partition) not in self._posiciones:
+            raise KafkaException(KafkaError(KafkaError._UNKNOWN_PARTITION))
+        self._posiciones[(tp.topic, tp.partition)] = tp.offset
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        if offsets is None:
+            offsets = [TopicPartition(t, p, pos) for (t, p), pos in self._posiciones.items()]
+        # como en Kafka: un miembro que ya perdió la partición no puede confirmar su offset
+        if self._generacion != self.broker.generacion(self.grupo) or any(
+                (tp.topic, tp.partition) not in self._posiciones for tp in offsets):
+            raise KafkaException(KafkaError(KafkaError.ILLEGAL_GENERATION))
+        for tp in offsets:
+            self.broker.confirmar(self.grupo, tp.topic, tp.partition, tp.offset)
+        return offsets
+
+    def committed(self, partitions, timeout=None):
+        salida = []
+        for tp in partitions:
+            offset = self.broker.confirmado(self.grupo, tp.topic, tp.partition)
+            salida.append(TopicPartition(tp.topic, tp.partition, OFFSET_INVALID if offset is None else offset))
+        return salida
+
+    def close(self):
+        if self._cerrado:
+            return
+        if self._posiciones and self._callbacks.get("revoke"):
+            self._callbacks["revoke"](self, self.assignment())
+        self._posiciones = {}
+        self.broker.salir(self)
+        self._cerrado = True
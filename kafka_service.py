@@ -1,29 +1,149 @@
 # kafka_service.py
-import json
-from confluent_kafka import Producer
-from kafka_config import KAFKA_BOOTSTRAP_SERVERS, KAFKA_TOPIC_EMPRESAS
-import logging
-from confluent_kafka import Producer
+"""
+Publicación de eventos de Empresa en Kafka sin bloquear a quien publica.
 
-# Crear un solo Producer global (reutilizarlo es buena práctica). [web:177][web:205]
-producer = Producer({"bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS})
+Hay un solo Producer por proceso, creado recién al primer uso. Quien publica solo encola
+el mensaje; un hilo en segundo plano hace `poll()` para atender las confirmaciones de
+entrega. La cola local es acotada (KAFKA_COLA_MAX) y, si se llena (broker caído o lento),
+se aplica KAFKA_DESBORDE: "descartar" el mensaje nuevo o "esperar" un máximo de KAFKA_ESPERA_MAX_S.
 
+El transporte es intercambiable (KAFKA_TRANSPORTE): "kafka" usa confluent_kafka y "memoria"
+el broker en proceso de kafka_memoria.py, que confirma tras KAFKA_MEMORIA_LATENCIA_MS.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
 
-def publicar_evento_empresa(datos: dict):
-    """Publica un JSON de empresa en el topic nuam.empresas.ingreso."""
-    value = json.dumps(datos).encode("utf-8")
-    producer.produce(KAFKA_TOPIC_EMPRESAS, value=value)
-    # flush pequeño para desarrollo; en producción se optimiza. [web:190]
-    producer.flush(1)
+from kafka_config import (
+    KAFKA_BOOTSTRAP_SERVERS, KAFKA_COLA_MAX, KAFKA_COMPRESSION, KAFKA_DESBORDE, KAFKA_ESPERA_MAX_S,
+    KAFKA_LINGER_MS, KAFKA_MEMORIA_LATENCIA_MS, KAFKA_MESSAGE_TIMEOUT_MS, KAFKA_TRANSPORTE,
+)
 
 logger = logging.getLogger(__name__)
 
-producer = Producer({"bootstrap.servers": "localhost:9092"})
+DESCARTAR = "descartar"
+ESPERAR = "esperar"
+TRANSPORTES = ("kafka", "memoria")
+
+
+def crear_transporte(nombre, config, latencia_ack_s=None):
+    """Objeto con la interfaz de confluent_kafka.Producer (produce/poll/flush/len) para `nombre`."""
+    if nombre == "kafka":
+        from confluent_kafka import Producer
+        return Producer(config)
+    if nombre == "memoria":
+        from kafka_memoria import ProducerMemoria
+        latencia = KAFKA_MEMORIA_LATENCIA_MS / 1000 if latencia_ack_s is None else latencia_ack_s
+        return ProducerMemoria(config=config, latencia_ack_s=latencia)
+    raise ValueError(f"Transporte de Kafka desconocido: {nombre} (opciones: {', '.join(TRANSPORTES)})")
+
+
+class ProductorEventos:
+    """Producer compartido con hilo de poll y cola local acotada."""
+
+    def __init__(self, config=None, desborde=KAFKA_DESBORDE, espera_max_s=KAFKA_ESPERA_MAX_S,
+                 transporte=None):
+        self.config = {
+            "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+            "linger.ms": KAFKA_LINGER_MS,
+            "compression.type": KAFKA_COMPRESSION,
+            "batch.num.messages": 10000,
+            "queue.buffering.max.messages": KAFKA_COLA_MAX,
+            "message.timeout.ms": KAFKA_MESSAGE_TIMEOUT_MS,
+            # mismo hash de clave que los clientes Java: un ticker cae siempre en la misma partición
+            "partitioner": "murmur2_random",
+            **(config or {}),
+        }
+        self.desborde = desborde
+        self.espera_max_s = espera_max_s
+        self.metricas = {"encolados": 0, "entregados": 0, "fallidos": 0, "descartados": 0}
+        self._lock = threading.Lock()
+        # `transporte`: nombre (ver TRANSPORTES) o un objeto ya creado con la interfaz de Producer
+        transporte = KAFKA_TRANSPORTE if transporte is None else transporte
+        self._producer = crear_transporte(transporte, self.config) if isinstance(transporte, str) else transporte
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._poll_loop, name="kafka-poll", daemon=True)
+        self._hilo.start()
+
+    def _poll_loop(self):
+        while not self._detener.is_set():
+            self._producer.poll(0.2)
+
+    def _contar(self, clave, n=1):
+        with self._lock:
+            self.metricas[clave] += n
+
+    def _on_delivery(self, err, msg):
+        if err is not None:
+            self._contar("fallidos")
+            logger.warning("Evento no entregado a %s: %s", msg.topic(), err)
+        else:
+            self._contar("entregados")
+
+    def encolar(self, topic, value, key=None, desborde=None, espera_max_s=None, callback=None, headers=None):
+        """
+        Deja el mensaje en la cola local y vuelve de inmediato. Devuelve False si se descartó
+        porque la cola estaba llena (con "esperar", tras `espera_max_s` segundos).
+        `callback(err, msg)` se llama además al confirmarse (o fallar) la entrega.
+        """
+        desborde = desborde or self.desborde
+        on_delivery = self._on_delivery
+        if callback is not None:
+            def on_delivery(err, msg):
+                self._on_delivery(err, msg)
+                callback(err, msg)
+        espera = self.espera_max_s if espera_max_s is None else espera_max_s
+        limite = time.monotonic() + (espera if desborde == ESPERAR else 0)
+        while True:
+            try:
+                self._producer.produce(topic, value=value, key=key, headers=headers, on_delivery=on_delivery)
+                self._contar("encolados")
+                return True
+            except BufferError:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._contar("descartados")
+                    n = self.metricas["descartados"]
+                    if n == 1 or n % 1000 == 0:  # no llenar el log mientras el broker siga caído
+                        logger.warning("Cola de Kafka llena (%s mensajes): %s eventos descartados", len(self._producer), n)
+                    return False
+                # el hilo de poll va liberando la cola; esperar un poco y reintentar
+                time.sleep(min(0.05, restante))
+
+    def pendientes(self):
+        return len(self._producer)
+
+    def flush(self, timeout=10.0):
+        """Espera a que salgan los mensajes encolados. Devuelve cuántos quedaron sin confirmar."""
+        return self._producer.flush(timeout)
+
+    def cerrar(self, timeout=5.0):
+        self._detener.set()
+        self._hilo.join(timeout=1.0)
+        pendientes = self.flush(timeout)
+        if pendientes:
+            logger.warning("Se cerraron %s eventos de Kafka sin confirmar", pendientes)
+
+
+_productor = None
+_productor_pid = None
+_productor_lock = threading.Lock()
+
+
+def get_productor():
+    """Productor del proceso, creado al primer uso (y de nuevo tras un fork: librdkafka no es fork-safe)."""
+    global _productor, _productor_pid
+    if _productor is None or _productor_pid != os.getpid():
+        with _productor_lock:
+            if _productor is None or _productor_pid != os.getpid():
+                _productor = ProductorEventos()
+                _productor_pid = os.getpid()
+    return _productor
+
 
-def publicar_evento_empresa(data):
-    try:
-        producer.produce("empresas-events", value=data)
-        producer.flush()
-        logger.info("Evento enviado a Kafka: %s", data)
-    except Exception:
-        logger.error("Error al publicar en Kafka", exc_info=True)
\ No newline at end of file
+@atexit.register
+def _cerrar_productor():
+    if _productor is not None and _productor_pid == os.getpid():
+        _productor.cerrar()
@@ -1,15 +1,18 @@
 from django.contrib import admin, messages
 from django.contrib.admin.sites import AdminSite
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.urls import path
+from django.utils.html import format_html
 import csv
 
 from .models import (
     Pais, Normativa, Empresa,
     InstrumentoNoInscrito, CalificacionTributaria,
-    HistorialCambio, ArchivoCargaMasiva, ValorInstrumento
+    HistorialCambio, ArchivoCargaMasiva, LayoutHoja, ValorInstrumento, EventoOutbox,
+    EmpresaLectura, TipoCambio,
 )
-from .utils_import import import_empresas_from_excel
+from . import import_jobs
 
 
 # -------------------------------------------------------------------
@@ -71,7 +74,7 @@ class PaisAdmin(admin.ModelAdmin):
 
 @admin.register(Empresa)
 class EmpresaAdmin(admin.ModelAdmin):
-    list_display = ("ticker", "nombre", "pais", "moneda", "capitalizacion")
+    list_display = ("ticker", "nombre", "pais", "moneda", "capitalizacion", "capitalizacion_usd")
     search_fields = ("ticker", "nombre", "pais__codigo", "pais__nombre", "moneda")
     list_filter = ("pais", "moneda")
     ordering = ("ticker",)
@@ -103,32 +106,98 @@ class InstrumentoNoInscritoAdmin(admin.ModelAdmin):
 
 @admin.register(ArchivoCargaMasiva)
 class ArchivoCargaMasivaAdmin(admin.ModelAdmin):
-    list_display = ("archivo", "fecha_subida", "procesado", "resultado")
-    readonly_fields = ("fecha_subida",)
-    list_filter = ("procesado",)
+    list_display = ("archivo", "fecha_subida", "estado", "barra_progreso", "duracion_s", "resultado")
+    readonly_fields = (
+        "fecha_subida", "hash_contenido", "procesado", "resultado", "estado", "progreso", "etapa", "worker", "intentos",
+        "encolado_en", "iniciado_en", "actualizado_en", "latido_en", "finalizado_en", "duracion_s",
+    )
+    list_filter = ("estado", "procesado")
     list_per_page = 50
     save_on_top = True
-    actions = ["procesar_empresas_desde_excel"]
-
-    def procesar_empresas_desde_excel(self, request, queryset):
-        for obj in queryset:
-            try:
-                path = obj.archivo.path
-            except Exception:
-                messages.error(request, f"No se pudo resolver la ruta del archivo: {obj.archivo}")
-                continue
-
-            res = import_empresas_from_excel(path)
-            obj.procesado = bool(res.get("ok"))
-            obj.resultado = res.get("msg", "")
-            obj.save(update_fields=["procesado", "resultado"])
-
-            if res.get("ok"):
-                messages.success(request, f"{obj.archivo.name}: {res['msg']}")
-            else:
-                messages.error(request, f"{obj.archivo.name}: {res['msg']}")
-
-    procesar_empresas_desde_excel.short_description = "Procesar Excel y cargar/actualizar empresas"
+    actions = ["procesar_empresas_desde_excel", "reprocesar_forzado"]
+    change_list_template = "admin/mercados/archivocargamasiva/change_list.html"
+
+    @admin.display(description="Progreso")
+    def barra_progreso(self, obj):
+        return format_html(
+            '<span class="carga-progreso" data-id="{}" data-estado="{}">'
+            '<progress max="100" value="{}"></progress> <span class="carga-etapa">{}% {}</span></span>',
+            obj.pk, obj.estado, obj.progreso, obj.progreso, obj.etapa,
+        )
+
+    def get_urls(self):
+        urls = [
+            path("progreso/", self.admin_site.admin_view(self.progreso_view), name="mercados_archivocargamasiva_progreso"),
+        ]
+        return urls + super().get_urls()
+
+    def progreso_view(self, request):
+        """Estado actual de los trabajos pedidos (?ids=1,2,3); lo consulta el changelist cada pocos segundos."""
+        ids = [i for i in request.GET.get("ids", "").split(",") if i.isdigit()]
+        filas = ArchivoCargaMasiva.objects.filter(pk__in=ids).values(
+            "id", "estado", "progreso", "etapa", "resultado", "duracion_s",
+        )
+        return JsonResponse({"trabajos": list(filas)})
+
+    def procesar_empresas_desde_excel(self, request, queryset, forzar=False):
+        n = import_jobs.encolar(queryset, forzar=forzar)
+        omitidos = queryset.count() - n
+        if n:
+            messages.success(request, f"{n} archivo(s) encolado(s); el avance se actualiza en esta lista.")
+        if omitidos:
+            messages.warning(request, f"{omitidos} archivo(s) ya estaban en cola o procesándose.")
+
+    procesar_empresas_desde_excel.short_description = "Procesar archivo (Excel, CSV o Parquet) y cargar/actualizar empresas (en segundo plano)"
+
+    def reprocesar_forzado(self, request, queryset):
+        self.procesar_empresas_desde_excel(request, queryset, forzar=True)
+
+    reprocesar_forzado.short_description = "Reprocesar aunque el contenido ya se haya cargado"
+
+
+@admin.register(LayoutHoja)
+class LayoutHojaAdmin(admin.ModelAdmin):
+    # Borrar un layout obliga a detectar de nuevo la estructura la próxima vez que llegue ese formato
+    list_display = ("hoja", "importador", "header_row", "modo", "usos", "usado_en")
+    list_filter = ("importador", "modo")
+    search_fields = ("hoja",)
+    readonly_fields = ("huella", "creado_en", "usado_en", "usos")
+
+
+@admin.register(EventoOutbox)
+class EventoOutboxAdmin(admin.ModelAdmin):
+    # Solo lectura: los escribe la app y los publica/marca `manage.py relay_outbox`
+    list_display = ("id", "topic", "clave", "creado_en", "enviado_en", "intentos")
+    list_filter = ("topic", ("enviado_en", admin.EmptyFieldListFilter))
+    search_fields = ("clave",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(EmpresaLectura)
+class EmpresaLecturaAdmin(admin.ModelAdmin):
+    # Solo lectura: la mantiene `manage.py consumir_empresas` a partir de los eventos
+    list_display = ("ticker", "nombre", "pais_nombre", "sector", "capitalizacion", "evento_id", "actualizado_en")
+    list_filter = ("pais_codigo", "sector")
+    search_fields = ("ticker", "nombre")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TipoCambio)
+class TipoCambioAdmin(admin.ModelAdmin):
+    list_display = ("moneda", "fecha", "tasa", "fuente", "actualizado_en")
+    list_filter = ("moneda", "fuente")
+    date_hierarchy = "fecha"
+    list_per_page = 50
 
 
 @admin.register(HistorialCambio)
@@ -0,0 +1,367 @@
+# mercados/benchmark.py
+"""
+Libros sintéticos con el formato de los informes NUAM y medición de los importadores.
+
+Lo usan `manage.py generar_libros_sinteticos`, `manage.py benchmark_importacion` y
+`manage.py benchmark_eventos` (camino de eventos de Empresa, sin Kafka real).
+Cada medición corre dentro de una transacción que se revierte al final: la base queda
+igual que antes. Las de importación, además, en un proceso propio (RSS máximo limpio).
+"""
+import io
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import time
+from datetime import date
+
+from django.db import connection, transaction
+
+# Nombre de la hoja del informe mensual (la que prioriza el importador)
+SHEET_BLOQUES = "Nemo-Cap. Bur|Ticker-Market Cap"
+SHEET_PLANO = "Nemo - Market Cap"
+IMPORTADORES = ("bloques", "plano")
+MAX_FILAS_EXCEL = 1_048_576 - 20  # límite de filas de una hoja, menos títulos y encabezados
+
+_BOLSAS = (("BCS", "Chile", "CLP", 967.48), ("bvc", "Colombia", "COP", 4019.09), ("BVL", "Perú", "PEN", 3.5445))
+_SECTORES = ("Financiero", "Minería", "Energía", "Retail", "Utilities", "Industrial", "Consumo", "Inmobiliario")
+_SUFIJOS = ("S.A.", "S.A.A.", "S.A.C.", "Holding S.A.", "Inversiones S.A.")
+
+
+def _nombre(rnd, i):
+    return f"EMPRESA SINTETICA {i:07d} {rnd.choice(_SUFIJOS)}"
+
+
+def _write_only_book():
+    from openpyxl import Workbook
+    return Workbook(write_only=True)
+
+
+def generar_libro_bloques(path, filas, semilla=0):
+    """
+    Libro con el layout de tres bloques del informe (lo lee `import_empresas_from_excel`):
+    títulos arriba, encabezado de bolsa + encabezado de columnas (modo B), fila de tipo
+    de cambio y luego [Emisor] [Ticker] [Cap] por cada bolsa. `filas` se reparte entre las tres.
+    """
+    rnd = random.Random(semilla)
+    por_bolsa = -(-filas // 3)
+    if por_bolsa > MAX_FILAS_EXCEL:
+        raise ValueError(f"Demasiadas filas para el layout de bloques (máximo {3 * MAX_FILAS_EXCEL}).")
+    wb = _write_only_book()
+    ws = wb.create_sheet("Portada | Cover")
+    ws.append(["Informe Bursátil Regional (sintético)"])
+    ws = wb.create_sheet(SHEET_BLOQUES)
+    for _ in range(9):
+        ws.append([])
+    ws.append([None, "Capitalización Bursátil en millones USD | Market Capitalization in USD millions"])
+    ws.append([])
+    ws.append([None, None, None, None, "Capitalización Bursátil Total | Total Market Cap =", None, None, 0.0])
+    ws.append([])
+    ws.append([])
+    titulos, columnas, tasas = [None], [None], [None]
+    for n, (bolsa, _, _, tasa) in enumerate(_BOLSAS):
+        titulos += [None, f"Capitalización Bursátil {bolsa} | {bolsa} Market Cap =", 0.0]
+        columnas += ["Emisor | Issuer", "Nemotécnico | Ticker", "Cap. Bursatil | Market Cap. (USD)"]
+        tasas += ["Tasa de cambio oficial al cierre de mes | Month-end official exchange rate", None, tasa]
+        if n < 2:
+            titulos.append(None); columnas.append(None); tasas.append(None)
+    ws.append(titulos)
+    ws.append(columnas)
+    ws.append(tasas)
+
+    restantes = [min(por_bolsa, max(0, filas - k * por_bolsa)) for k in range(3)]
+    i = 0
+    for fila in range(max(restantes)):
+        out = [None]
+        for k, (bolsa, _, _, _) in enumerate(_BOLSAS):
+            if fila < restantes[k]:
+                out += [_nombre(rnd, i), f"{bolsa.upper()}{i:07d}", round(rnd.lognormvariate(5, 1.5), 6)]
+                i += 1
+            else:
+                out += [None, None, None]
+            if k < 2:
+                out.append(None)
+        ws.append(out)
+    wb.save(path)
+    return path
+
+
+def generar_libro_plano(path, filas, semilla=0):
+    """Libro plano, una empresa por fila con columnas ticker/nombre/país/... (lo lee `seed_empresas`)."""
+    if filas > MAX_FILAS_EXCEL:
+        raise ValueError(f"Demasiadas filas para una hoja de Excel (máximo {MAX_FILAS_EXCEL}).")
+    rnd = random.Random(semilla)
+    wb = _write_only_book()
+    ws = wb.create_sheet(SHEET_PLANO)
+    ws.append(["Empresas listadas NUAM (sintético)"])
+    ws.append([])
+    # Encabezado bilingüe en dos filas, como el informe (seed_empresas lo combina en modo B)
+    ws.append(["Nemotécnico", "Nombre Emisor", "País", "Sector", "Moneda", "Cap. Bursátil", "Fecha", "Mercado"])
+    ws.append(["Ticker", "Issuer", "Country", "Industry", "Currency", "Market Cap", "Date", "Exchange"])
+    fecha = date(2025, 8, 31)
+    for i in range(filas):
+        bolsa, pais, moneda, _ = _BOLSAS[i % 3]
+        ws.append([
+            f"{bolsa.upper()}{i:07d}", _nombre(rnd, i), pais, rnd.choice(_SECTORES), moneda,
+            round(rnd.lognormvariate(12, 2), 2), fecha, bolsa.upper(),
+        ])
+    wb.save(path)
+    return path
+
+
+GENERADORES = {"bloques": generar_libro_bloques, "plano": generar_libro_plano}
+
+
+def ruta_libro(directorio, importador, filas):
+    return os.path.join(directorio, f"nuam_{importador}_{filas}.xlsx")
+
+
+def asegurar_libro(directorio, importador, filas, semilla=0, regenerar=False):
+    """Ruta del libro sintético; se genera solo si no existe (o si se pide regenerar)."""
+    os.makedirs(directorio, exist_ok=True)
+    path = ruta_libro(directorio, importador, filas)
+    if regenerar or not os.path.exists(path):
+        GENERADORES[importador](path, filas, semilla=semilla)
+    return path
+
+
+# ------------------ medición ------------------
+
+class ContadorSQL:
+    """Cuenta las sentencias SQL ejecutadas (sin guardar el texto, a diferencia de CaptureQueriesContext)."""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+
+def peak_rss_mb():
+    """RSS máximo del proceso en MB (None si la plataforma no lo expone)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo entrega en KB, macOS en bytes
+    return round(maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _importar(importador, path, engine):
+    if importador == "bloques":
+        from .utils_import import import_empresas_from_excel
+        res = import_empresas_from_excel(path, engine=engine)
+        if not res.get("ok"):
+            raise RuntimeError(res.get("msg"))
+        return res.get("msg", "")
+    from django.core.management import call_command
+    out = io.StringIO()
+    call_command("seed_empresas", file=path, engine=engine, stdout=out, stderr=io.StringIO())
+    return out.getvalue().strip().splitlines()[-1]
+
+
+class _Revertir(Exception):
+    pass
+
+
+def medir(importador, path, filas, pasadas=2, engine=None):
+    """
+    Importa `path` `pasadas` veces (la primera crea, las siguientes miden la recarga sin cambios)
+    y devuelve una medición por pasada. Todo se revierte al terminar.
+    """
+    resultados = []
+    contador = ContadorSQL()
+    try:
+        with transaction.atomic(), connection.execute_wrapper(contador):
+            for n in range(pasadas):
+                contador.total = 0
+                t0 = time.perf_counter()
+                detalle = _importar(importador, path, engine)
+                wall = time.perf_counter() - t0
+                resultados.append({
+                    "importador": importador,
+                    "archivo": os.path.basename(path),
+                    "filas": filas,
+                    "pasada": "inicial" if n == 0 else f"recarga {n}",
+                    "wall_s": round(wall, 3),
+                    "filas_por_s": round(filas / wall, 1) if wall else None,
+                    "sql": contador.total,
+                    "peak_rss_mb": peak_rss_mb(),
+                    "detalle": detalle,
+                })
+            raise _Revertir
+    except _Revertir:
+        pass
+    return resultados
+
+
+def _medir_en_hijo(cola, importador, path, filas, pasadas, engine):
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    try:
+        cola.put(("ok", medir(importador, path, filas, pasadas=pasadas, engine=engine)))
+    except Exception as e:
+        cola.put(("error", f"{type(e).__name__}: {e}"))
+
+
+def medir_en_proceso(importador, path, filas, pasadas=2, engine=None):
+    """`medir` en un proceso nuevo, para que el RSS máximo corresponda solo a esta importación."""
+    ctx = multiprocessing.get_context("spawn")
+    cola = ctx.Queue()
+    connection.close()  # el hijo abre su propia conexión
+    p = ctx.Process(target=_medir_en_hijo, args=(cola, importador, path, filas, pasadas, engine))
+    p.start()
+    try:
+        estado, valor = esperar_resultado(cola, p)
+    finally:
+        p.join()
+    if estado != "ok":
+        raise RuntimeError(valor)
+    return valor
+
+
+def esperar_resultado(cola, proceso, poll=1.0):
+    """
+    Resultado que el hijo deja en `cola`. Si el hijo muere sin reportar (OOM killer, señal,
+    error al importar Django) no se espera para siempre: se informa su exitcode.
+    """
+    while True:
+        try:
+            return cola.get(timeout=poll)
+        except queue.Empty:
+            if proceso.is_alive():
+                continue
+        # terminó: lo que alcanzó a escribir antes de salir ya está en la cola
+        try:
+            return cola.get(timeout=poll)
+        except queue.Empty:
+            proceso.join()
+            return "error", f"El proceso de medición terminó sin resultado (exitcode {proceso.exitcode})"
+
+
+# ------------------ eventos ------------------
+
+def _percentil(valores, p):
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(p / 100 * len(orden)))] if orden else None
+
+
+def _ms(valores):
+    return {"media_ms": round(sum(valores) / len(valores) * 1000, 3),
+            "p50_ms": round(_percentil(valores, 50) * 1000, 3),
+            "p99_ms": round(_percentil(valores, 99) * 1000, 3)}
+
+
+def _filas_sinteticas(n, prefijo, semilla=0):
+    rnd = random.Random(semilla)
+    return [{
+        "ticker": f"{prefijo}{i:07d}", "nombre": _nombre(rnd, i), "pais": None,
+        "sector": rnd.choice(_SECTORES), "moneda": "USD", "capitalizacion": round(rnd.lognormvariate(12, 2), 2),
+        "mercado": _BOLSAS[i % 3][0].upper(), "fuente": "benchmark", "fecha_reporte": date(2025, 8, 31),
+    } for i in range(n)]
+
+
+def medir_eventos(saves=500, filas_bulk=10000, latencia_ms=2.0):
+    """
+    Costo del camino de eventos sin Kafka real: construir y serializar un evento, latencia que
+    el outbox agrega a cada save, costo de registrar los eventos de una carga masiva y
+    rendimiento del relay publicando en el transporte en memoria (con `latencia_ms` de
+    confirmación simulada). Todo se revierte al terminar.
+    """
+    from django.db.models.signals import post_save
+
+    from kafka_config import KAFKA_TOPIC_EMPRESAS
+    from kafka_memoria import BrokerMemoria, ProducerMemoria
+    from kafka_service import ProductorEventos
+    from . import eventos, outbox
+    from .models import Empresa, EventoOutbox
+    from .signals import enviar_evento_empresa
+    from .utils_import import upsert_empresas
+
+    resultados = []
+    try:
+        with transaction.atomic():
+            # serialización: construir el evento desde el modelo y codificarlo
+            Empresa.objects.bulk_create([Empresa(**f) for f in _filas_sinteticas(saves, "EVS")])
+            muestra = list(Empresa.objects.filter(ticker__startswith="EVS").order_by("id"))
+            t0 = time.perf_counter()
+            evs = [eventos.empresa_evento(e, False) for e in muestra]
+            construir = (time.perf_counter() - t0) / len(evs)
+            formatos = [f for f in eventos.FORMATOS if f != "msgpack" or eventos.msgpack_available()]
+            for formato in formatos:
+                t0 = time.perf_counter()
+                tamanos = [len(eventos.codificar(ev, formato)[0]) for ev in evs]
+                codificar = (time.perf_counter() - t0) / len(evs)
+                resultados.append({
+                    "escenario": f"serializacion {formato}", "eventos": len(evs),
+                    "construir_us": round(construir * 1e6, 2), "codificar_us": round(codificar * 1e6, 2),
+                    "bytes_por_evento": round(sum(tamanos) / len(tamanos), 1),
+                })
+
+            # saves individuales: la diferencia con y sin el receiver es lo que agrega el outbox
+            def cronometrar(sufijo):
+                tiempos = []
+                for e in muestra:
+                    e.nombre = f"{e.nombre[:200]} {sufijo}"
+                    t0 = time.perf_counter()
+                    e.save()
+                    tiempos.append(time.perf_counter() - t0)
+                return tiempos
+
+            post_save.disconnect(enviar_evento_empresa, sender=Empresa)
+            try:
+                sin_eventos = cronometrar("a")
+            finally:
+                post_save.connect(enviar_evento_empresa, sender=Empresa)
+            con_eventos = cronometrar("b")
+            base, total = _ms(sin_eventos), _ms(con_eventos)
+            resultados.append({
+                "escenario": "save individual", "saves": len(muestra),
+                "sin_eventos": base, "con_eventos": total,
+                "agregado_ms": round(total["media_ms"] - base["media_ms"], 3),
+            })
+
+            # carga masiva: upsert completo y, aparte, solo el registro de sus eventos
+            filas = _filas_sinteticas(filas_bulk, "EVB", semilla=1)
+            antes = EventoOutbox.objects.count()
+            t0 = time.perf_counter()
+            upsert_empresas(filas)
+            wall = time.perf_counter() - t0
+            registrados = EventoOutbox.objects.count() - antes
+            t0 = time.perf_counter()
+            outbox.registrar_tickers([f["ticker"] for f in filas], [])
+            registro = time.perf_counter() - t0
+            resultados.append({
+                "escenario": "carga masiva", "filas": filas_bulk, "eventos": registrados,
+                "wall_s": round(wall, 3), "registro_eventos_s": round(registro, 3),
+                "registro_por_evento_us": round(registro / filas_bulk * 1e6, 2),
+            })
+
+            # relay: outbox -> transporte en memoria
+            broker = BrokerMemoria()
+            productor = ProductorEventos(transporte=ProducerMemoria(broker, latencia_ack_s=latencia_ms / 1000))
+            try:
+                t0 = time.perf_counter()
+                enviados = outbox.run_relay(once=True, retener_dias=0, productor=productor)
+                wall = time.perf_counter() - t0
+            finally:
+                productor.cerrar()
+            tamanos = [len(m) for m in broker.mensajes(KAFKA_TOPIC_EMPRESAS)]
+            resultados.append({
+                "escenario": "relay (transporte memoria)", "eventos": enviados, "latencia_ack_ms": latencia_ms,
+                "wall_s": round(wall, 3), "eventos_por_s": round(enviados / wall, 1) if wall else None,
+                "bytes_por_evento": round(sum(tamanos) / len(tamanos), 1) if tamanos else None,
+            })
+            raise _Revertir
+    except _Revertir:
+        pass
+    return resultados
@@ -0,0 +1,99 @@
+# mercados/capitalizacion.py
+"""
+Capitalización de las empresas en una moneda común (USD), para comparar entre bolsas.
+
+`Empresa.capitalizacion` está en la moneda local (CLP, COP, PEN); `capitalizacion_usd` es el
+mismo valor convertido con la tasa vigente (la más reciente de TipoCambio) y se guarda
+indexado, así los rankings, percentiles y sumas regionales son una sola consulta.
+
+Se recalcula:
+- al guardar una Empresa si cambió su capitalización o su moneda (`Empresa.save`); dentro de
+  `tasas_en_lote` (y de `eventos_empresa_en_lote`) la tasa de cada moneda se lee una vez,
+- en las cargas masivas (`upsert_empresas`), con las tasas leídas una vez por carga,
+- cada vez que se escriben tasas en TipoCambio (`tipos_cambio.guardar`, que usan
+  `actualizar_tipos_cambio` e `importar_tipos_cambio`): un UPDATE por moneda.
+
+Sigue a TipoCambio (tasas diarias), no a la caché en vivo de fx_service que usan la conversión
+y el dashboard: entre dos corridas de `actualizar_tipos_cambio` el valor usa la tasa del
+último día guardado, así que el ranking puede atrasarse hasta un día respecto de las tasas
+del momento. Sin tasa para la moneda de una empresa el valor queda en NULL (va al final del ranking).
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast
+
+from .models import Empresa, TipoCambio
+
+MONEDA_COMUN = "USD"
+
+# Tasas ya leídas en el bloque `tasas_en_lote` en curso (por hilo); None fuera de un bloque
+_lote = threading.local()
+
+
+def tasas_vigentes(monedas):
+    """{moneda: tasa más reciente contra USD}; una consulta indexada por moneda (moneda, fecha)."""
+    tasas = {}
+    for moneda in {m for m in monedas if m}:
+        if moneda == MONEDA_COMUN:
+            tasas[moneda] = 1.0
+            continue
+        tasa = (TipoCambio.objects.filter(moneda=moneda).order_by("-fecha")
+                .values_list("tasa", flat=True).first())
+        if tasa:
+            tasas[moneda] = tasa
+    return tasas
+
+
+@contextmanager
+def tasas_en_lote():
+    """
+    Para código que guarda muchas Empresas una a una: dentro del bloque la tasa de cada
+    moneda se consulta la primera vez que aparece y se reutiliza en los saves siguientes.
+    """
+    if getattr(_lote, "tasas", None) is not None:
+        yield  # bloque anidado: usa las tasas del externo
+        return
+    _lote.tasas = {}
+    try:
+        yield
+    finally:
+        _lote.tasas = None
+
+
+def _tasas_para(moneda):
+    leidas = getattr(_lote, "tasas", None)
+    if leidas is None:
+        return tasas_vigentes([moneda])
+    if moneda not in leidas:
+        leidas[moneda] = tasas_vigentes([moneda]).get(moneda)  # None = sin tasa, tampoco se repite
+    return leidas
+
+
+def en_usd(capitalizacion, moneda, tasas=None):
+    """Capitalización local convertida a USD, o None si falta el monto o la tasa."""
+    if capitalizacion is None or not moneda:
+        return None
+    tasa = (tasas if tasas is not None else _tasas_para(moneda)).get(moneda)
+    return float(capitalizacion) / tasa if tasa else None
+
+
+def recalcular(monedas=None):
+    """
+    Recalcula `capitalizacion_usd` de las empresas de `monedas` (todas las que hay en
+    Empresa por defecto) con un UPDATE por moneda. Devuelve cuántas filas actualizó.
+    """
+    en_tabla = set(Empresa.objects.exclude(moneda__isnull=True).order_by()
+                   .values_list("moneda", flat=True).distinct())
+    monedas = en_tabla if monedas is None else en_tabla & {m.upper() for m in monedas}
+    tasas = tasas_vigentes(monedas)
+    total = 0
+    for moneda in sorted(monedas):
+        qs = Empresa.objects.filter(moneda=moneda)
+        if moneda in tasas:
+            valor = Cast(F("capitalizacion"), FloatField()) / Value(tasas[moneda])
+        else:
+            valor = Value(None, output_field=FloatField())
+        total += qs.update(capitalizacion_usd=valor)
+    return total
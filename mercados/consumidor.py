@@ -0,0 +1,241 @@
+# mercados/consumidor.py
+"""
+Consumidor de los eventos de Empresa que materializa el modelo de lectura (EmpresaLectura).
+
+Lo corre `manage.py consumir_empresas` dentro de un grupo de consumidores, así que se
+pueden levantar varios y Kafka reparte las particiones entre ellos. Cada vuelta:
+
+1. `consume()` trae un lote de mensajes, que se separa por partición.
+2. Las particiones se procesan en paralelo en un pool de hilos, en orden dentro de cada
+   una (la clave es el ticker, así que todos los eventos de una empresa van en orden).
+3. Los offsets se confirman a mano y solo después de escribir en la BD, partición por
+   partición. Si una partición falla, no se confirma y se vuelve a leer desde su primer
+   mensaje del lote.
+
+La escritura es idempotente: cada fila guarda el `evento_id` del último evento aplicado y
+los repetidos (reentregas, replays del outbox) o más antiguos se ignoran. Los SNAPSHOT no
+traen ese orden: no avanzan `evento_id` ni se descartan por él, y sobre una fila que ya
+recibió eventos del outbox solo completan los campos vacíos. En un
+rebalanceo no queda trabajo a medias: el lote en curso termina y se confirma antes de
+volver a llamar a `consume()`, que es donde se revocan las particiones.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from kafka_config import KAFKA_BOOTSTRAP_SERVERS, KAFKA_GRUPO_LECTURA, KAFKA_TOPIC_EMPRESAS
+from . import eventos as ev_codec
+from .models import EmpresaLectura, Pais
+
+logger = logging.getLogger(__name__)
+
+# nombre en el evento -> campo del modelo de lectura
+CAMPOS_LECTURA = {
+    "nombre": "nombre",
+    "pais": "pais_codigo",
+    "sector": "sector",
+    "moneda": "moneda",
+    "capitalizacion": "capitalizacion",
+    "mercado": "mercado",
+    "fuente": "fuente",
+    "fecha_reporte": "fecha_reporte",
+}
+UPDATE_FIELDS = ["empresa_id", *CAMPOS_LECTURA.values(), "pais_nombre", "evento_id", "actualizado_en"]
+
+# SQLite admite un solo escritor: con esa BD los hilos solo paralelizan la decodificación
+_escritura_sqlite = threading.Lock()
+
+
+def crear_consumidor(grupo=None, config=None):
+    """Consumer de confluent_kafka con confirmación manual de offsets y rebalanceo cooperativo."""
+    from confluent_kafka import Consumer
+    return Consumer({
+        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+        "group.id": grupo or KAFKA_GRUPO_LECTURA,
+        "enable.auto.commit": False,
+        "auto.offset.reset": "earliest",
+        # en un rebalanceo solo se mueven las particiones que cambian de dueño
+        "partition.assignment.strategy": "cooperative-sticky",
+        **(config or {}),
+    })
+
+
+# ------------------ aplicación al modelo de lectura ------------------
+
+def campos_evento(evento):
+    """Campos de negocio del evento. Los mensajes sin versión (anteriores al esquema 1) traen los campos sueltos."""
+    if "v" in evento:
+        return evento.get("campos") or {}
+    return {c: evento[c] for c in CAMPOS_LECTURA if c in evento}
+
+
+def _escribir(filas):
+    if connection.features.supports_update_conflicts_with_target:
+        EmpresaLectura.objects.bulk_create(
+            filas, update_conflicts=True, unique_fields=["ticker"], update_fields=UPDATE_FIELDS,
+        )
+        return
+    EmpresaLectura.objects.bulk_create([f for f in filas if f.pk is None])
+    EmpresaLectura.objects.bulk_update([f for f in filas if f.pk is not None], UPDATE_FIELDS)
+
+
+def aplicar_eventos(eventos):
+    """
+    Aplica una lista de eventos (dicts, en orden) al modelo de lectura con un upsert en bloque.
+    Los eventos delta se fusionan sobre la fila existente. Devuelve (aplicados, omitidos).
+    """
+    por_ticker = {}
+    for evento in eventos:
+        por_ticker.setdefault(evento["ticker"], []).append(evento)
+
+    actuales = {f.ticker: f for f in EmpresaLectura.objects.filter(ticker__in=list(por_ticker))}
+    paises = dict(Pais.objects.values_list("codigo", "nombre"))
+    ahora = timezone.now()
+    filas, aplicados, omitidos = [], 0, 0
+    for ticker, lista in por_ticker.items():
+        fila = actuales.get(ticker) or EmpresaLectura(ticker=ticker)
+        cambio = False
+        for evento in lista:
+            snapshot = evento.get("accion") == "SNAPSHOT"
+            evento_id = None if snapshot else evento.get("evento_id")
+            if evento_id is not None and evento_id <= fila.evento_id:
+                omitidos += 1  # ya aplicado (reentrega o replay)
+                continue
+            for campo, valor in campos_evento(evento).items():
+                if campo in CAMPOS_LECTURA:
+                    atributo = CAMPOS_LECTURA[campo]
+                    # un snapshot puede ser más viejo que los eventos ya aplicados: no los pisa
+                    if snapshot and fila.evento_id and getattr(fila, atributo) not in (None, ""):
+                        continue
+                    setattr(fila, atributo, valor)
+            fila.empresa_id = evento.get("id", fila.empresa_id)
+            if evento_id is not None:
+                fila.evento_id = evento_id
+            aplicados += 1
+            cambio = True
+        if cambio:
+            fila.pais_nombre = paises.get(fila.pais_codigo, "")
+            fila.actualizado_en = ahora  # bulk_update no aplica auto_now
+            filas.append(fila)
+
+    if filas:
+        with transaction.atomic():
+            _escribir(filas)
+    return aplicados, omitidos
+
+
+def _aplicar_particion(mensajes):
+    """Decodifica y aplica los mensajes de una partición (corre en un hilo del pool)."""
+    eventos, invalidos = [], 0
+    for msg in mensajes:
+        try:
+            eventos.append(ev_codec.decodificar(msg.value(), msg.headers()))
+        except Exception:
+            # un mensaje ilegible no debe bloquear la partición para siempre: se registra y se salta
+            invalidos += 1
+            logger.error("Evento inválido en %s[%s]@%s", msg.topic(), msg.partition(), msg.offset(), exc_info=True)
+    eventos = [e for e in eventos if isinstance(e, dict) and e.get("ticker")]
+    try:
+        if connection.vendor == "sqlite":
+            with _escritura_sqlite:
+                aplicados, omitidos = aplicar_eventos(eventos)
+        else:
+            aplicados, omitidos = aplicar_eventos(eventos)
+    finally:
+        connection.close()  # conexión propia de este hilo
+    return aplicados, omitidos, invalidos
+
+
+# ------------------ bucle del consumidor ------------------
+
+class TrabajadorLectura:
+    """Bucle de consumo: lotes por partición en paralelo y confirmación manual de offsets."""
+
+    def __init__(self, consumer, hilos=4, lote=500, poll=1.0, topics=None):
+        self.consumer = consumer
+        self.hilos = hilos
+        self.lote = lote
+        self.poll = poll
+        self.topics = topics or [KAFKA_TOPIC_EMPRESAS]
+        self.metricas = {"lotes": 0, "mensajes": 0, "aplicados": 0, "omitidos": 0,
+                         "invalidos": 0, "errores": 0, "rebalanceos": 0}
+
+    def _on_assign(self, consumer, particiones):
+        self.metricas["rebalanceos"] += 1
+        logger.info("Particiones asignadas: %s", [(p.topic, p.partition) for p in particiones])
+
+    def _on_revoke(self, consumer, particiones):
+        # el lote anterior ya se escribió y confirmó: no hay offsets pendientes que salvar
+        logger.info("Particiones revocadas: %s", [(p.topic, p.partition) for p in particiones])
+
+    def _on_lost(self, consumer, particiones):
+        logger.warning("Particiones perdidas (sesión vencida): %s", [(p.topic, p.partition) for p in particiones])
+
+    def procesar_lote(self, mensajes, pool):
+        """Procesa un lote y confirma los offsets de las particiones que se escribieron bien."""
+        from confluent_kafka import KafkaException, TopicPartition
+
+        por_particion = {}
+        for msg in mensajes:
+            if msg.error():
+                logger.warning("Error del consumidor: %s", msg.error())
+                continue
+            por_particion.setdefault((msg.topic(), msg.partition()), []).append(msg)
+
+        futuros = {tp: pool.submit(_aplicar_particion, msgs) for tp, msgs in por_particion.items()}
+        confirmar, fallidas = [], []
+        for (topic, particion), futuro in futuros.items():
+            msgs = por_particion[(topic, particion)]
+            try:
+                aplicados, omitidos, invalidos = futuro.result()
+            except Exception:
+                self.metricas["errores"] += 1
+                logger.error("No se pudo aplicar el lote de %s[%s]", topic, particion, exc_info=True)
+                fallidas.append(TopicPartition(topic, particion, msgs[0].offset()))
+                continue
+            self.metricas["aplicados"] += aplicados
+            self.metricas["omitidos"] += omitidos
+            self.metricas["invalidos"] += invalidos
+            confirmar.append(TopicPartition(topic, particion, msgs[-1].offset() + 1))
+
+        if confirmar:
+            try:
+                self.consumer.commit(offsets=confirmar, asynchronous=False)
+            except KafkaException as e:
+                # la partición cambió de dueño: el nuevo la releerá y la escritura idempotente descarta lo repetido
+                logger.warning("No se pudieron confirmar los offsets (%s); se reprocesarán", e)
+        for tp in fallidas:
+            # volver a leer la partición desde el primer mensaje del lote
+            self.consumer.seek(tp)
+
+        self.metricas["lotes"] += 1
+        self.metricas["mensajes"] += sum(len(m) for m in por_particion.values())
+        return not fallidas
+
+    def run(self, should_stop=lambda: False, once=False):
+        """
+        Consume hasta que `should_stop()` sea verdadero (o, con `once`, hasta que no lleguen
+        más mensajes). Cierra el consumer al salir, lo que entrega sus particiones al grupo.
+        """
+        self.consumer.subscribe(self.topics, on_assign=self._on_assign,
+                                on_revoke=self._on_revoke, on_lost=self._on_lost)
+        pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="lectura")
+        try:
+            while not should_stop():
+                mensajes = self.consumer.consume(num_messages=self.lote, timeout=self.poll)
+                if not mensajes:
+                    if once:
+                        break
+                    continue
+                t0 = time.perf_counter()
+                if not self.procesar_lote(mensajes, pool):
+                    time.sleep(self.poll)  # BD con problemas: no reintentar en un bucle apretado
+                logger.debug("Lote de %s mensajes en %.3f s", len(mensajes), time.perf_counter() - t0)
+        finally:
+            pool.shutdown(wait=True)
+            self.consumer.close()
+        return self.metricas
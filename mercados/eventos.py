@@ -0,0 +1,143 @@
+# mercados/eventos.py
+"""
+Codificación de los eventos de Empresa que van a Kafka.
+
+El evento se arma directo desde los atributos del modelo (sin model_to_dict ni idas y
+vueltas por JSON) y lleva la versión del esquema:
+
+    {"v": 1, "accion": "CREAR" | "EDITAR", "ticker": "...", "id": 12, "delta": false,
+     "campos": {"nombre": ..., "pais": "CHL", "capitalizacion": "243.04", ...}}
+
+Con `delta` (NUAM_EVENTOS_DELTA) una edición trae en `campos` solo lo que cambió.
+Se serializa como JSON compacto o msgpack (NUAM_EVENTOS_FORMATO, msgpack es opcional);
+el formato y la versión viajan también en los headers del mensaje. La clave es el ticker.
+"""
+import importlib.util
+import json
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+SCHEMA_VERSION = 1
+FORMATOS = ("json", "msgpack")
+
+# Campos de negocio en el evento (attname en el modelo -> nombre en el evento)
+CAMPOS = {
+    "nombre": "nombre",
+    "pais_id": "pais",
+    "sector": "sector",
+    "moneda": "moneda",
+    "capitalizacion": "capitalizacion",
+    "mercado": "mercado",
+    "fuente": "fuente",
+    "fecha_reporte": "fecha_reporte",
+}
+
+_CENTAVOS = Decimal("0.01")
+
+
+def msgpack_available():
+    return importlib.util.find_spec("msgpack") is not None
+
+
+def formato_eventos(formato=None):
+    formato = (formato or getattr(settings, "NUAM_EVENTOS_FORMATO", "json")).lower()
+    if formato not in FORMATOS:
+        raise ImproperlyConfigured(f"Formato de eventos desconocido: {formato} (opciones: {', '.join(FORMATOS)})")
+    if formato == "msgpack" and not msgpack_available():
+        raise ImproperlyConfigured("NUAM_EVENTOS_FORMATO=msgpack requiere el paquete msgpack (pip install msgpack).")
+    return formato
+
+
+def delta_activo():
+    return getattr(settings, "NUAM_EVENTOS_DELTA", False)
+
+
+def valor_evento(campo, v):
+    """Valor tal como va en el evento: capitalización como texto con 2 decimales, fechas ISO, país por código."""
+    if v is None:
+        return None
+    if campo == "capitalizacion":
+        return str(Decimal(str(v)).quantize(_CENTAVOS))
+    if campo == "pais":
+        return getattr(v, "pk", v)
+    if isinstance(v, date):
+        return v.isoformat()
+    return v
+
+
+def valores_empresa(empresa):
+    return {campo: valor_evento(campo, getattr(empresa, attname)) for attname, campo in CAMPOS.items()}
+
+
+def valores_cargados(empresa):
+    """Valores de la Empresa al leerla de la BD (ver Empresa.from_db), o None si no se conocen."""
+    db = getattr(empresa, "_valores_db", None)
+    if db is None or any(attname not in db for attname in CAMPOS):
+        return None
+    return {campo: valor_evento(campo, db[attname]) for attname, campo in CAMPOS.items()}
+
+
+def empresa_evento(empresa, creada, anteriores=None, delta=None):
+    """
+    Evento de una Empresa recién creada o editada. `anteriores` son los valores previos
+    (nombres de evento, p.ej. de `valores_cargados`); si se conocen y delta está activo,
+    una edición lleva solo los campos cambiados.
+    """
+    delta = delta_activo() if delta is None else delta
+    campos = valores_empresa(empresa)
+    es_delta = bool(delta and not creada and anteriores is not None)
+    if es_delta:
+        anteriores = {c: valor_evento(c, v) for c, v in anteriores.items()}
+        campos = {c: v for c, v in campos.items() if anteriores.get(c, v) != v or c not in anteriores}
+    return {
+        "v": SCHEMA_VERSION,
+        "accion": "CREAR" if creada else "EDITAR",
+        "ticker": empresa.ticker,
+        "id": empresa.pk,
+        "delta": es_delta,
+        "campos": campos,
+    }
+
+
+def fusionar(anterior, nuevo):
+    """
+    Un solo evento con el estado de dos eventos seguidos del mismo ticker (ver la ventana de
+    coalescencia del relay). El resultado trae el último `evento_id` y en `cambios` cuántos
+    eventos resume. Si `anterior` era completo, sigue siéndolo aunque `nuevo` sea delta.
+    """
+    cambios = anterior.get("cambios", 1) + nuevo.get("cambios", 1)
+    if "v" not in anterior or "v" not in nuevo or not nuevo.get("delta"):
+        fusion = dict(nuevo)
+    else:
+        fusion = {**nuevo, "delta": anterior.get("delta", False),
+                  "campos": {**anterior.get("campos", {}), **nuevo.get("campos", {})}}
+    if anterior.get("accion") == "CREAR":
+        fusion["accion"] = "CREAR"
+    fusion["cambios"] = cambios
+    return fusion
+
+
+def codificar(evento, formato=None):
+    """Evento -> (bytes, headers) en el formato configurado."""
+    formato = formato_eventos(formato)
+    if formato == "msgpack":
+        import msgpack
+        value = msgpack.packb(evento, use_bin_type=True)
+    else:
+        value = json.dumps(evento, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    headers = [("schema", str(evento.get("v", SCHEMA_VERSION)).encode()), ("formato", formato.encode())]
+    return value, headers
+
+
+def decodificar(value, headers=None):
+    """Inverso de `codificar`. Sin headers asume JSON (mensajes anteriores a la versión 1)."""
+    formato = dict(headers or []).get("formato", b"json")
+    if isinstance(formato, bytes):
+        formato = formato.decode()
+    if formato == "msgpack":
+        import msgpack
+        return msgpack.unpackb(value, raw=False)
+    return json.loads(value)
@@ -0,0 +1,375 @@
+# mercados/import_jobs.py
+"""
+Cola de procesamiento de ArchivoCargaMasiva respaldada en la base de datos.
+
+El admin solo encola (estado EN_COLA); los workers de `manage.py procesar_cargas`
+toman trabajos uno a uno con bloqueo de fila, ejecutan el importador y van
+reportando progreso en el mismo registro. Con `run_writer` la lectura de los Excel
+se reparte en un pool de procesos y un único proceso escribe en la BD.
+
+Mientras un worker tiene trabajos tomados, un hilo (`Latido`) renueva `latido_en` cada
+NUAM_CARGAS_LATIDO_S segundos: `reencolar_colgados` solo devuelve a la cola los trabajos
+cuyo worker dejó de latir, aunque el importador lleve mucho rato en una misma etapa. Cada
+worker en marcha lo revisa cada NUAM_CARGAS_REVISAR_S (`Reencolador`), así el trabajo de un
+worker caído vuelve a la cola sin esperar a que alguien reinicie un worker.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ArchivoCargaMasiva
+from .utils_import import es_tabular, importar_archivo, parse_excel, parse_pool, write_parsed
+
+logger = logging.getLogger(__name__)
+
+
+def worker_id(n=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{n}"
+
+
+def encolar(queryset, forzar=False):
+    """
+    Deja en cola los archivos que no estén siendo procesados. Devuelve cuántos se encolaron.
+    Con `forzar` se procesan aunque su contenido sea idéntico a una carga anterior.
+    """
+    return (
+        queryset.exclude(estado__in=[ArchivoCargaMasiva.EN_COLA, ArchivoCargaMasiva.PROCESANDO])
+        .update(
+            forzar=forzar,
+            estado=ArchivoCargaMasiva.EN_COLA,
+            progreso=0,
+            etapa="En cola",
+            encolado_en=timezone.now(),
+            iniciado_en=None,
+            finalizado_en=None,
+            duracion_s=None,
+            worker="",
+            intentos=0,
+        )
+    )
+
+
+def reencolar_colgados(minutos, max_intentos=None):
+    """
+    Devuelve a la cola los trabajos PROCESANDO cuyo worker no late hace `minutos`
+    (worker caído o matado a mitad de un archivo). Los que ya se intentaron `max_intentos`
+    veces (NUAM_CARGAS_MAX_INTENTOS) quedan en ERROR: un archivo que tumba al worker no
+    vuelve a la cola para siempre. Devuelve (reencolados, descartados).
+    """
+    if max_intentos is None:
+        max_intentos = getattr(settings, "NUAM_CARGAS_MAX_INTENTOS", 3)
+    ahora = timezone.now()
+    limite = ahora - timedelta(minutes=minutos)
+    colgados = ArchivoCargaMasiva.objects.filter(
+        Q(latido_en__lt=limite) | Q(latido_en__isnull=True, actualizado_en__lt=limite),  # sin latido: tomados antes de existir
+        estado=ArchivoCargaMasiva.PROCESANDO,
+    )
+    descartados = colgados.filter(intentos__gte=max_intentos).update(
+        estado=ArchivoCargaMasiva.ERROR,
+        etapa="Con errores",
+        resultado=f"Abandonado tras {max_intentos} intentos sin terminar (el worker se detuvo procesándolo).",
+        finalizado_en=ahora,
+        actualizado_en=ahora,
+    )
+    reencolados = colgados.update(estado=ArchivoCargaMasiva.EN_COLA, etapa="Reencolado (worker sin respuesta)")
+    return reencolados, descartados
+
+
+def tomar_siguiente(worker):
+    """
+    Toma el trabajo más antiguo en cola. Usa SELECT ... FOR UPDATE SKIP LOCKED cuando el
+    motor lo soporta y, en todo caso, un UPDATE condicional sobre el estado, de modo que
+    dos workers nunca procesan el mismo archivo (también en SQLite).
+    """
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    while True:
+        # Sin SKIP LOCKED (SQLite) no abrimos transacción: el UPDATE condicional ya es atómico
+        # y una transacción de lectura que luego escribe falla con "database is locked".
+        with transaction.atomic() if skip_locked else nullcontext():
+            qs = ArchivoCargaMasiva.objects.filter(estado=ArchivoCargaMasiva.EN_COLA).order_by("encolado_en", "id")
+            if skip_locked:
+                qs = qs.select_for_update(skip_locked=True)
+            obj = qs.first()
+            if obj is None:
+                return None
+            ahora = timezone.now()
+            tomado = ArchivoCargaMasiva.objects.filter(pk=obj.pk, estado=ArchivoCargaMasiva.EN_COLA).update(
+                estado=ArchivoCargaMasiva.PROCESANDO,
+                worker=worker,
+                progreso=0,
+                etapa="Iniciando",
+                intentos=F("intentos") + 1,
+                iniciado_en=ahora,
+                actualizado_en=ahora,
+                latido_en=ahora,
+            )
+        if tomado:
+            obj.refresh_from_db()
+            return obj
+        # otro worker lo tomó entre la lectura y el UPDATE: probar con el siguiente
+
+
+class Latido:
+    """
+    Hilo que cada `intervalo` segundos marca como vivos (`latido_en`) los trabajos PROCESANDO
+    de este worker, con su propia conexión. Es independiente del progreso: una etapa larga
+    (un libro enorme, la escritura) no hace parecer colgado al trabajo.
+    """
+
+    def __init__(self, worker, intervalo=None):
+        self.worker = worker
+        self.intervalo = intervalo or getattr(settings, "NUAM_CARGAS_LATIDO_S", 30)
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._latir, name=f"latido-{worker}", daemon=True)
+
+    def _latir(self):
+        try:
+            while not self._fin.wait(self.intervalo):
+                try:
+                    ArchivoCargaMasiva.objects.filter(
+                        estado=ArchivoCargaMasiva.PROCESANDO, worker=self.worker,
+                    ).update(latido_en=timezone.now())
+                except DatabaseError:
+                    # SQLite ocupado por la escritura del importador: se reintenta en el próximo latido
+                    logger.debug("[%s] no se pudo registrar el latido", self.worker, exc_info=True)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+        self._hilo.join()
+
+
+class Reencolador:
+    """
+    `reencolar_colgados(minutos)` a lo sumo cada `cada_s` segundos, llamado desde el bucle de
+    un worker. La primera revisión es tras `cada_s`: al arrancar ya la hace `procesar_cargas`.
+    """
+
+    def __init__(self, worker, minutos, cada_s=None):
+        self.worker = worker
+        self.minutos = minutos
+        self.cada_s = getattr(settings, "NUAM_CARGAS_REVISAR_S", 60) if cada_s is None else cada_s
+        self._proxima = time.monotonic() + self.cada_s
+
+    def __call__(self):
+        if not self.minutos or time.monotonic() < self._proxima:
+            return
+        self._proxima = time.monotonic() + self.cada_s
+        try:
+            reencolados, descartados = reencolar_colgados(self.minutos)
+        except DatabaseError:
+            logger.warning("[%s] no se pudieron revisar los trabajos colgados", self.worker, exc_info=True)
+            return
+        if reencolados or descartados:
+            logger.warning("[%s] reencolados %s trabajos sin latido; %s superaron el máximo de intentos",
+                           self.worker, reencolados, descartados)
+
+
+class ProgressReporter:
+    """
+    Callback `progress(pct, etapa)` para el importador.
+
+    La escritura la hace un hilo propio, que en Django tiene su propia conexión: así el
+    avance se ve desde el admin aunque el importador esté dentro de su transacción.
+    Se escribe como máximo cada `intervalo` segundos y siempre el último valor recibido.
+    """
+
+    def __init__(self, pk, intervalo=0.5):
+        self.pk = pk
+        self.intervalo = intervalo
+        self._ultimo = None
+        self._lock = threading.Lock()
+        self._hay_dato = threading.Event()
+        self._fin = False
+        self._hilo = threading.Thread(target=self._escribir, name=f"progreso-carga-{pk}", daemon=True)
+        self._hilo.start()
+
+    def __call__(self, pct, etapa):
+        with self._lock:
+            self._ultimo = (max(0, min(100, int(pct))), etapa[:200])
+        self._hay_dato.set()
+
+    def _escribir(self):
+        try:
+            while True:
+                self._hay_dato.wait()
+                with self._lock:
+                    dato, self._ultimo = self._ultimo, None
+                    self._hay_dato.clear()
+                    fin = self._fin
+                if dato is not None:
+                    pct, etapa = dato
+                    try:
+                        ArchivoCargaMasiva.objects.filter(pk=self.pk).update(
+                            progreso=pct, etapa=etapa, actualizado_en=timezone.now(),
+                        )
+                    except DatabaseError:
+                        # p.ej. SQLite bloqueado por la transacción del importador: se reintenta con el próximo dato
+                        logger.debug("No se pudo guardar el progreso de la carga %s", self.pk, exc_info=True)
+                if fin:
+                    return
+                time.sleep(self.intervalo)
+        finally:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            self._fin = True
+        self._hay_dato.set()
+        self._hilo.join()
+
+
+def carga_identica(obj):
+    """Otra carga ya procesada con exactamente el mismo contenido, o None."""
+    if not obj.hash_contenido:
+        try:
+            obj.hash_contenido = obj.calcular_hash()
+        except Exception:
+            return None  # sin archivo legible: que el importador reporte el error
+        ArchivoCargaMasiva.objects.filter(pk=obj.pk).update(hash_contenido=obj.hash_contenido)
+    return (
+        ArchivoCargaMasiva.objects.filter(hash_contenido=obj.hash_contenido, estado=ArchivoCargaMasiva.OK)
+        .exclude(pk=obj.pk).order_by("-finalizado_en").first()
+    )
+
+
+def resultado_si_identica(obj):
+    """Resultado final si el contenido ya se cargó antes (y no se pidió forzar), o None."""
+    previa = None if obj.forzar else carga_identica(obj)
+    if previa is None:
+        return None
+    return {"ok": True, "msg": f"Contenido idéntico a la carga #{previa.pk} ({previa.archivo.name}); no se reprocesa."}
+
+
+def finalizar(obj, res, t0):
+    """Deja el resultado del importador en la fila del trabajo."""
+    ok = bool(res.get("ok"))
+    ArchivoCargaMasiva.objects.filter(pk=obj.pk).update(
+        estado=ArchivoCargaMasiva.OK if ok else ArchivoCargaMasiva.ERROR,
+        procesado=ok,
+        resultado=res.get("msg", ""),
+        progreso=100 if ok else F("progreso"),
+        etapa="Terminado" if ok else "Con errores",
+        finalizado_en=timezone.now(),
+        actualizado_en=timezone.now(),
+        duracion_s=round(time.monotonic() - t0, 3),
+        forzar=False,
+    )
+    return res
+
+
+def _ejecutar(obj, importar):
+    reporter = ProgressReporter(obj.pk)
+    try:
+        return importar(reporter)
+    except Exception as e:
+        logger.error("Fallo procesando carga %s", obj.pk, exc_info=True)
+        return {"ok": False, "msg": f"Error inesperado: {e}"}
+    finally:
+        reporter.close()
+
+
+def procesar(obj):
+    """Ejecuta el importador para un trabajo ya tomado y deja el resultado en la fila."""
+    t0 = time.monotonic()
+    res = resultado_si_identica(obj)
+    if res is None:
+        res = _ejecutar(obj, lambda progress: importar_archivo(obj.archivo.path, progress=progress))
+    return finalizar(obj, res, t0)
+
+
+def run_worker(n=0, poll=2.0, once=False, should_stop=lambda: False, reencolar_tras=0):
+    """
+    Bucle de un worker: toma trabajos hasta que no queden (si `once`) o hasta que
+    `should_stop()` sea verdadero. Con `reencolar_tras` (minutos) revisa además los trabajos
+    de workers caídos (ver Reencolador). Devuelve cuántos archivos procesó.
+    """
+    wid = worker_id(n)
+    revisar = Reencolador(wid, reencolar_tras)
+    hechos = 0
+    with Latido(wid):
+        while not should_stop():
+            revisar()
+            try:
+                obj = tomar_siguiente(wid)
+            except DatabaseError:
+                # base ocupada (p.ej. SQLite con otro worker escribiendo): reintentar en el próximo ciclo
+                logger.warning("[%s] no se pudo tomar trabajo de la cola", wid, exc_info=True)
+                time.sleep(poll)
+                continue
+            if obj is None:
+                if once:
+                    break
+                time.sleep(poll)
+                continue
+            logger.info("[%s] procesando carga %s (%s)", wid, obj.pk, obj.archivo.name)
+            res = procesar(obj)
+            logger.info("[%s] carga %s: %s", wid, obj.pk, res.get("msg"))
+            hechos += 1
+    return hechos
+
+
+def run_writer(lectores, poll=2.0, once=False, should_stop=lambda: False, reencolar_tras=0):
+    """
+    Un único proceso escritor con `lectores` procesos de lectura: cada Excel se parsea en un
+    proceso del pool y vuelve como filas compactas; aquí se escriben de a un archivo, en el orden
+    de la cola, para que en una carga de varios informes históricos gane el más reciente igual
+    que en el modo secuencial. CSV/Parquet se importan aquí mismo (ya leen y escriben por lotes).
+    `reencolar_tras` como en run_worker. Devuelve cuántos archivos procesó.
+    """
+    wid = worker_id()
+    revisar = Reencolador(wid, reencolar_tras)
+    hechos = 0
+    en_vuelo = deque()  # (obj, t0, resultado final | futuro del parseo | None = streaming)
+    with Latido(wid), parse_pool(lectores) as pool:
+        while True:
+            revisar()
+            # Mantener ocupados a los lectores: hasta dos archivos por proceso en vuelo
+            while not should_stop() and len(en_vuelo) < 2 * lectores:
+                try:
+                    obj = tomar_siguiente(wid)
+                except DatabaseError:
+                    logger.warning("[%s] no se pudo tomar trabajo de la cola", wid, exc_info=True)
+                    break
+                if obj is None:
+                    break
+                t0 = time.monotonic()
+                res = resultado_si_identica(obj)
+                if res is None and not es_tabular(obj.archivo.path):
+                    res = pool.submit(parse_excel, obj.archivo.path)
+                    ArchivoCargaMasiva.objects.filter(pk=obj.pk).update(
+                        progreso=5, etapa="Leyendo en proceso paralelo", actualizado_en=timezone.now(),
+                    )
+                en_vuelo.append((obj, t0, res))
+
+            if not en_vuelo:
+                if once or should_stop():
+                    break
+                time.sleep(poll)
+                continue
+
+            obj, t0, res = en_vuelo.popleft()
+            if res is None:
+                res = _ejecutar(obj, lambda progress: importar_archivo(obj.archivo.path, progress=progress))
+            elif not isinstance(res, dict):
+                futuro = res
+                res = _ejecutar(obj, lambda progress: write_parsed(futuro.result(), progress=progress))
+            finalizar(obj, res, t0)
+            logger.info("[%s] carga %s: %s", wid, obj.pk, res.get("msg"))
+            hechos += 1
+    return hechos
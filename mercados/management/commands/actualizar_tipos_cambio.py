@@ -0,0 +1,25 @@
+import requests
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mercados import tipos_cambio
+
+
+class Command(BaseCommand):
+    help = ("Guarda las tasas del día en TipoCambio desde el proveedor configurado (NUAM_FX_PROVEEDOR). "
+            "Pensado para correr una vez al día (cron / Programador de tareas).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--proveedor", choices=sorted(tipos_cambio.PROVEEDORES), default=None,
+                            help="api (FX_URL) o archivo (CSV/JSON local). Por defecto NUAM_FX_PROVEEDOR.")
+        parser.add_argument("--archivo", default=None, help="Ruta del CSV/JSON para el proveedor 'archivo'.")
+        parser.add_argument("--monedas", default="", help="Monedas a guardar separadas por coma (todas por defecto).")
+
+    def handle(self, *args, **opts):
+        monedas = [m for m in opts["monedas"].split(",") if m]
+        try:
+            filas = tipos_cambio.obtener(opts["proveedor"], archivo=opts["archivo"])
+            n = tipos_cambio.guardar(filas, fuente=opts["proveedor"] or "programado", monedas=monedas)
+        except (OSError, ValueError, requests.RequestException) as e:
+            raise CommandError(f"No se pudieron obtener los tipos de cambio: {e}")
+        self.stdout.write(self.style.SUCCESS(f"💱 Tipos de cambio guardados: {n} (capitalización en USD recalculada)"))
@@ -0,0 +1,44 @@
+import json
+import platform
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from mercados import benchmark
+from mercados.eventos import formato_eventos
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el camino de eventos de Empresa (save -> outbox -> relay) con el transporte de Kafka "
+        "en memoria: eventos/s, latencia agregada por save, bytes por evento y tiempo de serialización. "
+        "Los cambios en la base se revierten."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--saves", type=int, default=500, help="Saves individuales a medir.")
+        parser.add_argument("--filas", type=int, default=10000, help="Filas de la carga masiva.")
+        parser.add_argument("--latencia-ms", type=float, default=2.0,
+                            help="Latencia de confirmación simulada del broker en memoria.")
+        parser.add_argument("--salida", default=None, help="Además de imprimirlo, guardar el JSON en este archivo.")
+
+    def handle(self, *args, **opts):
+        self.stderr.write("⏱️  Midiendo eventos...")
+        resultados = benchmark.medir_eventos(
+            saves=max(1, opts["saves"]), filas_bulk=max(1, opts["filas"]), latencia_ms=opts["latencia_ms"],
+        )
+        reporte = {
+            "fecha": timezone.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "plataforma": platform.platform(),
+            "db": connection.vendor,
+            "formato_relay": formato_eventos(),
+            "resultados": resultados,
+        }
+        texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if opts["salida"]:
+            with open(opts["salida"], "w", encoding="utf-8") as fh:
+                fh.write(texto + "\n")
+        self.stdout.write(texto)
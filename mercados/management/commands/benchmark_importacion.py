@@ -0,0 +1,58 @@
+import json
+import platform
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from mercados import benchmark
+from mercados.utils_import import EXCEL_ENGINES, resolve_engine
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide los importadores de empresas sobre libros sintéticos y entrega JSON con filas/s, "
+        "RSS máximo, tiempo y cantidad de consultas SQL. Los cambios en la base se revierten."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--filas", type=int, nargs="+", default=[1000, 10000],
+                            help="Tamaños a medir (se generan en --dir si no existen).")
+        parser.add_argument("--importador", choices=benchmark.IMPORTADORES, nargs="+", default=list(benchmark.IMPORTADORES))
+        parser.add_argument("--pasadas", type=int, default=2,
+                            help="Importaciones por archivo: la primera crea, las siguientes miden la recarga sin cambios.")
+        parser.add_argument("--engine", choices=EXCEL_ENGINES, default=None)
+        parser.add_argument("--dir", default="bench", help="Carpeta de los libros sintéticos.")
+        parser.add_argument("--salida", default=None, help="Además de imprimirlo, guardar el JSON en este archivo.")
+        parser.add_argument("--en-proceso", action="store_true",
+                            help="Medir en el mismo proceso (más rápido; el RSS máximo queda acumulado).")
+
+    def handle(self, *args, **opts):
+        medir = benchmark.medir if opts["en_proceso"] else benchmark.medir_en_proceso
+        resultados = []
+        for filas in opts["filas"]:
+            for importador in opts["importador"]:
+                try:
+                    path = benchmark.asegurar_libro(opts["dir"], importador, filas)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stderr.write(f"⏱️  {importador} {filas} filas...")
+                try:
+                    resultados += medir(importador, path, filas, pasadas=max(1, opts["pasadas"]), engine=opts["engine"])
+                except RuntimeError as e:
+                    raise CommandError(f"{importador} {filas} filas: {e}")
+
+        reporte = {
+            "fecha": timezone.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "plataforma": platform.platform(),
+            "db": connection.vendor,
+            "engine": resolve_engine(opts["engine"]),
+            "resultados": resultados,
+        }
+        texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+        if opts["salida"]:
+            with open(opts["salida"], "w", encoding="utf-8") as fh:
+                fh.write(texto + "\n")
+        self.stdout.write(texto)
@@ -0,0 +1,39 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from mercados.consumidor import TrabajadorLectura, crear_consumidor
+
+_detener = False
+
+
+def _pedir_detencion(signum, frame):
+    global _detener
+    _detener = True
+
+
+class Command(BaseCommand):
+    help = ("Consume los eventos de Empresa de Kafka y mantiene el modelo de lectura (EmpresaLectura). "
+            "Se pueden correr varios en el mismo grupo: Kafka reparte las particiones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grupo", default=None, help="group.id del consumidor (KAFKA_GRUPO_LECTURA por defecto).")
+        parser.add_argument("--hilos", type=int, default=4, help="Particiones procesadas en paralelo.")
+        parser.add_argument("--lote", type=int, default=500, help="Mensajes por consume().")
+        parser.add_argument("--poll", type=float, default=1.0, help="Segundos de espera por mensajes.")
+        parser.add_argument("--once", action="store_true", help="Terminar cuando no lleguen más mensajes.")
+
+    def handle(self, *args, **opts):
+        signal.signal(signal.SIGTERM, _pedir_detencion)
+        trabajador = TrabajadorLectura(
+            crear_consumidor(opts["grupo"]), hilos=opts["hilos"], lote=opts["lote"], poll=opts["poll"],
+        )
+        self.stdout.write(self.style.NOTICE("📥 Consumidor de eventos de Empresa iniciado..."))
+        try:
+            m = trabajador.run(should_stop=lambda: _detener, once=opts["once"])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"✔️ Mensajes: {m['mensajes']} | aplicados: {m['aplicados']} | repetidos: {m['omitidos']} "
+            f"| inválidos: {m['invalidos']} | errores: {m['errores']}"
+        ))
@@ -0,0 +1,31 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mercados import benchmark
+
+
+class Command(BaseCommand):
+    help = "Genera libros Excel sintéticos con el formato NUAM (bloques BCS/BVC/BVL y/o plano) para pruebas de carga."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--filas", type=int, nargs="+", default=[1000],
+                            help="Cantidad de empresas por libro (p.ej. 1000 100000 1000000).")
+        parser.add_argument("--layout", choices=benchmark.IMPORTADORES + ("ambos",), default="ambos")
+        parser.add_argument("--dir", default="bench", help="Carpeta de salida.")
+        parser.add_argument("--semilla", type=int, default=0)
+
+    def handle(self, *args, **opts):
+        layouts = benchmark.IMPORTADORES if opts["layout"] == "ambos" else (opts["layout"],)
+        for filas in opts["filas"]:
+            for layout in layouts:
+                t0 = time.perf_counter()
+                try:
+                    path = benchmark.asegurar_libro(opts["dir"], layout, filas, semilla=opts["semilla"], regenerar=True)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                mb = os.path.getsize(path) / 2**20
+                self.stdout.write(self.style.SUCCESS(
+                    f"📄 {path} ({layout}, {filas} filas, {mb:.1f} MB) en {time.perf_counter() - t0:.1f} s"
+                ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mercados import tipos_cambio
+
+
+class Command(BaseCommand):
+    help = ("Carga histórico de tipos de cambio desde un CSV (fecha,moneda,tasa) o JSON. "
+            "Escribe por lotes y se puede repetir: los días ya cargados se actualizan.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo", help="Ruta del CSV o JSON.")
+        parser.add_argument("--lote", type=int, default=5000, help="Filas por INSERT.")
+        parser.add_argument("--monedas", default="", help="Monedas a importar separadas por coma (todas por defecto).")
+        parser.add_argument("--fuente", default="importacion", help="Texto guardado en TipoCambio.fuente.")
+
+    def handle(self, *args, **opts):
+        monedas = [m for m in opts["monedas"].split(",") if m]
+        t0 = time.perf_counter()
+        try:
+            n = tipos_cambio.guardar(tipos_cambio.leer_archivo(opts["archivo"]), fuente=opts["fuente"],
+                                     monedas=monedas, lote=opts["lote"])
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"No se pudo importar {opts['archivo']}: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"📥 Tipos de cambio importados: {n} en {time.perf_counter() - t0:.2f} s (capitalización en USD recalculada)"
+        ))
@@ -0,0 +1,91 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+def _worker(n, poll, once, detener, reencolar_tras):
+    # Con start method "spawn" el hijo parte sin Django configurado
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # el padre coordina la detención
+    from mercados import import_jobs  # importa modelos: solo después de django.setup()
+    import_jobs.run_worker(n=n, poll=poll, once=once, should_stop=detener.is_set, reencolar_tras=reencolar_tras)
+
+
+class Command(BaseCommand):
+    help = "Procesa en segundo plano los ArchivoCargaMasiva encolados desde el admin."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Cantidad de procesos worker concurrentes.")
+        parser.add_argument("--poll", type=float, default=2.0, help="Segundos de espera cuando la cola está vacía.")
+        parser.add_argument("--once", action="store_true", help="Procesar lo pendiente y terminar.")
+        parser.add_argument("--reencolar-tras", type=int, default=30,
+                            help="Minutos sin latido del worker tras los cuales un trabajo PROCESANDO vuelve a la cola "
+                                 "(0 = no). Tras NUAM_CARGAS_MAX_INTENTOS intentos queda en error.")
+        parser.add_argument("--lectores", type=int, default=0,
+                            help="Procesos que parsean los Excel en paralelo mientras este proceso es el único "
+                                 "que escribe en la BD (0 = cada worker lee y escribe).")
+
+    def handle(self, *args, **opts):
+        from mercados import import_jobs
+        workers = max(1, opts["workers"])
+
+        if opts["reencolar_tras"]:
+            n, descartados = import_jobs.reencolar_colgados(opts["reencolar_tras"])
+            if n:
+                self.stdout.write(self.style.WARNING(f"⚙️  Reencolados {n} trabajos sin respuesta del worker"))
+            if descartados:
+                self.stdout.write(self.style.ERROR(f"⛔ {descartados} trabajos superaron el máximo de intentos"))
+
+        if opts["lectores"] and workers > 1:
+            raise CommandError("--lectores usa un único proceso escritor: no se combina con --workers.")
+
+        # El Event se crea aquí y viaja como argumento: con "spawn" los hijos no comparten globales del padre
+        detener = multiprocessing.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: detener.set())
+
+        if opts["lectores"]:
+            self.stdout.write(self.style.NOTICE(
+                f"🛠️  Iniciando escritor de cargas masivas con {opts['lectores']} proceso(s) de lectura..."
+            ))
+            try:
+                hechos = import_jobs.run_writer(opts["lectores"], poll=opts["poll"], once=opts["once"],
+                                                should_stop=detener.is_set, reencolar_tras=opts["reencolar_tras"])
+            except KeyboardInterrupt:
+                return
+            self.stdout.write(self.style.SUCCESS(f"✔️ Archivos procesados: {hechos}"))
+            return
+
+        self.stdout.write(self.style.NOTICE(f"🛠️  Iniciando {workers} worker(s) de cargas masivas..."))
+
+        if workers == 1:
+            try:
+                hechos = import_jobs.run_worker(poll=opts["poll"], once=opts["once"], should_stop=detener.is_set,
+                                                reencolar_tras=opts["reencolar_tras"])
+            except KeyboardInterrupt:
+                return
+            self.stdout.write(self.style.SUCCESS(f"✔️ Archivos procesados: {hechos}"))
+            return
+
+        # Cada proceso abre su propia conexión: no heredar la del padre
+        connections.close_all()
+        procesos = [
+            multiprocessing.Process(target=_worker, args=(i, opts["poll"], opts["once"], detener,
+                                                          opts["reencolar_tras"]),
+                                    name=f"carga-worker-{i}")
+            for i in range(workers)
+        ]
+        for p in procesos:
+            p.start()
+        try:
+            for p in procesos:
+                p.join()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Deteniendo workers (terminan el archivo en curso)..."))
+            detener.set()
+            for p in procesos:
+                p.join()
+        self.stdout.write(self.style.SUCCESS("✔️ Workers detenidos"))
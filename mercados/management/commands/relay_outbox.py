@@ -0,0 +1,54 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mercados import outbox
+
+_detener = False
+
+
+def _pedir_detencion(signum, frame):
+    global _detener
+    _detener = True
+
+
+class Command(BaseCommand):
+    help = "Publica en Kafka los eventos del outbox (EventoOutbox). Se pueden correr varios relays a la vez."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=1000, help="Eventos por lote (un flush por lote).")
+        parser.add_argument("--poll", type=float, default=1.0, help="Segundos de espera cuando no hay eventos.")
+        parser.add_argument("--once", action="store_true", help="Publicar lo pendiente y terminar.")
+        parser.add_argument("--lease", type=int, default=60,
+                            help="Segundos tras los cuales un lote reclamado y no confirmado vuelve a estar libre.")
+        parser.add_argument("--retener-dias", type=int, default=7,
+                            help="Días que se conservan los eventos enviados (0 = no podar).")
+        parser.add_argument("--ventana", type=float, default=None,
+                            help="Segundos para fusionar eventos seguidos de un mismo ticker (NUAM_EVENTOS_VENTANA_S; 0 = no).")
+        parser.add_argument("--buffer-max", type=int, default=None,
+                            help="Máximo de tickers retenidos en la ventana (NUAM_EVENTOS_BUFFER_MAX).")
+        parser.add_argument("--reenviar-desde", type=int, default=None,
+                            help="Marcar como pendientes los eventos desde este id antes de empezar (replay).")
+
+    def handle(self, *args, **opts):
+        if opts["reenviar_desde"] is not None:
+            n = outbox.reenviar_desde(opts["reenviar_desde"])
+            self.stdout.write(self.style.WARNING(f"🔁 {n} eventos marcados para reenviar desde #{opts['reenviar_desde']}"))
+
+        signal.signal(signal.SIGTERM, _pedir_detencion)
+        self.stdout.write(self.style.NOTICE("📤 Relay de outbox iniciado..."))
+        metricas = {}
+        try:
+            total = outbox.run_relay(
+                lote=opts["lote"], poll=opts["poll"], once=opts["once"], lease_s=opts["lease"],
+                retener_dias=opts["retener_dias"], should_stop=lambda: _detener,
+                ventana_s=opts["ventana"], buffer_max=opts["buffer_max"], metricas=metricas,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"✔️ Eventos publicados: {total} | mensajes emitidos: {metricas['emitidos']} "
+            f"| coalescidos: {metricas['coalescidos']}"
+        ))
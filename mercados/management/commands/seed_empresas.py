@@ -1,5 +1,9 @@
 from django.core.management.base import BaseCommand
-from mercados.models import Empresa, Pais
+from mercados.models import LayoutHoja
+from mercados.utils_import import (
+    EXCEL_ENGINES, WorkbookReader, frame_from_raw, paises_por_clave, upsert_empresas, format_conteo,
+    buscar_layout, guardar_layout,
+)
 import pandas as pd, os, re, unicodedata
 from datetime import datetime
 
@@ -55,26 +59,32 @@ def pick_col(cols_norm, *candidates):
                 return idx
     return None
 
-def try_load_sheet(path: str, sheet_name: str, stdout, stderr):
-    # 1) Leer crudo sin header para detectar fila de encabezado (profundo)
-    raw = pd.read_excel(path, sheet_name=sheet_name, header=None, engine="openpyxl")
+def try_load_sheet(raw: pd.DataFrame, sheet_name: str, stdout, stderr):
+    # 0) Mismo formato que un archivo ya importado: reutilizar el layout guardado
+    layout = buscar_layout(LayoutHoja.PLANO, sheet_name, raw)
+    if layout is not None:
+        if layout.modo == "B":
+            df = frame_from_raw(raw, layout.header_row + 1, columns=combine_two_header_rows(raw, layout.header_row))
+        else:
+            df = frame_from_raw(raw, layout.header_row)
+        if df is not None:
+            stdout.write(f"♻️  [{sheet_name}] layout en caché: header_row {layout.header_row}, modo {layout.modo}")
+            return df, {**layout.columnas, "cols_label": layout.modo}
+
+    # 1) La hoja ya viene leída en crudo (sin header): detectar fila de encabezado (profundo)
     header_row = find_header_row(raw, scan_limit=200)
 
     stdout.write(f"🔎 [{sheet_name}] header_row detectada: {header_row}")
 
-    # 2) Intento A: usar esa fila como header
-    dfA = pd.read_excel(path, sheet_name=sheet_name, header=header_row, engine="openpyxl")
-    dfA = dfA.dropna(how="all")
-    colsA = list(dfA.columns)
+    # 2) Intento A: usar esa fila como header (en memoria, sin releer el archivo)
+    dfA = frame_from_raw(raw, header_row)
+    colsA = list(dfA.columns) if dfA is not None else []
     colsA_norm = [norm(c) for c in colsA]
 
     # 3) Intento B: combinar 2 filas de encabezado (header_row y header_row+1) y re-asignar
     combined_cols = combine_two_header_rows(raw, header_row)
-    dfB = pd.read_excel(path, sheet_name=sheet_name, header=header_row+1, engine="openpyxl")
-    dfB = dfB.dropna(how="all")
-    if len(dfB.columns) == len(combined_cols):
-        dfB.columns = combined_cols
-    colsB = list(dfB.columns)
+    dfB = frame_from_raw(raw, header_row + 1, columns=combined_cols)
+    colsB = list(dfB.columns) if dfB is not None else []
     colsB_norm = [norm(c) for c in colsB]
 
     # función de evaluación de estructura válida
@@ -98,11 +108,12 @@ def try_load_sheet(path: str, sheet_name: str, stdout, stderr):
     okA, mapA = evaluate(colsA_norm, "A")
     okB, mapB = evaluate(colsB_norm, "B")
 
-    # Preferir el que tenga mapeo válido
-    if okB:
-        return dfB, mapB
-    if okA:
-        return dfA, mapA
+    # Preferir el que tenga mapeo válido (y guardarlo para el próximo archivo con este formato)
+    for ok, dfx, mapx in ((okB, dfB, mapB), (okA, dfA, mapA)):
+        if ok and dfx is not None:
+            idx = {k: v for k, v in mapx.items() if k != "cols_label"}
+            guardar_layout(LayoutHoja.PLANO, sheet_name, raw, header_row, mapx["cols_label"], idx)
+            return dfx, mapx
 
     # Ninguno válido: log diagnóstico
     stderr.write(f"❌ [{sheet_name}] No se identificaron columnas mínimas.\n"
@@ -115,6 +126,8 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--file", type=str, default="Informe_Bursátil_Regional_2025-08.xlsx")
+        parser.add_argument("--engine", type=str, choices=EXCEL_ENGINES, default=None,
+                            help="Motor de lectura del Excel (por defecto settings.NUAM_EXCEL_ENGINE o 'auto').")
 
     def handle(self, *args, **opts):
         path = opts["file"]
@@ -124,8 +137,8 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR(f"No se encontró: {path}"))
             return
 
-        xls = pd.ExcelFile(path)
-        self.stdout.write(self.style.NOTICE(f"📚 Hojas detectadas: {xls.sheet_names}"))
+        xls = WorkbookReader(path, engine=opts.get("engine"))
+        self.stdout.write(self.style.NOTICE(f"📚 Hojas detectadas: {xls.sheet_names} (motor: {xls.engine})"))
 
         # Priorizamos la 'Nemo...' pero probamos todas si falla
         sheet_order = sorted(xls.sheet_names, key=lambda s: (0 if ("Nemo" in s and "Cap" in s) else 1, s))
@@ -135,10 +148,12 @@ class Command(BaseCommand):
         used_sheet = None
         for sheet in sheet_order:
             self.stdout.write(self.style.NOTICE(f"🧪 Probando hoja: {sheet}"))
-            dfi, mapi = try_load_sheet(path, sheet, self.stdout, self.stderr)
+            dfi, mapi = try_load_sheet(xls.raw(sheet), sheet, self.stdout, self.stderr)
             if dfi is not None:
                 df, mapping, used_sheet = dfi, mapi, sheet
                 break
+        xls.close()
+        self.stdout.write(self.style.NOTICE(f"⏱️  Lectura del Excel: {xls.parse_seconds:.2f} s"))
 
         if df is None:
             self.stderr.write(self.style.ERROR("No se pudo encontrar una tabla con 'ticker/nemo' y 'nombre/emisor'."))
@@ -158,7 +173,9 @@ class Command(BaseCommand):
         idx_fecha  = mapping["idx_fecha"]
         idx_merc   = mapping["idx_merc"]
 
-        created = updated = skipped = 0
+        skipped = 0
+        paises = paises_por_clave()
+        rows = []
 
         for _, row in df.iterrows():
             def get(idx):
@@ -176,8 +193,7 @@ class Command(BaseCommand):
             pais_obj = None
             pv = str(get(idx_pais) or "").strip()
             if pv:
-                pais_obj = Pais.objects.filter(codigo__iexact=pv).first() or \
-                           Pais.objects.filter(nombre__iexact=pv).first()
+                pais_obj = paises.get(pv.lower())
 
             # Capitalización
             cap_val = None
@@ -197,7 +213,8 @@ class Command(BaseCommand):
                 except:
                     fecha_val = None
 
-            defaults = {
+            rows.append({
+                "ticker": ticker,
                 "nombre": nombre,
                 "pais": pais_obj,
                 "sector": (str(get(idx_sector)).strip() or None) if get(idx_sector) is not None else None,
@@ -206,12 +223,11 @@ class Command(BaseCommand):
                 "mercado": (str(get(idx_merc)).strip() or None) if get(idx_merc) is not None else None,
                 "fuente": "Excel NUAM",
                 "fecha_reporte": fecha_val,
-            }
+            })
 
-            obj, is_created = Empresa.objects.update_or_create(ticker=ticker, defaults=defaults)
-            created += 1 if is_created else 0
-            updated += 0 if is_created else 1
+        # upsert_empresas deja los eventos en el outbox por bloque, en la misma transacción
+        conteo = upsert_empresas(rows)
 
         self.stdout.write(self.style.SUCCESS(
-            f"✅ Empresas creadas: {created}, actualizadas: {updated}, omitidas: {skipped}"
+            f"✅ Empresas {format_conteo(conteo, skipped).lower()}"
         ))
@@ -0,0 +1,69 @@
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from kafka_config import KAFKA_TOPIC_EMPRESAS
+from mercados import snapshot
+
+_detener = False
+
+
+def _pedir_detencion(signum, frame):
+    global _detener
+    _detener = True
+
+
+class Command(BaseCommand):
+    help = ("Publica el estado actual de todas las Empresas (un evento SNAPSHOT por ticker) para "
+            "reconstruir consumidores. Lee en paralelo por tramos de id, sin bloquear tablas, y se puede reanudar.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--topic", default=KAFKA_TOPIC_EMPRESAS,
+                            help="Topic de destino (idealmente compactado: cleanup.policy=compact).")
+        parser.add_argument("--hilos", type=int, default=4, help="Tramos de id leídos y publicados en paralelo.")
+        parser.add_argument("--lote", type=int, default=1000, help="Filas por consulta (y por confirmación).")
+        parser.add_argument("--max-eventos-s", type=float, default=None,
+                            help="Límite de eventos por segundo entre todos los hilos (sin límite por defecto).")
+        parser.add_argument("--checkpoint", default=os.path.join(settings.BASE_DIR, ".snapshot_empresas.json"),
+                            help="Archivo donde se guarda el avance.")
+        parser.add_argument("--reanudar", action="store_true", help="Continuar el snapshot del checkpoint.")
+
+    def handle(self, *args, **opts):
+        path = opts["checkpoint"]
+        if opts["reanudar"]:
+            if not os.path.exists(path):
+                raise CommandError(f"No hay checkpoint en {path}")
+            cp = snapshot.Checkpoint.cargar(path)
+            self.stdout.write(self.style.NOTICE(
+                f"🔁 Reanudando snapshot {cp.estado['snapshot']} ({cp.enviados} eventos ya enviados)"))
+        else:
+            cp = snapshot.nuevo_checkpoint(path, opts["topic"], max(1, opts["hilos"]))
+            self.stdout.write(self.style.NOTICE(
+                f"📸 Snapshot {cp.estado['snapshot']} hacia {opts['topic']} en {len(cp.estado['tramos'])} tramos"))
+
+        signal.signal(signal.SIGTERM, _pedir_detencion)
+        t0 = time.perf_counter()
+        inicio = cp.enviados
+        try:
+            snapshot.run_snapshot(
+                cp, hilos=opts["hilos"], lote=opts["lote"], eventos_por_s=opts["max_eventos_s"],
+                should_stop=lambda: _detener,
+                progreso=lambda n: self.stdout.write(f"   … {n} eventos enviados"),
+            )
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(f"⏸️ Interrumpido; continuar con --reanudar ({path})"))
+            return
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        dt = time.perf_counter() - t0
+        n = cp.enviados - inicio
+        if not cp.completo:
+            self.stdout.write(self.style.WARNING(f"⏸️ Detenido tras {n} eventos; continuar con --reanudar"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"✔️ Snapshot completo: {cp.enviados} empresas + marcador de fin "
+            f"({n} en esta corrida, {dt:.1f} s, {n / dt if dt else 0:.0f} ev/s)"))
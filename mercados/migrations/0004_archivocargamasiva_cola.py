@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+def marcar_procesados(apps, schema_editor):
+    ArchivoCargaMasiva = apps.get_model("mercados", "ArchivoCargaMasiva")
+    ArchivoCargaMasiva.objects.filter(procesado=True).update(estado="OK", progreso=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0003_empresa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='actualizado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='duracion_s',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='encolado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_COLA', 'En cola'), ('PROCESANDO', 'Procesando'), ('OK', 'Procesado'), ('ERROR', 'Error')], db_index=True, default='PENDIENTE', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='etapa',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='finalizado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='iniciado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='intentos',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='progreso',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='worker',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(marcar_procesados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0004_archivocargamasiva_cola'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='forzar',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='hash_contenido',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
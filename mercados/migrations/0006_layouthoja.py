@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0005_archivocargamasiva_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayoutHoja',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('huella', models.CharField(max_length=64, unique=True)),
+                ('importador', models.CharField(choices=[('bloques', 'Excel NUAM (bloques BCS/BVC/BVL)'), ('plano', 'Excel plano (seed_empresas)')], max_length=10)),
+                ('hoja', models.CharField(max_length=200)),
+                ('header_row', models.PositiveIntegerField()),
+                ('modo', models.CharField(max_length=1)),
+                ('columnas', models.JSONField(default=dict)),
+                ('usos', models.PositiveIntegerField(default=0)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('usado_en', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'layout de hoja',
+                'verbose_name_plural': 'layouts de hojas',
+                'indexes': [models.Index(fields=['importador', 'hoja'], name='mercados_la_importa_499e5e_idx')],
+            },
+        ),
+    ]
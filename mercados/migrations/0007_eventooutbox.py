@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0006_layouthoja'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=200)),
+                ('clave', models.CharField(blank=True, max_length=100)),
+                ('payload', models.JSONField()),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('enviado_en', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('reclamo', models.CharField(blank=True, db_index=True, max_length=32)),
+                ('reclamado_en', models.DateTimeField(blank=True, null=True)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'evento outbox',
+                'verbose_name_plural': 'eventos outbox',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0007_eventooutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmpresaLectura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=20, unique=True)),
+                ('empresa_id', models.IntegerField(blank=True, null=True)),
+                ('nombre', models.CharField(blank=True, max_length=255)),
+                ('pais_codigo', models.CharField(blank=True, db_index=True, max_length=3, null=True)),
+                ('pais_nombre', models.CharField(blank=True, max_length=50)),
+                ('sector', models.CharField(blank=True, db_index=True, max_length=100, null=True)),
+                ('moneda', models.CharField(blank=True, max_length=10, null=True)),
+                ('capitalizacion', models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True)),
+                ('mercado', models.CharField(blank=True, max_length=100, null=True)),
+                ('fuente', models.CharField(blank=True, max_length=100, null=True)),
+                ('fecha_reporte', models.DateField(blank=True, null=True)),
+                ('evento_id', models.BigIntegerField(default=0)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'empresa (lectura)',
+                'verbose_name_plural': 'empresas (lectura)',
+                'ordering': ['ticker'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0008_empresalectura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TipoCambio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('moneda', models.CharField(max_length=3)),
+                ('fecha', models.DateField()),
+                ('tasa', models.FloatField()),
+                ('fuente', models.CharField(blank=True, max_length=50)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'tipo de cambio',
+                'verbose_name_plural': 'tipos de cambio',
+                'ordering': ['moneda', 'fecha'],
+                'constraints': [models.UniqueConstraint(fields=('moneda', 'fecha'), name='tipocambio_moneda_fecha')],
+            },
+        ),
+    ]
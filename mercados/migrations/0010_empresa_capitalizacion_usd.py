@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:28
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Cast
+
+
+def calcular_capitalizacion_usd(apps, schema_editor):
+    # igual que mercados.capitalizacion.recalcular, con los modelos históricos
+    Empresa = apps.get_model("mercados", "Empresa")
+    TipoCambio = apps.get_model("mercados", "TipoCambio")
+    monedas = Empresa.objects.exclude(moneda__isnull=True).order_by().values_list("moneda", flat=True).distinct()
+    for moneda in set(monedas):
+        tasa = 1.0 if moneda == "USD" else (
+            TipoCambio.objects.filter(moneda=moneda).order_by("-fecha").values_list("tasa", flat=True).first())
+        if tasa:
+            Empresa.objects.filter(moneda=moneda).update(
+                capitalizacion_usd=Cast(F("capitalizacion"), FloatField()) / Value(tasa))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0009_tipocambio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='empresa',
+            name='capitalizacion_usd',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='empresa',
+            index=models.Index(fields=['pais', 'capitalizacion_usd'], name='mercados_em_pais_id_d88b8d_idx'),
+        ),
+        migrations.RunPython(calcular_capitalizacion_usd, migrations.RunPython.noop),
+    ]
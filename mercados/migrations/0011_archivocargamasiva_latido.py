@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mercados', '0010_empresa_capitalizacion_usd'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocargamasiva',
+            name='latido_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,6 @@
 # mercados/models.py
-from django.db import models
-from django.forms.models import model_to_dict
-from django.core.serializers.json import DjangoJSONEncoder
-import json
+from django.db import models, transaction
+import hashlib
 
 
 class Pais(models.Model):
@@ -96,14 +94,115 @@ class HistorialCambio(models.Model):
 class ArchivoCargaMasiva(models.Model):
     """
     Almacena archivos CSV/Excel para cargas masivas de instrumentos o precios.
+    El procesamiento corre en segundo plano (`manage.py procesar_cargas`): el admin
+    solo encola y los campos de estado/progreso reflejan el avance del worker.
     """
+    PENDIENTE = "PENDIENTE"
+    EN_COLA = "EN_COLA"
+    PROCESANDO = "PROCESANDO"
+    OK = "OK"
+    ERROR = "ERROR"
+    ESTADOS = [
+        (PENDIENTE, "Pendiente"),
+        (EN_COLA, "En cola"),
+        (PROCESANDO, "Procesando"),
+        (OK, "Procesado"),
+        (ERROR, "Error"),
+    ]
+
     archivo = models.FileField(upload_to="cargas/%Y/%m/")
     fecha_subida = models.DateTimeField(auto_now_add=True)
     procesado = models.BooleanField(default=False)
     resultado = models.TextField(blank=True)
 
+    # SHA-256 del contenido: una carga idéntica a otra ya procesada se omite
+    hash_contenido = models.CharField(max_length=64, blank=True, db_index=True)
+    forzar = models.BooleanField(default=False)  # reprocesar aunque el contenido ya se haya cargado
+
+    # Cola de procesamiento
+    estado = models.CharField(max_length=12, choices=ESTADOS, default=PENDIENTE, db_index=True)
+    progreso = models.PositiveSmallIntegerField(default=0)         # 0-100
+    etapa = models.CharField(max_length=200, blank=True)           # ej: "Escribiendo empresas (2/5)"
+    worker = models.CharField(max_length=100, blank=True)          # host:pid del worker que la tomó
+    intentos = models.PositiveSmallIntegerField(default=0)
+    encolado_en = models.DateTimeField(null=True, blank=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    actualizado_en = models.DateTimeField(null=True, blank=True)   # último reporte de progreso
+    latido_en = models.DateTimeField(null=True, blank=True)        # último latido del worker (sigue vivo)
+    finalizado_en = models.DateTimeField(null=True, blank=True)
+    duracion_s = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.archivo.name} - {self.get_estado_display()}"
+
+    def calcular_hash(self):
+        h = hashlib.sha256()
+        if not self.archivo._committed:
+            # subida aún en memoria/temporal: chunks() rebobina y el storage lo vuelve a leer al guardar
+            for chunk in self.archivo.file.chunks():
+                h.update(chunk)
+            return h.hexdigest()
+        self.archivo.open("rb")
+        try:
+            for chunk in self.archivo.chunks():
+                h.update(chunk)
+        finally:
+            self.archivo.close()
+        return h.hexdigest()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "archivo" in field_names:  # nombre guardado: para saber si el archivo cambió al guardar
+            instance._archivo_db = values[field_names.index("archivo")]
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Solo al crear o al cambiar el archivo se lee para el hash: los demás saves (progreso,
+        # estado) no abren el archivo, que en filas antiguas puede ya no existir
+        update_fields = kwargs.get("update_fields")
+        if self._state.adding:
+            archivo_nuevo = not self.hash_contenido or not self.archivo._committed
+        else:
+            archivo_nuevo = not self.archivo._committed or self.archivo.name != getattr(self, "_archivo_db", self.archivo.name)
+        if self.archivo and archivo_nuevo and (update_fields is None or "archivo" in update_fields):
+            self.hash_contenido = self.calcular_hash()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "hash_contenido"}
+        super().save(*args, **kwargs)
+        self._archivo_db = self.archivo.name
+
+
+class LayoutHoja(models.Model):
+    """
+    Estructura ya detectada de una hoja de carga: fila de encabezado, modo (A = una fila,
+    B = dos filas combinadas) e índices de columnas. Se guarda por huella de las primeras
+    filas para que los archivos con el mismo formato no repitan la detección.
+    """
+    BLOQUES = "bloques"
+    PLANO = "plano"
+    IMPORTADORES = [
+        (BLOQUES, "Excel NUAM (bloques BCS/BVC/BVL)"),
+        (PLANO, "Excel plano (seed_empresas)"),
+    ]
+
+    huella = models.CharField(max_length=64, unique=True)
+    importador = models.CharField(max_length=10, choices=IMPORTADORES)
+    hoja = models.CharField(max_length=200)
+    header_row = models.PositiveIntegerField()
+    modo = models.CharField(max_length=1)                 # A o B
+    columnas = models.JSONField(default=dict)             # índices detectados (bloques o campos)
+    usos = models.PositiveIntegerField(default=0)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    usado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "layout de hoja"
+        verbose_name_plural = "layouts de hojas"
+        indexes = [models.Index(fields=["importador", "hoja"])]
+
     def __str__(self):
-        return f"{self.archivo.name} - {'OK' if self.procesado else 'Pendiente'}"
+        return f"{self.hoja} ({self.get_importador_display()}, fila {self.header_row}, modo {self.modo})"
 
 
 # ------------------------------
@@ -135,6 +234,8 @@ class Empresa(models.Model):
         blank=True,
         null=True,
     )
+    # Capitalización en USD con la tasa vigente (ver mercados/capitalizacion.py): comparable entre bolsas
+    capitalizacion_usd = models.FloatField(blank=True, null=True, db_index=True, editable=False)
 
     # Metadatos útiles
     mercado = models.CharField(max_length=100, blank=True, null=True)
@@ -145,14 +246,110 @@ class Empresa(models.Model):
         verbose_name = "empresa"
         verbose_name_plural = "empresas"
         ordering = ["ticker"]
+        # ranking por país en moneda común
+        indexes = [models.Index(fields=["pais", "capitalizacion_usd"])]
+
+    def __str__(self):
+        return f"{self.ticker} - {self.nombre}"
+
+    def save(self, *args, **kwargs):
+        from .capitalizacion import en_usd
+        # solo se convierte si cambió el monto o la moneda: un save que edita otros campos no
+        # consulta TipoCambio (los cambios de tasa los aplica tipos_cambio.guardar)
+        if getattr(self, "_usd_de", None) != (self.capitalizacion, self.moneda):
+            self.capitalizacion_usd = en_usd(self.capitalizacion, self.moneda)
+            self._usd_de = (self.capitalizacion, self.moneda)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"capitalizacion", "moneda"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "capitalizacion_usd"}
+        # el receiver post_save escribe el evento en el outbox: misma transacción que el cambio,
+        # también en autocommit (sin ATOMIC_REQUESTS los saves de la API no abren una)
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # valores leídos de la BD: permiten publicar solo los campos cambiados (ver mercados/eventos.py)
+        instance._valores_db = dict(zip(field_names, values))
+        if {"capitalizacion", "moneda", "capitalizacion_usd"} <= set(field_names):
+            instance._usd_de = (instance._valores_db["capitalizacion"], instance._valores_db["moneda"])
+        return instance
+
+
+class EventoOutbox(models.Model):
+    """
+    Eventos por publicar en Kafka (patrón outbox). Se escriben en la misma transacción que el
+    cambio de la Empresa y `manage.py relay_outbox` los publica y los marca como enviados.
+    """
+    topic = models.CharField(max_length=200)
+    clave = models.CharField(max_length=100, blank=True)              # clave del mensaje (ticker)
+    payload = models.JSONField()
+    creado_en = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(null=True, blank=True, db_index=True)
+    reclamo = models.CharField(max_length=32, blank=True, db_index=True)  # token del relay que tomó el lote
+    reclamado_en = models.DateTimeField(null=True, blank=True)
+    intentos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "evento outbox"
+        verbose_name_plural = "eventos outbox"
+        ordering = ["id"]
+
+    def __str__(self):
+        estado = "enviado" if self.enviado_en else "pendiente"
+        return f"#{self.pk} {self.topic} {self.clave} ({estado})"
+
+
+class EmpresaLectura(models.Model):
+    """
+    Modelo de lectura de Empresa, desnormalizado (incluye el nombre del país). Lo llena
+    `manage.py consumir_empresas` a partir de los eventos de Kafka; las consultas de solo
+    lectura pueden ir aquí en vez de a las tablas principales. `evento_id` es el último
+    evento aplicado: los repetidos o más antiguos se ignoran.
+    """
+    ticker = models.CharField(max_length=20, unique=True)
+    empresa_id = models.IntegerField(null=True, blank=True)
+    nombre = models.CharField(max_length=255, blank=True)
+    pais_codigo = models.CharField(max_length=3, blank=True, null=True, db_index=True)
+    pais_nombre = models.CharField(max_length=50, blank=True)
+    sector = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    moneda = models.CharField(max_length=10, blank=True, null=True)
+    capitalizacion = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
+    mercado = models.CharField(max_length=100, blank=True, null=True)
+    fuente = models.CharField(max_length=100, blank=True, null=True)
+    fecha_reporte = models.DateField(blank=True, null=True)
+    evento_id = models.BigIntegerField(default=0)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "empresa (lectura)"
+        verbose_name_plural = "empresas (lectura)"
+        ordering = ["ticker"]
 
     def __str__(self):
         return f"{self.ticker} - {self.nombre}"
 
 
-def empresa_a_dict(empresa):
-    """Convierte una instancia de Empresa a un dict serializable JSON."""
-    data = model_to_dict(empresa)
-    # Si hay campos que no quieras enviar al topic, elimínalos aquí:
-    # data.pop("campo_x", None)
-    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+class TipoCambio(models.Model):
+    """
+    Tasa diaria de una moneda contra USD (unidades de `moneda` por 1 USD, como la entrega
+    la API). La llenan `manage.py actualizar_tipos_cambio` (diario) e
+    `importar_tipos_cambio` (histórico); el dashboard lee de aquí sus series.
+    """
+    moneda = models.CharField(max_length=3)
+    fecha = models.DateField()
+    tasa = models.FloatField()
+    fuente = models.CharField(max_length=50, blank=True)            # api, archivo, importación...
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "tipo de cambio"
+        verbose_name_plural = "tipos de cambio"
+        ordering = ["moneda", "fecha"]
+        # un valor por moneda y día; el índice sirve las consultas por rango de fechas
+        constraints = [models.UniqueConstraint(fields=["moneda", "fecha"], name="tipocambio_moneda_fecha")]
+
+    def __str__(self):
+        return f"{self.moneda} {self.fecha:%Y-%m-%d}: {self.tasa}"
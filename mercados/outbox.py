@@ -0,0 +1,339 @@
+# mercados/outbox.py
+"""
+Outbox transaccional de eventos de Empresa.
+
+Los cambios se registran como filas de EventoOutbox dentro de la transacción que modifica
+la Empresa (si esa transacción se revierte, el evento desaparece con ella). El relay
+(`manage.py relay_outbox`) toma lotes en orden de id, los publica en Kafka y los marca como
+enviados. Varios relays pueden correr a la vez: cada uno reclama su lote con un UPDATE
+condicional y un token propio, así una fila nunca la publican dos relays al mismo tiempo.
+La entrega es al menos una vez: un lote cuyo relay se cae vuelve a estar disponible
+cuando vence su reclamo.
+"""
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from kafka_config import KAFKA_TOPIC_EMPRESAS
+from . import eventos as ev_codec
+from .models import Empresa, EventoOutbox
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------ registro (lado de la escritura) ------------------
+
+def registrar_empresas(empresas, creadas=(), batch_size=1000, anteriores=None):
+    """
+    Agrega al outbox un evento CREAR/EDITAR por cada Empresa (debe llamarse dentro de la
+    transacción del cambio). `anteriores` ({ticker: valores previos}) permite eventos delta.
+    """
+    creadas = set(creadas)
+    anteriores = anteriores or {}
+    eventos = []
+    for empresa in empresas:
+        datos = ev_codec.empresa_evento(empresa, empresa.ticker in creadas, anteriores.get(empresa.ticker))
+        eventos.append(EventoOutbox(topic=KAFKA_TOPIC_EMPRESAS, clave=empresa.ticker, payload=datos))
+    EventoOutbox.objects.bulk_create(eventos, batch_size=batch_size)
+    return len(eventos)
+
+
+def registrar_tickers(tickers_creados, tickers_actualizados, chunk=1000, anteriores=None):
+    """Como `registrar_empresas`, leyendo las filas por bloques a partir de los tickers."""
+    creados = set(tickers_creados)
+    tickers = list(creados) + [t for t in tickers_actualizados if t not in creados]
+    total = 0
+    for i in range(0, len(tickers), chunk):
+        # el evento usa pais_id directamente: no hace falta traer el país
+        empresas = Empresa.objects.filter(ticker__in=tickers[i:i + chunk]).order_by("ticker")
+        total += registrar_empresas(empresas, creados, batch_size=chunk, anteriores=anteriores)
+    return total
+
+
+# ------------------ relay (lado de la publicación) ------------------
+
+def _libres(lease_s):
+    vencido = timezone.now() - timedelta(seconds=lease_s)
+    return Q(enviado_en__isnull=True) & (Q(reclamo="") | Q(reclamado_en__lt=vencido))
+
+
+def reclamar_lote(n=1000, lease_s=60):
+    """
+    Reclama hasta `n` eventos pendientes (los más antiguos). El UPDATE vuelve a exigir que
+    sigan libres, de modo que si otro relay tomó alguno entre la lectura y el UPDATE, ese
+    queda fuera. Devuelve (token, eventos reclamados en orden de id).
+    """
+    token = uuid.uuid4().hex
+    while True:
+        ids = list(EventoOutbox.objects.filter(_libres(lease_s)).order_by("id").values_list("id", flat=True)[:n])
+        if not ids:
+            return token, []
+        tomados = EventoOutbox.objects.filter(_libres(lease_s), id__in=ids).update(
+            reclamo=token, reclamado_en=timezone.now(), intentos=F("intentos") + 1,
+        )
+        if tomados:
+            return token, list(EventoOutbox.objects.filter(reclamo=token).order_by("id"))
+        # otro relay se llevó todo ese tramo entre la lectura y el UPDATE: probar con el siguiente
+
+
+def _en_bloques(ids, size=500):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+class Entregas:
+    """
+    Confirmaciones de entrega de un relay. Los callbacks llegan desde el hilo de poll del
+    producer y se acumulan aquí; `aplicar()` los lleva a la BD (filas enviadas o liberadas).
+    Las filas de mensajes aún en vuelo siguen reclamadas hasta que llegue su callback
+    (librdkafka lo entrega a más tardar a los message.timeout.ms): `renovar()` extiende su
+    reclamo para que otro relay no las publique de nuevo mientras tanto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_vuelo = set()  # (token, evento_id)
+        self._ok = []
+        self._fallidos = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._en_vuelo)
+
+    def callback(self, refs):
+        """Callback de entrega para un mensaje que agrupa las filas `refs`."""
+        with self._lock:
+            self._en_vuelo.update(refs)
+
+        def cb(err, msg):
+            with self._lock:
+                self._en_vuelo.difference_update(refs)
+                (self._fallidos if err is not None else self._ok).extend(refs)
+        return cb
+
+    def descartar(self, refs):
+        """El mensaje no entró a la cola del producer: sus filas se liberan sin esperar callback."""
+        with self._lock:
+            self._en_vuelo.difference_update(refs)
+            self._fallidos.extend(refs)
+
+    def aplicar(self):
+        """Marca enviadas las filas confirmadas y libera las fallidas. Devuelve (enviadas, fallidas)."""
+        with self._lock:
+            ok, self._ok = self._ok, []
+            fallidos, self._fallidos = self._fallidos, []
+        ahora = timezone.now()
+        for token, ids in _por_token(ok):
+            for bloque in _en_bloques(ids):
+                EventoOutbox.objects.filter(reclamo=token, id__in=bloque).update(enviado_en=ahora, reclamo="")
+        for token, ids in _por_token(fallidos):
+            for bloque in _en_bloques(ids):
+                EventoOutbox.objects.filter(reclamo=token, id__in=bloque).update(reclamo="", reclamado_en=None)
+        return len(ok), len(fallidos)
+
+    def renovar(self, refs=None):
+        """Extiende el reclamo de `refs` (por defecto, las filas en vuelo)."""
+        if refs is None:
+            with self._lock:
+                refs = list(self._en_vuelo)
+        ahora = timezone.now()
+        for token, ids in _por_token(refs):
+            for bloque in _en_bloques(ids):
+                EventoOutbox.objects.filter(reclamo=token, id__in=bloque, enviado_en__isnull=True).update(
+                    reclamado_en=ahora,
+                )
+
+
+def publicar(mensajes, productor=None, timeout=30.0, lease_s=60, entregas=None):
+    """
+    Publica `mensajes` [(topic, clave, payload, [(token, evento_id), ...])] con un único flush.
+    Las filas de los mensajes que el broker confirmó quedan enviadas y las que fallaron (o no
+    alcanzaron a entrar a la cola) se liberan para un próximo intento. Encolar y esperar el
+    flush nunca toma más de la mitad del lease: las filas que siguen en vuelo al terminar
+    quedan reclamadas en `entregas` hasta su callback, sin que otro relay las tome.
+    Devuelve (filas enviadas, filas fallidas) resueltas hasta ahora.
+    """
+    if productor is None:
+        from kafka_service import get_productor
+        productor = get_productor()
+    entregas = Entregas() if entregas is None else entregas
+    limite = time.monotonic() + min(timeout, lease_s / 2)
+
+    # las filas pudieron esperar en el buffer de coalescencia: el lease corre desde ahora
+    entregas.renovar([ref for *_, refs in mensajes for ref in refs])
+    formato = ev_codec.formato_eventos()
+    for topic, clave, payload, refs in mensajes:
+        value, headers = ev_codec.codificar(payload, formato)
+        encolado = productor.encolar(
+            topic, value=value, key=clave.encode("utf-8") or None, headers=headers,
+            desborde="esperar", espera_max_s=max(0.0, limite - time.monotonic()), callback=entregas.callback(refs),
+        )
+        if not encolado:
+            entregas.descartar(refs)
+    productor.flush(max(0.0, limite - time.monotonic()))
+    return entregas.aplicar()
+
+
+def _por_token(refs):
+    grupos = {}
+    for token, pk in refs:
+        grupos.setdefault(token, []).append(pk)
+    return grupos.items()
+
+
+def publicar_lote(token, eventos, productor=None, timeout=30.0, lease_s=60):
+    """Publica los eventos reclamados con `token`, uno por mensaje. Devuelve (enviados, fallidos)."""
+    return publicar([_mensaje(token, ev) for ev in eventos], productor=productor, timeout=timeout, lease_s=lease_s)
+
+
+def _mensaje(token, ev):
+    # evento_id es creciente: permite al consumidor descartar eventos más viejos que los ya aplicados
+    return ev.topic, ev.clave, {**ev.payload, "evento_id": ev.pk}, [(token, ev.pk)]
+
+
+class BufferCoalescente:
+    """
+    Ventana de coalescencia del relay. Los eventos de un mismo ticker que llegan dentro de
+    `ventana_s` desde el primero se fusionan (`eventos.fusionar`) y sale un solo mensaje
+    con el último estado. Si hay más de `max_tickers` tickers esperando, los más antiguos
+    salen antes de tiempo. Las filas siguen reclamadas mientras esperan en el buffer.
+    """
+
+    def __init__(self, ventana_s, max_tickers=10000):
+        self.ventana_s = ventana_s
+        self.max_tickers = max_tickers
+        self._pendientes = {}  # (topic, clave) -> [llegada, topic, clave, payload, refs]; en orden de llegada
+        self.metricas = {"recibidos": 0, "emitidos": 0, "coalescidos": 0}
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def agregar(self, token, ev):
+        self.metricas["recibidos"] += 1
+        payload = {**ev.payload, "evento_id": ev.pk}
+        k = (ev.topic, ev.clave) if ev.clave else (ev.topic, ev.pk)  # sin clave no hay nada que fusionar
+        actual = self._pendientes.get(k)
+        if actual is None:
+            self._pendientes[k] = [time.monotonic(), ev.topic, ev.clave, payload, [(token, ev.pk)]]
+            return
+        actual[3] = ev_codec.fusionar(actual[3], payload)
+        actual[4].append((token, ev.pk))
+        self.metricas["coalescidos"] += 1
+
+    def vence_en(self):
+        """Segundos hasta que el más antiguo deba salir (None si el buffer está vacío)."""
+        if not self._pendientes:
+            return None
+        llegada = next(iter(self._pendientes.values()))[0]
+        return max(0.0, llegada + self.ventana_s - time.monotonic())
+
+    def listos(self, todos=False):
+        """Saca del buffer los mensajes que ya cumplieron la ventana (o todos), como los recibe `publicar`."""
+        limite = time.monotonic() - self.ventana_s
+        salida = []
+        while self._pendientes:
+            k, (llegada, *mensaje) = next(iter(self._pendientes.items()))
+            if not (todos or llegada <= limite or len(self._pendientes) > self.max_tickers):
+                break
+            del self._pendientes[k]
+            salida.append(tuple(mensaje))
+        self.metricas["emitidos"] += len(salida)
+        return salida
+
+
+def reenviar_desde(evento_id):
+    """Vuelve a dejar pendientes los eventos desde `evento_id` (los que aún no se podaron)."""
+    return EventoOutbox.objects.filter(id__gte=evento_id).update(enviado_en=None, reclamo="", reclamado_en=None)
+
+
+def podar(dias, chunk=5000):
+    """Borra los eventos enviados hace más de `dias` días, por bloques para no bloquear la tabla."""
+    limite = timezone.now() - timedelta(days=dias)
+    total = 0
+    while True:
+        ids = list(EventoOutbox.objects.filter(enviado_en__lt=limite).values_list("id", flat=True)[:chunk])
+        if not ids:
+            return total
+        total += EventoOutbox.objects.filter(id__in=ids).delete()[0]
+
+
+def run_relay(lote=1000, poll=1.0, once=False, lease_s=60, retener_dias=7, podar_cada_s=600,
+              should_stop=lambda: False, productor=None, ventana_s=None, buffer_max=None, metricas=None):
+    """
+    Bucle del relay: reclama y publica lotes hasta vaciar el outbox (si `once`) o hasta que
+    `should_stop()` sea verdadero. Cada `podar_cada_s` borra los enviados más antiguos que
+    `retener_dias`. Con `ventana_s` > 0 (NUAM_EVENTOS_VENTANA_S) los eventos pasan antes por
+    un BufferCoalescente de hasta `buffer_max` tickers (NUAM_EVENTOS_BUFFER_MAX).
+    `metricas` (dict opcional) recibe enviados (filas), emitidos (mensajes) y coalescidos.
+    Devuelve el total de eventos enviados.
+    """
+    ventana_s = getattr(settings, "NUAM_EVENTOS_VENTANA_S", 0) if ventana_s is None else ventana_s
+    buffer_max = buffer_max or getattr(settings, "NUAM_EVENTOS_BUFFER_MAX", 10000)
+    if ventana_s and ventana_s * 2 > lease_s:
+        # las filas siguen reclamadas mientras esperan: el reclamo no puede vencer antes de publicarlas
+        raise ValueError(f"La ventana de coalescencia ({ventana_s} s) debe ser menor que la mitad del lease ({lease_s} s).")
+    buffer = BufferCoalescente(ventana_s, buffer_max) if ventana_s else None
+    metricas = {} if metricas is None else metricas
+    metricas.update(enviados=0, emitidos=0, coalescidos=0)
+    if productor is None:
+        from kafka_service import get_productor
+        productor = get_productor()
+    entregas = Entregas()
+
+    def enviar(mensajes):
+        t0 = time.perf_counter()
+        enviados, fallidos = publicar(mensajes, productor=productor, lease_s=lease_s, entregas=entregas)
+        dt = time.perf_counter() - t0
+        metricas["enviados"] += enviados
+        metricas["emitidos"] += len(mensajes)
+        if buffer is not None:
+            metricas["coalescidos"] = buffer.metricas["coalescidos"]
+        logger.info("Outbox: %s enviados en %s mensajes, %s fallidos, %s en vuelo en %.2f s (%.0f ev/s)",
+                    enviados, len(mensajes), fallidos, len(entregas), dt, enviados / dt if dt else 0)
+        return enviados, fallidos
+
+    ultima_poda = 0.0
+    while not should_stop():
+        # confirmaciones que llegaron después del flush de su lote; las que faltan siguen reclamadas
+        metricas["enviados"] += entregas.aplicar()[0]
+        entregas.renovar()
+        if retener_dias and time.monotonic() - ultima_poda > podar_cada_s:
+            borrados = podar(retener_dias)
+            if borrados:
+                logger.info("Outbox: %s eventos antiguos borrados", borrados)
+            ultima_poda = time.monotonic()
+
+        token, eventos = reclamar_lote(lote, lease_s)
+        if buffer is None:
+            mensajes = [_mensaje(token, ev) for ev in eventos]
+        else:
+            for ev in eventos:
+                buffer.agregar(token, ev)
+            # con --once y el outbox vacío no se espera a que venza la ventana
+            mensajes = buffer.listos(todos=once and not eventos)
+
+        if mensajes:
+            enviados, fallidos = enviar(mensajes)
+            if fallidos and not enviados:
+                time.sleep(poll)  # broker caído: no reintentar en un bucle apretado
+                if once:
+                    break
+        if not eventos:
+            if once and not buffer:
+                break
+            time.sleep(poll if not buffer else min(poll, buffer.vence_en()))
+
+    if buffer:
+        enviar(buffer.listos(todos=True))  # al detenerse no quedan eventos retenidos
+    if len(entregas):
+        # lo que siga sin confirmar queda reclamado y vuelve a estar libre al vencer el lease
+        productor.flush(lease_s / 2)
+    metricas["enviados"] += entregas.aplicar()[0]
+    return metricas["enviados"]
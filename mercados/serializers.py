@@ -34,6 +34,6 @@ class EmpresaSerializer(serializers.ModelSerializer):
         model = Empresa
         fields = [
             'ticker', 'nombre', 'pais', 'pais_codigo', 'pais_nombre',
-            'sector', 'moneda', 'capitalizacion',
+            'sector', 'moneda', 'capitalizacion', 'capitalizacion_usd',
             'mercado', 'fuente', 'fecha_reporte'
         ]
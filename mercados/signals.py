@@ -1,13 +1,75 @@
 # mercados/signals.py
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from .models import Empresa, empresa_a_dict
-from kafka_service import publicar_evento_empresa
+from .models import Empresa
+from . import capitalizacion, outbox
+from .eventos import CAMPOS, valores_cargados
+
+logger = logging.getLogger(__name__)
+
+# Estado de los bloques `eventos_empresa_en_lote` en curso (por hilo): profundidad, tope y tickers pendientes
+_lote = threading.local()
+
+
+def vaciar_lote():
+    """Registra en el outbox los tickers anotados hasta ahora en el bloque en curso (si hay uno)."""
+    cambios = getattr(_lote, "cambios", None)
+    if not cambios:
+        return 0
+    _lote.cambios = {}
+    return outbox.registrar_tickers(
+        [t for t, creada in cambios.items() if creada],
+        [t for t, creada in cambios.items() if not creada],
+        chunk=_lote.tope,
+    )
+
+
+@contextmanager
+def eventos_empresa_en_lote(lote=None):
+    """
+    Para código que guarda muchas Empresas una a una: en vez de una fila de outbox por save
+    se anotan los tickers cambiados y se registran con bulk_create cada `lote` tickers
+    (NUAM_IMPORT_BATCH_SIZE) y al salir; la tasa de cada moneda para `capitalizacion_usd` se
+    lee una vez por bloque (`capitalizacion.tasas_en_lote`). Todo el bloque corre en una transacción: los eventos
+    quedan junto a sus cambios y, si algo falla, no queda ninguno de los dos. La memoria
+    no crece con el largo de la carga.
+    `upsert_empresas` no lo necesita: registra sus eventos por bloque en su propia transacción.
+    """
+    if getattr(_lote, "profundidad", 0):
+        # bloque anidado: se suma al externo, que es quien tiene la transacción
+        _lote.profundidad += 1
+        try:
+            yield
+        finally:
+            _lote.profundidad -= 1
+        return
+    _lote.cambios = {}
+    _lote.tope = lote or getattr(settings, "NUAM_IMPORT_BATCH_SIZE", 1000)
+    _lote.profundidad = 1
+    try:
+        with transaction.atomic(), capitalizacion.tasas_en_lote():
+            yield
+            vaciar_lote()
+    finally:
+        _lote.profundidad = 0
+        _lote.cambios = {}
 
 
 @receiver(post_save, sender=Empresa)
 def enviar_evento_empresa(sender, instance, created, **kwargs):
-    """Envía un evento a Kafka cuando se crea o actualiza una Empresa."""
-    datos = empresa_a_dict(instance)
-    datos["accion"] = "CREAR" if created else "EDITAR"
-    publicar_evento_empresa(datos)
+    """Registra en el outbox el evento de creación/edición de una Empresa (lo publica relay_outbox)."""
+    if getattr(_lote, "profundidad", 0):
+        _lote.cambios[instance.ticker] = _lote.cambios.get(instance.ticker, False) or created
+        if len(_lote.cambios) >= _lote.tope:
+            vaciar_lote()
+        return
+    outbox.registrar_empresas([instance], [instance.ticker] if created else [],
+                              anteriores={instance.ticker: valores_cargados(instance)})
+    # un segundo save de la misma instancia compara contra lo que quedó guardado
+    instance._valores_db = {attname: getattr(instance, attname) for attname in CAMPOS}
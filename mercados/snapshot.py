@@ -0,0 +1,209 @@
+# mercados/snapshot.py
+"""
+Snapshot completo de Empresas hacia Kafka, para reconstruir consumidores nuevos o que
+perdieron su estado (`manage.py snapshot_empresas`).
+
+Cada Empresa sale como evento completo con accion "SNAPSHOT" y clave = ticker, apto para
+un topic compactado. El rango de ids se reparte en tramos que se leen en paralelo con
+paginación por clave (`id > último`, de a `lote` filas): consultas cortas, sin cursores
+largos ni bloqueos de tabla. Tras confirmar cada lote en el broker se guarda el avance de
+su tramo en un archivo de checkpoint, así un snapshot cortado se puede reanudar. Al final
+se publica un marcador de fin de snapshot (clave FIN_SNAPSHOT_CLAVE).
+
+Los eventos SNAPSHOT no llevan `evento_id`: el máximo id del outbox al leer no garantiza que
+los ids menores ya estén confirmados (otra transacción puede tener uno sin commit), y con ese
+sello el consumidor descartaría ese evento real al llegar después. El consumidor no los usa
+para ordenar (ver consumidor.aplicar_eventos).
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.db import connection
+from django.db.models import Max, Min
+
+from . import eventos as ev_codec
+from .models import Empresa
+
+logger = logging.getLogger(__name__)
+
+FIN_SNAPSHOT_CLAVE = "__fin_snapshot__"
+
+
+class Limitador:
+    """Límite de eventos por segundo compartido entre hilos (0 o None = sin límite)."""
+
+    def __init__(self, por_segundo):
+        self.por_segundo = por_segundo
+        self._lock = threading.Lock()
+        self._proximo = time.monotonic()
+
+    def esperar(self, n):
+        if not self.por_segundo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(self._proximo, ahora)
+            self._proximo = turno + n / self.por_segundo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+class Checkpoint:
+    """Avance del snapshot por tramo, guardado como JSON (escritura atómica con rename)."""
+
+    def __init__(self, path, estado):
+        self.path = path
+        self.estado = estado
+        self._lock = threading.Lock()
+
+    @classmethod
+    def cargar(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    def avanzar(self, tramo, ultimo_id, n):
+        with self._lock:
+            t = self.estado["tramos"][tramo]
+            t["ultimo"] = ultimo_id
+            t["enviados"] += n
+            self.guardar()
+
+    def guardar(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.estado, f, indent=1)
+        os.replace(tmp, self.path)
+
+    @property
+    def completo(self):
+        return all(t["ultimo"] >= t["hasta"] for t in self.estado["tramos"])
+
+    @property
+    def enviados(self):
+        return sum(t["enviados"] for t in self.estado["tramos"])
+
+
+def nuevo_checkpoint(path, topic, tramos):
+    """Reparte el rango de ids actual en `tramos` tramos (id desde exclusivo, hasta inclusivo)."""
+    rango = Empresa.objects.aggregate(desde=Min("id"), hasta=Max("id"))
+    estado = {"snapshot": uuid.uuid4().hex, "topic": topic, "tramos": []}
+    if rango["desde"] is not None:
+        inicio, fin = rango["desde"] - 1, rango["hasta"]
+        paso = -(-(fin - inicio) // tramos)
+        for desde in range(inicio, fin, paso):
+            hasta = min(desde + paso, fin)
+            estado["tramos"].append({"desde": desde, "hasta": hasta, "ultimo": desde, "enviados": 0})
+    cp = Checkpoint(path, estado)
+    cp.guardar()
+    return cp
+
+
+def _evento_snapshot(empresa, snapshot_id):
+    evento = ev_codec.empresa_evento(empresa, creada=False, delta=False)
+    evento["accion"] = "SNAPSHOT"
+    evento["snapshot"] = snapshot_id
+    return evento
+
+
+def _enviar(productor, topic, mensajes, timeout):
+    """
+    Encola (clave, evento) y espera la confirmación de estos mensajes. El productor lo comparten
+    los hilos (y el proceso): su flush contaría también los mensajes de los demás, así que se
+    esperan solo los callbacks propios. Devuelve cuántos fallaron o quedaron sin confirmar.
+    """
+    confirmado = threading.Condition()
+    cuenta = {"pendientes": 0, "fallidos": 0}
+
+    def on_delivery(err, msg):
+        with confirmado:
+            cuenta["pendientes"] -= 1
+            if err is not None:
+                cuenta["fallidos"] += 1
+            confirmado.notify_all()
+
+    limite = time.monotonic() + timeout
+    formato = ev_codec.formato_eventos()
+    for clave, evento in mensajes:
+        value, headers = ev_codec.codificar(evento, formato)
+        with confirmado:
+            cuenta["pendientes"] += 1
+        encolado = productor.encolar(topic, value=value, key=clave.encode("utf-8"), headers=headers,
+                                     desborde="esperar", espera_max_s=max(0.0, limite - time.monotonic()),
+                                     callback=on_delivery)
+        if not encolado:
+            with confirmado:
+                cuenta["pendientes"] -= 1
+                cuenta["fallidos"] += 1
+    # el hilo de poll del productor entrega los callbacks
+    with confirmado:
+        confirmado.wait_for(lambda: cuenta["pendientes"] <= 0, timeout=max(0.0, limite - time.monotonic()))
+        return cuenta["fallidos"] + cuenta["pendientes"]
+
+
+def _correr_tramo(i, cp, productor, lote, limitador, timeout, should_stop):
+    tramo = cp.estado["tramos"][i]
+    topic, snapshot_id = cp.estado["topic"], cp.estado["snapshot"]
+    ultimo = tramo["ultimo"]
+    try:
+        while ultimo < tramo["hasta"] and not should_stop():
+            filas = list(Empresa.objects.filter(id__gt=ultimo, id__lte=tramo["hasta"]).order_by("id")[:lote])
+            if not filas:
+                cp.avanzar(i, tramo["hasta"], 0)
+                break
+            limitador.esperar(len(filas))
+            mensajes = [(e.ticker, _evento_snapshot(e, snapshot_id)) for e in filas]
+            fallidos = _enviar(productor, topic, mensajes, timeout)
+            if fallidos:
+                raise RuntimeError(f"{fallidos} eventos del tramo {i} sin confirmar; reanudar con --reanudar")
+            ultimo = filas[-1].id if len(filas) == lote else tramo["hasta"]
+            cp.avanzar(i, ultimo, len(filas))
+    finally:
+        connection.close()  # conexión propia de este hilo
+
+
+def run_snapshot(checkpoint, productor=None, hilos=4, lote=1000, eventos_por_s=None, timeout=60.0,
+                 should_stop=lambda: False, progreso=None):
+    """
+    Publica los tramos pendientes de `checkpoint` en paralelo y, si quedó completo, el
+    marcador de fin. `progreso(enviados)` se llama cada segundo. Devuelve el Checkpoint.
+    """
+    if productor is None:
+        from kafka_service import get_productor
+        productor = get_productor()
+    limitador = Limitador(eventos_por_s)
+    tramos = [i for i, t in enumerate(checkpoint.estado["tramos"]) if t["ultimo"] < t["hasta"]]
+    detener = threading.Event()
+
+    def parar():
+        return detener.is_set() or should_stop()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, hilos), thread_name_prefix="snapshot")
+    try:
+        futuros = [pool.submit(_correr_tramo, i, checkpoint, productor, lote, limitador, timeout, parar)
+                   for i in tramos]
+        while wait(futuros, timeout=1.0).not_done:
+            if progreso:
+                progreso(checkpoint.enviados)
+        for f in futuros:
+            f.result()
+    except BaseException:
+        # Ctrl+C (llega solo a este hilo) o un tramo con error: los demás terminan el lote en
+        # curso, que queda en el checkpoint, y se detienen en vez de seguir hasta el final
+        detener.set()
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    if checkpoint.completo and not checkpoint.estado.get("fin_enviado"):
+        marcador = {"v": ev_codec.SCHEMA_VERSION, "accion": "FIN_SNAPSHOT", "ticker": None,
+                    "snapshot": checkpoint.estado["snapshot"], "total": checkpoint.enviados}
+        if _enviar(productor, checkpoint.estado["topic"], [(FIN_SNAPSHOT_CLAVE, marcador)], timeout):
+            raise RuntimeError("No se confirmó el marcador de fin de snapshot; reanudar con --reanudar")
+        checkpoint.estado["fin_enviado"] = True
+        checkpoint.guardar()
+    return checkpoint
@@ -0,0 +1,189 @@
+# mercados/sse.py
+"""
+Tasas en vivo para el dashboard por Server-Sent Events (`/api/tipos-cambio/stream/`).
+
+Un solo hilo por proceso (el Difusor) mira la caché de fx_service cada NUAM_SSE_POLL_S; esa
+lectura es la que dispara el refresco contra el proveedor cuando vence FX_TTL_S, así que
+una descarga sirve a todos los dashboards abiertos. Cuando las tasas cambian de verdad (el
+id del evento es un hash del contenido) se despierta a todas las conexiones, que envían el
+evento `tasas`: la lista completa (`tasas`) a una conexión nueva y solo las monedas que
+cambiaron (`cambios`, null = ya no está) a la que tenía las anteriores. Sin cambios se manda
+un comentario de heartbeat cada NUAM_SSE_HEARTBEAT_S para que proxies y navegador no corten
+la conexión.
+
+Cada conexión dura a lo sumo NUAM_SSE_MAX_S: el navegador se reconecta solo y manda
+Last-Event-ID, así que si ya tenía las tasas vigentes no se le reenvían.
+
+Solo se sirve bajo ASGI (`stream_async`): cada conexión espera un asyncio.Event de su loop,
+que el Difusor activa con `call_soon_threadsafe`, así los dashboards abiertos no ocupan
+hilos. Bajo WSGI la vista responde 503 y el dashboard revalida con ETag cada NUAM_SSE_POLL_S.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+import fx_service
+
+logger = logging.getLogger(__name__)
+
+RETRY_MS = 3000  # espera sugerida al navegador antes de reconectar
+
+
+def _sse(evento_id, payload):
+    data = json.dumps(payload, separators=(",", ":"))
+    return f"id: {evento_id}\nevent: tasas\ndata: {data}\n\n".encode()
+
+
+def _evento(data, previo=None):
+    """
+    Evento de las tasas de `data`: {"id", "anterior", "tasas", "completo", "cambios"}. El id es
+    un hash de los valores compactos; `cambios` (bytes) trae solo lo distinto de `previo`.
+    """
+    tasas = {m: float(f"{t:.6g}") for m, t in data["rates"].items()}
+    cuerpo = json.dumps(tasas, separators=(",", ":"), sort_keys=True)
+    evento_id = hashlib.sha1(cuerpo.encode()).hexdigest()[:16]
+    base = {"id": evento_id, "fecha": data.get("date"), "base": "USD"}
+    evento = {"id": evento_id, "anterior": None, "tasas": tasas,
+              "completo": _sse(evento_id, {**base, "tasas": tasas}), "cambios": None}
+    if previo is not None:
+        cambios = {m: t for m, t in tasas.items() if previo["tasas"].get(m) != t}
+        cambios.update({m: None for m in previo["tasas"] if m not in tasas})
+        evento.update(anterior=previo["id"], cambios=_sse(evento_id, {**base, "cambios": cambios}))
+    return evento
+
+
+class Difusor:
+    """Último evento de tasas del proceso y aviso a todas las conexiones cuando cambia."""
+
+    def __init__(self, poll_s=None, obtener=fx_service.obtener_tasas):
+        self.poll_s = poll_s or getattr(settings, "NUAM_SSE_POLL_S", 5.0)
+        self.obtener = obtener
+        self._lock = threading.Lock()
+        self._ultimo = None  # ver _evento
+        self._hilo = None
+        self._suscriptores = set()  # (event loop, asyncio.Event) de las conexiones async
+        self.metricas = {"conexiones": 0, "abiertas": 0, "cambios": 0}
+
+    def publicar(self, data):
+        with self._lock:
+            evento = _evento(data, self._ultimo)
+            if self._ultimo is not None and self._ultimo["id"] == evento["id"]:
+                return False
+            self._ultimo = evento
+            self.metricas["cambios"] += 1
+            suscriptores = list(self._suscriptores)
+        for loop, ev in suscriptores:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                pass  # loop ya cerrado: la conexión se está yendo
+        return True
+
+    def _vigilar(self):
+        while True:
+            try:
+                if self.publicar(self.obtener()):
+                    logger.info("SSE: tasas nuevas para %s conexiones", self.metricas["abiertas"])
+            except fx_service.TasasNoDisponibles:
+                pass  # sin tasas todavía: las conexiones siguen con heartbeats
+            except Exception:
+                logger.error("SSE: fallo al leer tipos de cambio", exc_info=True)
+            time.sleep(self.poll_s)
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._vigilar, name="sse-tasas", daemon=True)
+                self._hilo.start()
+
+    def conexion(self, delta):
+        with self._lock:
+            self.metricas["abiertas"] += delta
+            if delta > 0:
+                self.metricas["conexiones"] += 1
+
+    def suscribir(self):
+        """(loop, asyncio.Event) de la conexión async en curso; `publicar` activa el evento."""
+        suscriptor = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._suscriptores.add(suscriptor)
+        return suscriptor
+
+    def desuscribir(self, suscriptor):
+        with self._lock:
+            self._suscriptores.discard(suscriptor)
+
+    def pendiente(self, visto):
+        """
+        (id, bytes) por enviar a una conexión que tiene las tasas `visto`: solo los cambios si
+        `visto` es el evento anterior, todas si no. None si ya está al día o aún no hay tasas.
+        """
+        with self._lock:
+            ultimo = self._ultimo
+        if ultimo is None or ultimo["id"] == visto:
+            return None
+        if visto is not None and visto == ultimo["anterior"]:
+            return ultimo["id"], ultimo["cambios"]
+        return ultimo["id"], ultimo["completo"]
+
+
+async def stream_async(ultimo_id=None, difusor=None, heartbeat_s=None, max_s=None):
+    """Generador async de bytes SSE para una conexión (ver docstring del módulo)."""
+    difusor = difusor or get_difusor()
+    heartbeat_s = heartbeat_s or getattr(settings, "NUAM_SSE_HEARTBEAT_S", 15.0)
+    max_s = max_s or getattr(settings, "NUAM_SSE_MAX_S", 300.0)
+    visto = ultimo_id or None
+    fin = time.monotonic() + max_s
+    suscriptor = difusor.suscribir()
+    aviso = suscriptor[1]
+    difusor.conexion(+1)
+    try:
+        yield f"retry: {RETRY_MS}\n\n".encode()
+        while True:
+            restante = fin - time.monotonic()
+            if restante <= 0:
+                return
+            # limpiar antes de mirar: un publicar posterior vuelve a activar el aviso
+            aviso.clear()
+            evento = difusor.pendiente(visto)
+            if evento is not None:
+                visto = evento[0]
+                yield evento[1]
+                continue
+            try:
+                await asyncio.wait_for(aviso.wait(), min(heartbeat_s, restante))
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+    finally:
+        difusor.desuscribir(suscriptor)
+        difusor.conexion(-1)
+
+
+_difusor = None
+_difusor_pid = None
+_difusor_lock = threading.Lock()
+
+
+def get_difusor():
+    """Difusor del proceso con su hilo en marcha (uno nuevo tras un fork)."""
+    global _difusor, _difusor_pid
+    with _difusor_lock:
+        if _difusor is None or _difusor_pid != os.getpid():
+            _difusor = Difusor()
+            _difusor_pid = os.getpid()
+        _difusor.iniciar()
+        return _difusor
+
+
+def metricas():
+    """Métricas del Difusor del proceso, sin ponerlo en marcha si nadie abrió un stream."""
+    with _difusor_lock:
+        if _difusor is None or _difusor_pid != os.getpid():
+            return {"conexiones": 0, "abiertas": 0, "cambios": 0}
+        return dict(_difusor.metricas)
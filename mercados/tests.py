@@ -1,3 +1,1314 @@
-from django.test import TestCase
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import DatabaseError, connection
+from django.db.models.query import QuerySet
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import pandas as pd
+
+import cliente_http
+import fx_service
+import kafka_service
+from kafka_config import KAFKA_TOPIC_EMPRESAS
+from kafka_memoria import BrokerMemoria, ConsumerMemoria, ProducerMemoria
+from mercados import (
+    benchmark, capitalizacion, consumidor, eventos, import_jobs, outbox, snapshot, sse, tipos_cambio, utils_import,
+)
+from mercados.models import ArchivoCargaMasiva, Empresa, EmpresaLectura, EventoOutbox, LayoutHoja, Pais, TipoCambio
+from mercados.signals import eventos_empresa_en_lote
+from mercados.utils_import import upsert_empresas
+
+TOPIC = "nuam.empresas.test"
+
+
+def evento(ticker, evento_id, delta=False, accion="EDITAR", **campos):
+    return {"v": eventos.SCHEMA_VERSION, "accion": accion, "ticker": ticker, "id": evento_id,
+            "delta": delta, "campos": campos, "evento_id": evento_id}
+
+
+def crear_paises():
+    return [Pais.objects.create(codigo=c, nombre=n, moneda=m, bolsa_nombre=b, ley_bursatil="-")
+            for c, n, m, b in (("CHL", "Chile", "CLP", "BCS"), ("COL", "Colombia", "COP", "bvc"),
+                               ("PER", "Perú", "PEN", "BVL"))]
+
+
+class ImportadorExcelTests(TestCase):
+    """import_empresas_from_excel: cada hoja se lee una sola vez y el encabezado se arma en memoria."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.libro = benchmark.generar_libro_bloques(os.path.join(cls.tmp.name, "bloques.xlsx"), 30)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        crear_paises()
+
+    def test_una_lectura_por_hoja(self):
+        lecturas = []
+        original = utils_import.WorkbookReader.raw
+
+        def raw(reader, sheet):
+            lecturas.append(sheet)
+            return original(reader, sheet)
+
+        with mock.patch.object(utils_import.WorkbookReader, "raw", raw):
+            res = utils_import.import_empresas_from_excel(self.libro, engine="openpyxl")
+
+        self.assertTrue(res["ok"], res.get("msg"))
+        self.assertEqual(lecturas, [benchmark.SHEET_BLOQUES])
+        # 30 emisores, más la fila de tipo de cambio bajo el encabezado (el importador la conserva)
+        self.assertEqual(Empresa.objects.filter(ticker__regex=r"^(BCS|BVC|BVL)[0-9]{7}$").count(), 30)
+        e = Empresa.objects.get(ticker="BVL0000002")
+        self.assertEqual((e.pais_id, e.moneda, e.mercado), ("PER", "PEN", "BVL"))
+
+    def test_frame_from_raw_equivale_a_read_excel(self):
+        for header_row in (15, 16):
+            esperado = pd.read_excel(self.libro, sheet_name=benchmark.SHEET_BLOQUES, header=header_row,
+                                     engine="openpyxl").dropna(how="all").reset_index(drop=True)
+            with utils_import.WorkbookReader(self.libro, engine="openpyxl") as xls:
+                df = utils_import.frame_from_raw(xls.raw(benchmark.SHEET_BLOQUES), header_row)
+            pd.testing.assert_frame_equal(df, esperado, check_dtype=False)
+
+    def test_archivo_inexistente_y_fila_fuera_de_rango(self):
+        res = utils_import.import_empresas_from_excel(os.path.join(self.tmp.name, "no.xlsx"))
+        self.assertFalse(res["ok"])
+        self.assertIsNone(utils_import.frame_from_raw(pd.DataFrame([[1, 2]]), 5))
+
+
+def fila(ticker, **campos):
+    return {"ticker": ticker, "nombre": f"Empresa {ticker}", "pais": None, "sector": None, "moneda": None,
+            "capitalizacion": None, "mercado": None, "fuente": "prueba", "fecha_reporte": None, **campos}
+
+
+class UpsertEmpresasTests(TestCase):
+    """upsert_empresas: escritura en bloques, sin consultas por fila."""
+
+    def test_crea_actualiza_y_cuenta_repetidas(self):
+        Empresa.objects.create(ticker="A", nombre="Vieja")
+        filas = [fila("A", nombre="Nueva"), fila("B"), fila("C", nombre="Primera"), fila("C", nombre="Última")]
+        conteo = upsert_empresas(filas, batch_size=2)
+
+        self.assertEqual(conteo, {"creadas": 2, "actualizadas": 1, "sin_cambios": 0, "repetidas": 1})
+        nombres = dict(Empresa.objects.values_list("ticker", "nombre"))
+        self.assertEqual(nombres, {"A": "Nueva", "B": "Empresa B", "C": "Última"})
+
+    def test_consultas_no_crecen_con_las_filas(self):
+        def consultas(n, prefijo):
+            with CaptureQueriesContext(connection) as ctx:
+                upsert_empresas([fila(f"{prefijo}{i:04d}") for i in range(n)], batch_size=1000)
+            return len(ctx)
+
+        # SQLite parte cada bloque según su límite de parámetros, pero nunca es una consulta por fila
+        self.assertLess(consultas(10, "P"), 10)
+        self.assertLess(consultas(500, "G"), 500 // 20)
+
+    def test_sin_filas_no_escribe(self):
+        with self.assertNumQueries(1):  # solo la lectura del estado actual
+            self.assertEqual(upsert_empresas([]), {"creadas": 0, "actualizadas": 0, "sin_cambios": 0, "repetidas": 0})
+
+
+class MeltBloquesTests(TestCase):
+    """Extracción columnar de los bloques BCS/BVC/BVL."""
+
+    def test_orden_fila_a_fila_y_normalizacion(self):
+        paises = {p.codigo.lower(): p for p in crear_paises()}
+        df = pd.DataFrame([
+            ["Banco A ", "BSA", "1,234.5", "Ecopetrol", "ECO", 10, None, None, None],
+            [None, None, None, "Grupo Ñandú S.A.", None, "n/d", "Credicorp", "BAP", " 2 500 "],
+        ])
+        blocks = {"bcs": {"emisor": 0, "ticker": 1, "cap": 2}, "bvc": {"emisor": 3, "ticker": 4, "cap": 5},
+                  "bvl": {"emisor": 6, "ticker": 7, "cap": 8}}
+        largo = utils_import._melt_blocks(df, blocks)
+        self.assertEqual(largo["bolsa"].tolist(), ["bcs", "bvc", "bvl"] * 2)
+
+        filas = utils_import._rows_from_melted(largo, paises)
+        # la celda vacía de BVL en la fila 0 y la de BCS en la fila 1 se descartan
+        self.assertEqual([f["ticker"] for f in filas], ["BSA", "ECO", "GRUPONANDU", "BAP"])
+        self.assertEqual([f["capitalizacion"] for f in filas], [1234.5, 10, None, 2500.0])
+        self.assertEqual(filas[0]["nombre"], "Banco A")
+        self.assertEqual((filas[3]["pais"].codigo, filas[3]["moneda"], filas[3]["mercado"]), ("PER", "PEN", "BVL"))
+
+    def test_bloque_sin_columna_de_cap(self):
+        df = pd.DataFrame([["Emisor", "TCK"]])
+        largo = utils_import._melt_blocks(df, {"bcs": {"emisor": 0, "ticker": 1, "cap": None}})
+        filas = utils_import._rows_from_melted(largo, {})
+        self.assertEqual((filas[0]["ticker"], filas[0]["capitalizacion"], filas[0]["pais"]), ("TCK", None, None))
+        self.assertEqual(len(utils_import._melt_blocks(df, {})), 0)
+
+
+class CargaIncrementalTests(TestCase):
+    """Cargas repetidas: contenido idéntico se omite y solo se escriben las filas que cambian."""
+
+    def test_contenido_identico_se_omite_salvo_forzar(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            previa = ArchivoCargaMasiva.objects.create(archivo=ContentFile(b"ticker,nombre\nA,B\n", name="a.csv"))
+            ArchivoCargaMasiva.objects.filter(pk=previa.pk).update(estado=ArchivoCargaMasiva.OK)
+            nueva = ArchivoCargaMasiva.objects.create(archivo=ContentFile(b"ticker,nombre\nA,B\n", name="b.csv"))
+            distinta = ArchivoCargaMasiva.objects.create(archivo=ContentFile(b"ticker,nombre\nA,C\n", name="c.csv"))
+
+            self.assertEqual(nueva.hash_contenido, previa.hash_contenido)
+            self.assertIn(f"#{previa.pk}", import_jobs.resultado_si_identica(nueva)["msg"])
+            self.assertIsNone(import_jobs.resultado_si_identica(distinta))
+            nueva.forzar = True
+            self.assertIsNone(import_jobs.resultado_si_identica(nueva))
+
+    def test_huella_sin_falsos_cambios_y_valores_no_finitos(self):
+        upsert_empresas([fila("A", capitalizacion=Decimal("10.5")), fila("B", capitalizacion=float("inf"))])
+        self.assertIsNone(Empresa.objects.get(ticker="B").capitalizacion)
+
+        # 10.50 como float y NaN (sin dato, igual que el NULL guardado) no cuentan como cambios
+        conteo = upsert_empresas([fila("A", capitalizacion=10.50), fila("B", capitalizacion=float("nan"))])
+        self.assertEqual((conteo["actualizadas"], conteo["sin_cambios"]), (0, 2))
+        self.assertEqual(utils_import.empresa_fingerprint(fila("C", capitalizacion=Decimal("-Infinity")))[4], None)
+        self.assertEqual(utils_import._parse_cap(pd.Series(["inf", "1,5"], dtype=object)).tolist(), [None, 15.0])
+
+
+class ImportacionStreamingTests(TestCase):
+    """CSV/Parquet por lotes: separador y encoding detectados, una transacción por lote."""
+
+    def setUp(self):
+        crear_paises()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def archivo(self, nombre, contenido, encoding="utf-8"):
+        path = os.path.join(self.tmp.name, nombre)
+        with open(path, "w", encoding=encoding, newline="") as fh:
+            fh.write(contenido)
+        return path
+
+    def test_csv_por_lotes_latin1_con_punto_y_coma(self):
+        path = self.archivo("empresas.csv", "Ticker;Nombre Emisor;País;Moneda;Market Cap;Fecha\n"
+                                            "SQM;Soquimich;Chile;CLP;1 500;2025-08-31\n"
+                                            ";Sin ticker;Chile;CLP;1;\n"
+                                            "ECO;Ecopetrol;COL;COP;n/d;\n"
+                                            "BAP;Crédito del Perú;Perú;PEN;;\n", encoding="latin-1")
+        avances = []
+        res = utils_import.import_empresas_streaming(path, progress=lambda pct, etapa: avances.append(pct),
+                                                     chunk_size=2)
+
+        self.assertTrue(res["ok"], res["msg"])
+        self.assertEqual((res["creadas"], len(avances), avances[-1]), (3, 2, 100))
+        self.assertIn("omitidas: 1", res["msg"])
+        bap = Empresa.objects.get(ticker="BAP")
+        self.assertEqual((bap.nombre, bap.pais_id, bap.capitalizacion), ("Crédito del Perú", "PER", None))
+        sqm = Empresa.objects.get(ticker="SQM")
+        self.assertEqual((sqm.capitalizacion, str(sqm.fecha_reporte)), (Decimal("1500"), "2025-08-31"))
+
+    def test_error_en_un_lote_conserva_los_anteriores(self):
+        path = self.archivo("e.csv", "ticker,nombre\nA,Uno\nB,Dos\nC,Tres\n")
+        original = utils_import.upsert_empresas
+        lotes = []
+
+        def falla_el_segundo(rows, **kwargs):
+            lotes.append(len(rows))
+            if len(lotes) == 2:
+                raise RuntimeError("disco lleno")
+            return original(rows, **kwargs)
+
+        with mock.patch.object(utils_import, "upsert_empresas", side_effect=falla_el_segundo):
+            res = utils_import.import_empresas_streaming(path, chunk_size=2)
+
+        self.assertFalse(res["ok"])
+        self.assertIn("lote 2", res["msg"])
+        self.assertEqual(sorted(Empresa.objects.values_list("ticker", flat=True)), ["A", "B"])
+
+    def test_sin_columnas_minimas_y_parquet_sin_pyarrow(self):
+        res = utils_import.import_empresas_streaming(self.archivo("x.csv", "a,b\n1,2\n"))
+        self.assertFalse(res["ok"])
+        self.assertIn("ticker y nombre", res["msg"])
+
+        path = self.archivo("x.parquet", "")
+        with mock.patch.object(utils_import.importlib.util, "find_spec", return_value=None):
+            res = utils_import.import_empresas_streaming(path)
+        self.assertIn("pyarrow", res["msg"])
+
+
+class LayoutCacheTests(TestCase):
+    """Huella de layout: un libro con el mismo formato reutiliza la detección guardada."""
+
+    def test_segundo_libro_con_el_mismo_formato_usa_la_cache(self):
+        crear_paises()
+        with tempfile.TemporaryDirectory() as tmp:
+            a = benchmark.generar_libro_bloques(os.path.join(tmp, "a.xlsx"), 9, semilla=1)
+            b = benchmark.generar_libro_bloques(os.path.join(tmp, "b.xlsx"), 12, semilla=2)
+            primero = utils_import.import_empresas_from_excel(a, engine="openpyxl")
+            with mock.patch.object(utils_import, "_detect_layout") as detectar:
+                segundo = utils_import.import_empresas_from_excel(b, engine="openpyxl")
+
+        self.assertEqual((primero["layout_cache"], segundo["layout_cache"]), (False, True))
+        detectar.assert_not_called()
+        layout = LayoutHoja.objects.get()
+        self.assertEqual((layout.usos, layout.modo), (1, "B"))
+        self.assertEqual(Empresa.objects.filter(ticker="BVL0000011").count(), 1)
+
+    def test_huella_ignora_titulos_pero_no_encabezados(self):
+        raw = pd.DataFrame([["Informe agosto 2025", None], [None, None], ["Ticker", "Market Cap"], ["A", 1]])
+        huella = utils_import.layout_huella("plano", "Hoja", raw, 2)
+
+        titulo = raw.copy()
+        titulo.iloc[0, 0] = "Informe septiembre 2025"
+        encabezado = raw.copy()
+        encabezado.iloc[2, 1] = "Cap. Bursátil"
+        self.assertEqual(utils_import.layout_huella("plano", "Hoja", titulo, 2), huella)
+        self.assertNotEqual(utils_import.layout_huella("plano", "Hoja", encabezado, 2), huella)
+        self.assertNotEqual(utils_import.layout_huella("plano", "Otra", raw, 2), huella)
+
+
+class BenchmarkProcesoTests(SimpleTestCase):
+    """La medición en proceso aparte no se cuelga si el hijo muere sin reportar."""
+
+    def test_hijo_muerto_reporta_exitcode_y_resultado_normal(self):
+        ctx = multiprocessing.get_context("spawn")
+        cola = ctx.Queue()
+        hijo = ctx.Process(target=os._exit, args=(3,))
+        hijo.start()
+        self.assertEqual(benchmark.esperar_resultado(cola, hijo, poll=0.1),
+                         ("error", "El proceso de medición terminó sin resultado (exitcode 3)"))
+
+        cola.put(("ok", [1]))
+        hijo = ctx.Process(target=os._exit, args=(0,))
+        hijo.start()
+        self.assertEqual(benchmark.esperar_resultado(cola, hijo, poll=0.1), ("ok", [1]))
+        hijo.join()
+
+
+class EventosEnLoteTests(TestCase):
+    """eventos_empresa_en_lote: outbox por bloques dentro de una transacción."""
+
+    def test_registra_por_bloques_y_una_vez_por_ticker(self):
+        with eventos_empresa_en_lote(lote=2):
+            a = Empresa.objects.create(ticker="A", nombre="A")
+            a.nombre = "A2"
+            a.save()  # mismo ticker en el bloque pendiente: un solo evento
+            self.assertEqual(EventoOutbox.objects.count(), 0)
+            Empresa.objects.create(ticker="B", nombre="B")
+            self.assertEqual(EventoOutbox.objects.count(), 2)  # se vació al llegar al tope
+            Empresa.objects.create(ticker="C", nombre="C")
+
+        eventos_por_ticker = dict(EventoOutbox.objects.values_list("clave", "payload__accion"))
+        self.assertEqual(eventos_por_ticker, {"A": "CREAR", "B": "CREAR", "C": "CREAR"})
+        self.assertEqual(EventoOutbox.objects.get(clave="A").payload["campos"]["nombre"], "A2")
+
+    def test_error_revierte_cambios_y_eventos(self):
+        with self.assertRaises(RuntimeError), eventos_empresa_en_lote(lote=1):
+            Empresa.objects.create(ticker="A", nombre="A")
+            Empresa.objects.create(ticker="B", nombre="B")
+            raise RuntimeError("falla a mitad de la carga")
+
+        self.assertFalse(Empresa.objects.exists())
+        self.assertFalse(EventoOutbox.objects.exists())
+        Empresa.objects.create(ticker="C", nombre="C")  # fuera del bloque vuelve al evento por save
+        self.assertEqual(EventoOutbox.objects.count(), 1)
+
+
+class OutboxTransaccionalTests(TransactionTestCase):
+    """Empresa.save y su fila de outbox se confirman o se revierten juntas (en autocommit)."""
+
+    def test_falla_del_outbox_revierte_el_cambio(self):
+        empresa = Empresa.objects.create(ticker="A", nombre="Original")
+        empresa.nombre = "Cambiado"
+        with mock.patch.object(outbox, "registrar_empresas", side_effect=DatabaseError("outbox lleno")):
+            with self.assertRaises(DatabaseError):
+                empresa.save()
+            with self.assertRaises(DatabaseError):
+                Empresa.objects.create(ticker="B", nombre="Nueva")
+
+        self.assertEqual(Empresa.objects.get(ticker="A").nombre, "Original")
+        self.assertFalse(Empresa.objects.filter(ticker="B").exists())
+        self.assertEqual(EventoOutbox.objects.count(), 1)  # solo el de la creación de A
+
+
+class RelayOutboxTests(TestCase):
+    """Reclamo de lotes del outbox y publicación sin reenvíos mientras hay mensajes en vuelo."""
+
+    def setUp(self):
+        for i in range(5):
+            Empresa.objects.create(ticker=f"T{i}", nombre=f"Empresa {i}")
+
+    def productor(self, latencia, cola_max=100):
+        self.broker = BrokerMemoria()
+        transporte = ProducerMemoria(self.broker, config={"queue.buffering.max.messages": cola_max},
+                                     latencia_ack_s=latencia)
+        p = kafka_service.ProductorEventos(transporte=transporte)
+        self.addCleanup(p.cerrar, 0.5)
+        return p
+
+    def test_dos_relays_reclaman_filas_distintas_y_el_lease_vence(self):
+        token1, lote1 = outbox.reclamar_lote(3)
+        token2, lote2 = outbox.reclamar_lote(3)
+        self.assertNotEqual(token1, token2)
+        self.assertEqual(([e.clave for e in lote1], [e.clave for e in lote2]), (["T0", "T1", "T2"], ["T3", "T4"]))
+        self.assertEqual(outbox.reclamar_lote(3)[1], [])
+
+        EventoOutbox.objects.filter(reclamo=token1).update(reclamado_en=timezone.now() - timedelta(minutes=5))
+        token3, lote3 = outbox.reclamar_lote(10, lease_s=60)
+        self.assertEqual([(e.clave, e.intentos) for e in lote3], [("T0", 2), ("T1", 2), ("T2", 2)])
+
+    def test_filas_en_vuelo_siguen_reclamadas_hasta_su_confirmacion(self):
+        productor = self.productor(latencia=0.5)
+        token, lote = outbox.reclamar_lote(10)
+        entregas = outbox.Entregas()
+        enviados = outbox.publicar([outbox._mensaje(token, ev) for ev in lote], productor=productor,
+                                   timeout=0.05, lease_s=60, entregas=entregas)
+
+        self.assertEqual((enviados, len(entregas)), ((0, 0), 5))
+        self.assertEqual(outbox.reclamar_lote(10)[1], [])  # otro relay no las toma
+        productor.flush(2)
+        self.assertEqual(entregas.aplicar(), (5, 0))
+        self.assertFalse(EventoOutbox.objects.filter(enviado_en__isnull=True).exists())
+        self.assertEqual(len(self.broker.mensajes(KAFKA_TOPIC_EMPRESAS)), 5)
+
+    def test_encolar_no_espera_mas_que_el_lease(self):
+        productor = self.productor(latencia=5, cola_max=2)
+        token, lote = outbox.reclamar_lote(10)
+        t0 = time.monotonic()
+        enviados = outbox.publicar([outbox._mensaje(token, ev) for ev in lote], productor=productor,
+                                   lease_s=0.4, entregas=outbox.Entregas())
+
+        self.assertLess(time.monotonic() - t0, 1)
+        self.assertEqual(enviados, (0, 3))  # los que no entraron a la cola se liberan
+        self.assertEqual(EventoOutbox.objects.filter(reclamo="").count(), 3)
+
+    def test_relay_once_espera_las_confirmaciones(self):
+        metricas = {}
+        total = outbox.run_relay(lote=2, once=True, retener_dias=0, productor=self.productor(latencia=0.05),
+                                 metricas=metricas)
+        self.assertEqual((total, metricas["emitidos"]), (5, 5))
+        self.assertFalse(EventoOutbox.objects.filter(enviado_en__isnull=True).exists())
+
+
+class EventosCodecTests(SimpleTestCase):
+    """Eventos de Empresa: codificación versionada, deltas y fusión de eventos seguidos."""
+
+    def empresa(self, **campos):
+        valores = dict(ticker="SQM-B", pk=7, nombre="SQM", pais_id="CHL", sector=None, moneda="CLP",
+                       capitalizacion=Decimal("1234.5"), mercado="BCS", fuente=None, fecha_reporte=date(2025, 8, 31))
+        return Empresa(**{**valores, **campos})
+
+    def test_evento_completo_y_delta_ida_y_vuelta(self):
+        completo = eventos.empresa_evento(self.empresa(), creada=True, delta=True)
+        self.assertEqual((completo["accion"], completo["delta"]), ("CREAR", False))
+        self.assertEqual(completo["campos"]["capitalizacion"], "1234.50")
+        self.assertEqual(completo["campos"]["fecha_reporte"], "2025-08-31")
+
+        anteriores = eventos.valores_empresa(self.empresa())
+        delta = eventos.empresa_evento(self.empresa(nombre="SQM S.A."), creada=False, anteriores=anteriores, delta=True)
+        self.assertEqual((delta["delta"], delta["campos"]), (True, {"nombre": "SQM S.A."}))
+
+        value, headers = eventos.codificar(delta, "json")
+        self.assertEqual(dict(headers), {"schema": b"1", "formato": b"json"})
+        self.assertEqual(eventos.decodificar(value, headers), delta)
+        self.assertEqual(eventos.decodificar(b'{"ticker": "X"}'), {"ticker": "X"})  # sin headers: JSON
+
+    def test_fusionar_completo_con_delta_sigue_completo(self):
+        crear = evento("A", 1, accion="CREAR", nombre="A", sector="Minería")
+        fusion = eventos.fusionar(crear, evento("A", 2, delta=True, nombre="A2"))
+        self.assertEqual((fusion["accion"], fusion["delta"], fusion["evento_id"], fusion["cambios"]),
+                         ("CREAR", False, 2, 2))
+        self.assertEqual(fusion["campos"], {"nombre": "A2", "sector": "Minería"})
+
+        # un evento completo reemplaza lo anterior; dos deltas se acumulan como delta
+        completo = eventos.fusionar(fusion, evento("A", 3, nombre="A3"))
+        self.assertEqual((completo["campos"], completo["cambios"]), ({"nombre": "A3"}, 3))
+        deltas = eventos.fusionar(evento("B", 4, delta=True, nombre="B"), evento("B", 5, delta=True, sector="X"))
+        self.assertEqual((deltas["delta"], deltas["campos"]), (True, {"nombre": "B", "sector": "X"}))
+
+    def test_formato_desconocido(self):
+        with self.assertRaises(ImproperlyConfigured):
+            eventos.codificar({}, "avro")
+
+
+class BufferCoalescenteTests(SimpleTestCase):
+    """Ventana de coalescencia del relay: un mensaje por ticker con el último estado."""
+
+    def setUp(self):
+        self.ahora = 100.0
+        reloj = mock.patch.object(outbox.time, "monotonic", lambda: self.ahora)
+        reloj.start()
+        self.addCleanup(reloj.stop)
+
+    def fila(self, pk, ticker, **campos):
+        return EventoOutbox(pk=pk, topic=TOPIC, clave=ticker, payload=evento(ticker, pk, **campos))
+
+    def test_fusiona_dentro_de_la_ventana_y_sale_al_vencer(self):
+        buffer = outbox.BufferCoalescente(ventana_s=2)
+        buffer.agregar("t", self.fila(1, "A", nombre="A1"))
+        self.ahora += 1
+        buffer.agregar("t", self.fila(2, "B", nombre="B1"))
+        buffer.agregar("t", self.fila(3, "A", nombre="A2"))
+
+        self.assertEqual(buffer.listos(), [])
+        self.assertEqual(buffer.vence_en(), 1.0)
+        self.ahora += 1
+        (topic, clave, payload, refs), = buffer.listos()  # A vence; B llegó después
+        self.assertEqual((clave, payload["campos"]["nombre"], payload["cambios"]), ("A", "A2", 2))
+        self.assertEqual(refs, [("t", 1), ("t", 3)])
+        self.assertEqual([m[1] for m in buffer.listos(todos=True)], ["B"])
+        self.assertEqual(buffer.metricas, {"recibidos": 3, "emitidos": 2, "coalescidos": 1})
+        self.assertIsNone(buffer.vence_en())
+
+    def test_tope_de_tickers_y_eventos_sin_clave(self):
+        buffer = outbox.BufferCoalescente(ventana_s=60, max_tickers=2)
+        for pk, ticker in enumerate(["A", "B", "C"], start=1):
+            buffer.agregar("t", self.fila(pk, ticker))
+        self.assertEqual([m[1] for m in buffer.listos()], ["A"])  # el más antiguo sale antes de tiempo
+
+        sin_clave = outbox.BufferCoalescente(ventana_s=60)
+        sin_clave.agregar("t", self.fila(1, ""))
+        sin_clave.agregar("t", self.fila(2, ""))
+        self.assertEqual(len(sin_clave), 2)
+
+
+class TransporteSelectivo:
+    """Transporte que confirma al instante salvo los mensajes con clave b"ajeno" (quedan en vuelo)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cola = []
+
+    def __len__(self):
+        return len(self._cola)
+
+    def produce(self, topic, value=None, key=None, headers=None, on_delivery=None, **kwargs):
+        with self._lock:
+            self._cola.append((key, on_delivery))
+
+    def poll(self, timeout=0):
+        with self._lock:
+            listos = [m for m in self._cola if m[0] != b"ajeno"]
+            self._cola = [m for m in self._cola if m[0] == b"ajeno"]
+        for _, cb in listos:
+            cb(None, None)
+        if not listos:
+            time.sleep(min(timeout, 0.01))
+        return len(listos)
+
+    def flush(self, timeout=None):
+        limite = time.monotonic() + (timeout or 0)
+        while len(self) and time.monotonic() < limite:
+            self.poll(0.01)
+        return len(self)
+
+
+class SnapshotTests(TransactionTestCase):
+    """Snapshot paralelo: checkpoint por lote, reanudación y confirmaciones propias."""
+
+    def setUp(self):
+        for i in range(20):
+            Empresa.objects.create(ticker=f"S{i:02d}", nombre=f"Empresa {i}")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "snapshot.json")
+
+    def productor(self, latencia=0.0):
+        self.broker = BrokerMemoria()
+        p = kafka_service.ProductorEventos(transporte=ProducerMemoria(self.broker, latencia_ack_s=latencia))
+        self.addCleanup(p.cerrar, 0.5)
+        return p
+
+    def claves(self):
+        return [m.key().decode() for m in self.broker.mensajes(TOPIC)]
+
+    def test_ctrl_c_guarda_el_avance_y_reanuda_sin_duplicados(self):
+        productor = self.productor(latencia=0.15)
+        cp = snapshot.nuevo_checkpoint(self.path, TOPIC, tramos=1)
+
+        def ctrl_c(enviados):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            snapshot.run_snapshot(cp, productor=productor, hilos=1, lote=2, progreso=ctrl_c)
+        guardado = snapshot.Checkpoint.cargar(self.path)
+        self.assertFalse(guardado.completo)
+        self.assertEqual(guardado.enviados, len(self.claves()))  # se detuvo tras el lote en curso
+        self.assertLess(guardado.enviados, 20)
+
+        snapshot.run_snapshot(guardado, productor=productor, hilos=3, lote=4)
+        claves = self.claves()
+        self.assertEqual(claves.count(snapshot.FIN_SNAPSHOT_CLAVE), 1)
+        claves.remove(snapshot.FIN_SNAPSHOT_CLAVE)
+        self.assertEqual(sorted(claves), [f"S{i:02d}" for i in range(20)])
+        self.assertTrue(snapshot.Checkpoint.cargar(self.path).estado["fin_enviado"])
+
+    def test_enviar_no_cuenta_mensajes_ajenos_del_productor(self):
+        productor = kafka_service.ProductorEventos(transporte=TransporteSelectivo())
+        self.addCleanup(productor.cerrar, 0.1)
+        productor.encolar(TOPIC, b"de otro hilo", key=b"ajeno")
+
+        self.assertEqual(snapshot._enviar(productor, TOPIC, [("S00", {"ticker": "S00"})], timeout=0.3), 0)
+        self.assertEqual(productor.pendientes(), 1)
+
+
+class ColaCargasTests(TransactionTestCase):
+    """Cola de ArchivoCargaMasiva: toma exclusiva, latido del worker y tope de intentos."""
+
+    def trabajo(self, **campos):
+        campos.setdefault("estado", ArchivoCargaMasiva.EN_COLA)
+        campos.setdefault("encolado_en", timezone.now())
+        return ArchivoCargaMasiva.objects.create(archivo="cargas/x.csv", hash_contenido="0" * 64, **campos)
+
+    def test_un_trabajo_nunca_lo_toman_dos_workers(self):
+        primero, segundo = self.trabajo(), self.trabajo()
+        visto = import_jobs.tomar_siguiente("w1")
+        self.assertEqual((visto.pk, visto.worker, visto.intentos), (primero.pk, "w1", 1))
+
+        # w2 lee la cola antes de que w1 confirme: el UPDATE condicional lo hace pasar al siguiente
+        original = QuerySet.first
+        lecturas = []
+
+        def first(qs):
+            lecturas.append(qs.model)
+            return visto if len(lecturas) == 1 else original(qs)
+
+        with mock.patch.object(QuerySet, "first", first):
+            otro = import_jobs.tomar_siguiente("w2")
+        self.assertEqual(otro.pk, segundo.pk)
+        self.assertEqual(ArchivoCargaMasiva.objects.get(pk=primero.pk).worker, "w1")
+        self.assertIsNone(import_jobs.tomar_siguiente("w3"))
+
+    def test_reencola_sin_latido_y_descarta_tras_el_tope(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        procesando = dict(estado=ArchivoCargaMasiva.PROCESANDO, actualizado_en=hace_una_hora)
+        vivo = self.trabajo(latido_en=timezone.now(), intentos=1, **procesando)  # etapa larga, worker vivo
+        caido = self.trabajo(latido_en=hace_una_hora, intentos=1, **procesando)
+        veneno = self.trabajo(latido_en=hace_una_hora, intentos=3, **procesando)
+
+        self.assertEqual(import_jobs.reencolar_colgados(30, max_intentos=3), (1, 1))
+        estados = dict(ArchivoCargaMasiva.objects.values_list("pk", "estado"))
+        self.assertEqual(estados, {vivo.pk: ArchivoCargaMasiva.PROCESANDO, caido.pk: ArchivoCargaMasiva.EN_COLA,
+                                   veneno.pk: ArchivoCargaMasiva.ERROR})
+        self.assertIn("3 intentos", ArchivoCargaMasiva.objects.get(pk=veneno.pk).resultado)
+
+    def test_latido_renueva_solo_los_trabajos_del_worker(self):
+        viejo = timezone.now() - timedelta(hours=1)
+        propio = self.trabajo(estado=ArchivoCargaMasiva.PROCESANDO, worker="w1", latido_en=viejo)
+        ajeno = self.trabajo(estado=ArchivoCargaMasiva.PROCESANDO, worker="w2", latido_en=viejo)
+        with import_jobs.Latido("w1", intervalo=0.02):
+            time.sleep(0.2)
+
+        self.assertGreater(ArchivoCargaMasiva.objects.get(pk=propio.pk).latido_en, viejo)
+        self.assertEqual(ArchivoCargaMasiva.objects.get(pk=ajeno.pk).latido_en, viejo)
+        self.assertEqual(import_jobs.reencolar_colgados(30), (1, 0))
+
+    def test_worker_en_marcha_reencola_los_trabajos_de_un_worker_caido(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        caido = self.trabajo(estado=ArchivoCargaMasiva.PROCESANDO, worker="muerto", latido_en=hace_una_hora,
+                             intentos=3)
+        vueltas = []
+
+        def parar():
+            vueltas.append(1)
+            return len(vueltas) > 3
+
+        with override_settings(NUAM_CARGAS_REVISAR_S=0):
+            import_jobs.run_worker(poll=0.01, should_stop=parar, reencolar_tras=30)
+        self.assertEqual(ArchivoCargaMasiva.objects.get(pk=caido.pk).estado, ArchivoCargaMasiva.ERROR)
+
+    def test_guardar_sin_cambiar_el_archivo_no_lo_lee(self):
+        legado = ArchivoCargaMasiva.objects.create(archivo="cargas/ya_no_existe.xlsx", hash_contenido="0" * 64)
+        ArchivoCargaMasiva.objects.filter(pk=legado.pk).update(hash_contenido="")  # fila anterior a los hashes
+        legado = ArchivoCargaMasiva.objects.get(pk=legado.pk)
+        legado.etapa = "Reintento"
+        legado.save(update_fields=["etapa"])
+        legado.save()
+        self.assertEqual(ArchivoCargaMasiva.objects.get(pk=legado.pk).etapa, "Reintento")
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            legado.archivo = ContentFile(b"ticker;nombre\n", name="nueva.csv")
+            legado.save()
+        self.assertEqual(len(ArchivoCargaMasiva.objects.get(pk=legado.pk).hash_contenido), 64)
+
+
+def pool_de_hilos(procesos):
+    # mismo contrato que parse_pool, en este proceso: los hijos "spawn" abrirían la BD real, no la de pruebas
+    return ThreadPoolExecutor(max_workers=procesos)
+
+
+@mock.patch.object(utils_import, "parse_pool", pool_de_hilos)
+@mock.patch.object(import_jobs, "parse_pool", pool_de_hilos)
+class LecturaParalelaTests(TransactionTestCase):
+    """Lectura de hojas y archivos en paralelo con un único escritor."""
+
+    def setUp(self):
+        crear_paises()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_hojas_en_paralelo_gana_la_primera_valida(self):
+        path = benchmark.generar_libro_bloques(os.path.join(self.tmp.name, "a.xlsx"), 12)
+        paralelo = utils_import.parse_excel(path, engine="openpyxl", procesos=2)
+        secuencial = utils_import.parse_excel(path, engine="openpyxl")
+
+        self.assertEqual(paralelo["sheet"], benchmark.SHEET_BLOQUES)
+        self.assertEqual(paralelo["rows"], secuencial["rows"])
+        vacio = utils_import.parse_excel(path, engine="openpyxl", procesos=2, sheets=["Portada | Cover", "Otra"])
+        self.assertFalse(vacio["ok"])
+
+    def test_escritor_respeta_el_orden_de_la_cola(self):
+        with override_settings(MEDIA_ROOT=self.tmp.name):
+            for semilla in (1, 2):
+                path = benchmark.generar_libro_bloques(os.path.join(self.tmp.name, f"{semilla}.xlsx"), 6, semilla)
+                with open(path, "rb") as fh:
+                    ArchivoCargaMasiva.objects.create(archivo=ContentFile(fh.read(), name=f"informe{semilla}.xlsx"),
+                                                      estado=ArchivoCargaMasiva.EN_COLA, encolado_en=timezone.now())
+            hechos = import_jobs.run_writer(2, poll=0.01, once=True)
+
+        self.assertEqual(hechos, 2)
+        self.assertEqual(set(ArchivoCargaMasiva.objects.values_list("estado", flat=True)), {ArchivoCargaMasiva.OK})
+        # mismos tickers en los dos informes: quedan los valores del último encolado
+        esperado = utils_import.parse_excel(path)["rows"]
+        cap = {t[0]: t[5] for t in esperado}
+        self.assertEqual(float(Empresa.objects.get(ticker="BVL0000002").capitalizacion),
+                         round(cap["BVL0000002"], 2))
+
+
+class ProductorEventosTests(SimpleTestCase):
+    """Producer no bloqueante: el hilo de poll confirma las entregas y la cola local es acotada."""
+
+    def productor(self, cola_max=100, latencia=0.0, **kwargs):
+        transporte = ProducerMemoria(BrokerMemoria(), config={"queue.buffering.max.messages": cola_max},
+                                     latencia_ack_s=latencia)
+        p = kafka_service.ProductorEventos(transporte=transporte, **kwargs)
+        self.addCleanup(p.cerrar, 1.0)
+        return p
+
+    def test_encolar_no_espera_al_broker_y_el_hilo_confirma(self):
+        p = self.productor(latencia=0.3)
+        confirmados = threading.Event()
+        t0 = time.monotonic()
+        self.assertTrue(p.encolar(TOPIC, b"x", key=b"A", callback=lambda err, msg: confirmados.set()))
+        self.assertLess(time.monotonic() - t0, 0.1)
+        self.assertTrue(confirmados.wait(2))  # sin flush: lo atendió el hilo de poll
+        self.assertEqual(p.metricas["entregados"], 1)
+
+    def test_cola_llena_descarta_o_espera(self):
+        p = self.productor(cola_max=1, latencia=0.2, desborde=kafka_service.DESCARTAR)
+        self.assertTrue(p.encolar(TOPIC, b"1"))
+        self.assertFalse(p.encolar(TOPIC, b"2"))
+        self.assertEqual(p.metricas["descartados"], 1)
+        # con "esperar" vuelve a entrar cuando el hilo libera la cola
+        self.assertTrue(p.encolar(TOPIC, b"3", desborde=kafka_service.ESPERAR, espera_max_s=2))
+        self.assertFalse(p.encolar(TOPIC, b"4", desborde=kafka_service.ESPERAR, espera_max_s=0.05))
+
+    def test_productor_del_proceso_se_recrea_tras_fork(self):
+        with mock.patch.object(kafka_service, "ProductorEventos") as clase, \
+                mock.patch.multiple(kafka_service, _productor=None, _productor_pid=None):
+            with mock.patch.object(kafka_service.os, "getpid", return_value=1):
+                primero = kafka_service.get_productor()
+                self.assertIs(kafka_service.get_productor(), primero)
+            with mock.patch.object(kafka_service.os, "getpid", return_value=2):
+                kafka_service.get_productor()
+        self.assertEqual(clase.call_count, 2)
+
+
+class TransporteMemoriaTests(TestCase):
+    """Transporte de Kafka en memoria y benchmark del camino de eventos."""
+
+    def test_producer_memoria_confirma_tras_la_latencia(self):
+        broker = BrokerMemoria()
+        producer = ProducerMemoria(broker, config={"queue.buffering.max.messages": 2}, latencia_ack_s=0.2)
+        confirmados = []
+        producer.produce(TOPIC, b"1", key=b"A", on_delivery=lambda err, msg: confirmados.append(msg.value()))
+        producer.produce(TOPIC, b"2", key=b"A", on_delivery=lambda err, msg: confirmados.append(msg.value()))
+        with self.assertRaises(BufferError):
+            producer.produce(TOPIC, b"3", key=b"A")
+        self.assertEqual(len(broker.mensajes(TOPIC)), 2)  # en el log al producirse
+        self.assertEqual(producer.poll(0), 0)
+        self.assertEqual(confirmados, [])
+        self.assertEqual(producer.flush(2), 0)
+        self.assertEqual(confirmados, [b"1", b"2"])
+
+    def test_crear_transporte_por_nombre(self):
+        self.assertIsInstance(kafka_service.crear_transporte("memoria", {}, latencia_ack_s=0), ProducerMemoria)
+        with self.assertRaises(ValueError):
+            kafka_service.crear_transporte("rabbit", {})
+
+    def test_medir_eventos_reporta_escenarios_y_revierte(self):
+        resultados = benchmark.medir_eventos(saves=5, filas_bulk=20, latencia_ms=0)
+        escenarios = {r["escenario"]: r for r in resultados}
+        self.assertIn("serializacion json", escenarios)
+        self.assertEqual(escenarios["save individual"]["saves"], 5)
+        self.assertEqual(escenarios["carga masiva"]["eventos"], 20)
+        # 5 saves con el receiver + 20 del upsert + 20 del registro medido aparte
+        self.assertEqual(escenarios["relay (transporte memoria)"]["eventos"], 45)
+        self.assertFalse(Empresa.objects.exists())
+        self.assertFalse(EventoOutbox.objects.exists())
+
+
+class ConsumidorLecturaTests(TransactionTestCase):
+    """El consumidor de eventos contra un broker en memoria (sin Kafka real)."""
+
+    def setUp(self):
+        Pais.objects.create(codigo="CHL", nombre="Chile", moneda="CLP", bolsa_nombre="BCS", ley_bursatil="-")
+        self.broker = BrokerMemoria(particiones=3)
+
+    def publicar(self, ev):
+        value, headers = eventos.codificar(ev, "json")
+        return self.broker.producir(TOPIC, value, key=ev["ticker"].encode(), headers=headers)
+
+    def trabajador(self, grupo="lectura", **kwargs):
+        consumer = ConsumerMemoria(self.broker, {"group.id": grupo, "auto.offset.reset": "earliest"})
+        kwargs.setdefault("poll", 0.01)
+        return consumidor.TrabajadorLectura(consumer, topics=[TOPIC], **kwargs)
+
+    def confirmados(self, grupo="lectura"):
+        return {p: self.broker.confirmado(grupo, TOPIC, p) for p in range(self.broker.particiones)}
+
+    def fin(self):
+        return {p: self.broker.fin(TOPIC, p) or None for p in range(self.broker.particiones)}
+
+    def test_materializa_eventos_y_confirma_offsets(self):
+        for i in range(30):
+            self.publicar(evento(f"T{i:03d}", i + 1, accion="CREAR", nombre=f"Empresa {i}", pais="CHL",
+                                 capitalizacion="10.50", fecha_reporte="2025-08-31"))
+        m = self.trabajador(hilos=3, lote=7).run(once=True)
+
+        self.assertEqual((m["mensajes"], m["aplicados"], m["errores"]), (30, 30, 0))
+        self.assertEqual(EmpresaLectura.objects.count(), 30)
+        fila = EmpresaLectura.objects.get(ticker="T007")
+        self.assertEqual((fila.nombre, fila.pais_codigo, fila.pais_nombre), ("Empresa 7", "CHL", "Chile"))
+        self.assertEqual(fila.capitalizacion, Decimal("10.50"))
+        self.assertEqual(str(fila.fecha_reporte), "2025-08-31")
+        self.assertEqual(self.confirmados(), self.fin())
+
+    def test_delta_se_fusiona_con_la_fila(self):
+        self.publicar(evento("BSANTANDER", 1, accion="CREAR", nombre="Banco", sector="Financiero", pais="CHL"))
+        self.publicar(evento("BSANTANDER", 2, delta=True, nombre="Banco Santander"))
+        self.trabajador().run(once=True)
+
+        fila = EmpresaLectura.objects.get(ticker="BSANTANDER")
+        self.assertEqual((fila.nombre, fila.sector, fila.evento_id), ("Banco Santander", "Financiero", 2))
+
+    def test_snapshot_no_descarta_eventos_posteriores_ni_pisa_los_aplicados(self):
+        self.publicar(evento("COPEC", 5, accion="CREAR", nombre="Copec nuevo", pais="CHL"))
+        snap = evento("COPEC", 9, accion="SNAPSHOT", nombre="Copec viejo", sector="Energía", pais="CHL")
+        snap.pop("evento_id")
+        self.publicar(snap)
+        self.publicar(evento("COPEC", 7, delta=True, sector="Combustibles"))  # id menor, confirmado después
+        snap_nueva = evento("NUEVA", 0, accion="SNAPSHOT", nombre="Nueva", pais="CHL")
+        snap_nueva.pop("evento_id")
+        self.publicar(snap_nueva)
+        self.trabajador().run(once=True)
+
+        copec = EmpresaLectura.objects.get(ticker="COPEC")
+        self.assertEqual((copec.nombre, copec.sector, copec.evento_id), ("Copec nuevo", "Combustibles", 7))
+        nueva = EmpresaLectura.objects.get(ticker="NUEVA")
+        self.assertEqual((nueva.nombre, nueva.evento_id), ("Nueva", 0))
+
+    def test_reentrega_es_idempotente(self):
+        self.publicar(evento("SQM-B", 5, nombre="SQM nuevo"))
+        self.publicar(evento("SQM-B", 3, nombre="SQM viejo"))  # replay de un evento anterior
+        self.trabajador().run(once=True)
+        # otro grupo relee todo desde el principio sobre la misma tabla
+        m = self.trabajador(grupo="otro").run(once=True)
+
+        self.assertEqual(EmpresaLectura.objects.get(ticker="SQM-B").nombre, "SQM nuevo")
+        self.assertEqual((m["aplicados"], m["omitidos"]), (0, 2))
+
+    def test_mensajes_sin_version_e_invalidos(self):
+        self.broker.producir(TOPIC, b'{"id": 9, "ticker": "LEGADO", "nombre": "Legado", "pais": "CHL", "accion": "CREAR"}',
+                             key=b"LEGADO")
+        self.broker.producir(TOPIC, b"no es json", key=b"LEGADO")
+        m = self.trabajador().run(once=True)
+
+        self.assertEqual(EmpresaLectura.objects.get(ticker="LEGADO").pais_nombre, "Chile")
+        self.assertEqual((m["aplicados"], m["invalidos"]), (1, 1))
+        self.assertEqual(self.confirmados(), self.fin())  # el mensaje ilegible no bloquea la partición
+
+    def test_error_de_escritura_no_confirma_y_reintenta(self):
+        self.publicar(evento("FALLA", 1, accion="CREAR", nombre="Falla"))
+        original = consumidor.aplicar_eventos
+        llamadas = []
+
+        def falla_una_vez(evs):
+            llamadas.append(len(evs))
+            if len(llamadas) == 1:
+                raise RuntimeError("BD caída")
+            return original(evs)
+
+        t = self.trabajador()
+        with mock.patch.object(consumidor, "aplicar_eventos", side_effect=falla_una_vez):
+            m = t.run(once=False, should_stop=lambda: t.metricas["aplicados"] > 0 or len(llamadas) > 5)
+
+        self.assertEqual((m["errores"], m["aplicados"]), (1, 1))
+        self.assertEqual(EmpresaLectura.objects.get(ticker="FALLA").nombre, "Falla")
+        self.assertEqual(self.confirmados(), self.fin())
+
+    def test_rebalanceo_reparte_particiones_sin_perder_eventos(self):
+        for i in range(60):
+            self.publicar(evento(f"R{i:03d}", i + 1, accion="CREAR", nombre=f"R{i}"))
+        a = self.trabajador(lote=5)
+        a.consumer.subscribe(a.topics, on_assign=a._on_assign, on_revoke=a._on_revoke)
+        # A procesa un par de lotes solo y luego entra B al grupo
+        with consumidor.ThreadPoolExecutor(max_workers=2) as pool:
+            for _ in range(2):
+                a.procesar_lote(a.consumer.consume(num_messages=a.lote), pool)
+            b = self.trabajador(lote=5)
+            mb = b.run(once=True)
+            # B sale del grupo al terminar: A recupera todas las particiones desde lo confirmado
+            while mensajes := a.consumer.consume(num_messages=a.lote):
+                a.procesar_lote(mensajes, pool)
+        a.consumer.close()
+
+        self.assertGreater(mb["aplicados"], 0)
+        self.assertEqual(EmpresaLectura.objects.count(), 60)
+        self.assertEqual(a.metricas["aplicados"] + mb["aplicados"], 60)
+        self.assertEqual(self.confirmados(), self.fin())
+
+
+class TiposCambioTests(TestCase):
+    """Histórico de tipos de cambio: upsert por (moneda, fecha) y lectura por rango."""
+
+    def test_guardar_es_upsert_y_serie_lee_el_rango(self):
+        filas = [(date(2025, 1, d), m, t * d) for d in range(1, 11) for m, t in (("CLP", 900.0), ("PEN", 3.0))]
+        self.assertEqual(tipos_cambio.guardar(filas, fuente="prueba", lote=7), 20)
+        tipos_cambio.guardar([(date(2025, 1, 5), "CLP", 1.0), (date(2025, 1, 5), "COP", 4000.0)], monedas=["CLP"])
+
+        self.assertEqual(TipoCambio.objects.count(), 20)
+        with self.assertNumQueries(1):
+            fechas, tasas = tipos_cambio.serie(["CLP", "PEN", "COP"], date(2025, 1, 4), date(2025, 1, 6))
+        self.assertEqual(fechas, [date(2025, 1, 4), date(2025, 1, 5), date(2025, 1, 6)])
+        self.assertEqual(tasas["CLP"][date(2025, 1, 5)], 1.0)
+        self.assertEqual(tasas["PEN"][date(2025, 1, 6)], 18.0)
+        self.assertEqual(tasas["COP"], {})
+
+    def test_dashboard_etiqueta_la_base_realmente_usada(self):
+        hoy = timezone.localdate()
+        tipos_cambio.guardar([(hoy, "CLP", 950.0), (hoy, "PEN", 3.8)], fuente="prueba")
+        data = {"date": hoy.isoformat(), "rates": {"USD": 1.0, "CLP": 950.0, "PEN": 3.8}}
+        tasas = (fx_service.MatrizCruzada(data, 100.0), {**data, "obtenido_en": 100.0, "desactualizado": False})
+        with mock.patch.object(fx_service, "obtener_matriz", return_value=tasas):
+            r = self.client.get("/api/convertir-moneda-dashboard/?base=COP&periodo=1").json()
+            self.assertEqual(r["base"], "USD")  # sin tasa de COP: todo en USD
+            self.assertEqual({s["label"] for s in r["series"]}, {"CLP vs USD", "PEN vs USD"})
+            self.assertEqual(r["labels_historico"], [hoy.isoformat()])
+
+            r = self.client.get("/api/convertir-moneda-dashboard/?base=PEN&periodo=1").json()
+            self.assertEqual(r["base"], "PEN")
+            self.assertIn("CLP vs PEN", {s["label"] for s in r["series"]})
+
+
+class CapitalizacionUsdTests(TestCase):
+    """Capitalización en USD: al guardar, en cargas masivas y al refrescar las tasas."""
+
+    def setUp(self):
+        self.chl = Pais.objects.create(codigo="CHL", nombre="Chile", moneda="CLP", bolsa_nombre="BCS", ley_bursatil="-")
+        self.per = Pais.objects.create(codigo="PER", nombre="Perú", moneda="PEN", bolsa_nombre="BVL", ley_bursatil="-")
+        tipos_cambio.guardar([(date(2025, 1, 1), "CLP", 1000.0), (date(2025, 1, 2), "CLP", 500.0),
+                              (date(2025, 1, 2), "PEN", 4.0)])
+
+    def test_save_upsert_y_recalculo_por_moneda(self):
+        Empresa.objects.create(ticker="CHL1", nombre="A", pais=self.chl, moneda="CLP", capitalizacion=Decimal("1000000"))
+        upsert_empresas([{"ticker": "PER1", "nombre": "B", "pais": self.per, "sector": None, "moneda": "PEN",
+                          "capitalizacion": Decimal("12000"), "mercado": None, "fuente": None, "fecha_reporte": None}])
+        usd = dict(Empresa.objects.values_list("ticker", "capitalizacion_usd"))
+        self.assertEqual(usd, {"CHL1": 2000.0, "PER1": 3000.0})  # tasa más reciente
+
+        tipos_cambio.guardar([(date(2025, 1, 3), "CLP", 250.0)])  # guardar tasas recalcula
+        self.assertEqual(Empresa.objects.get(ticker="CHL1").capitalizacion_usd, 4000.0)
+        with self.assertNumQueries(3):  # monedas en uso, tasa vigente de CLP, un UPDATE
+            self.assertEqual(capitalizacion.recalcular(["CLP"]), 1)
+
+    def test_save_sin_cambiar_monto_ni_moneda_no_consulta_tasas(self):
+        Empresa.objects.create(ticker="CHL1", nombre="A", pais=self.chl, moneda="CLP", capitalizacion=Decimal("1000000"))
+        empresa = Empresa.objects.get(ticker="CHL1")
+        empresa.nombre = "A2"
+        with CaptureQueriesContext(connection) as ctx:
+            empresa.save()
+        self.assertFalse([q for q in ctx.captured_queries if "tipocambio" in q["sql"].lower()])
+
+        # varios saves en un bloque: la tasa de cada moneda se lee una vez
+        empresas = [Empresa(ticker=f"CHL{i}", nombre="B", pais=self.chl, moneda="CLP", capitalizacion=Decimal(i))
+                    for i in range(2, 6)]
+        with CaptureQueriesContext(connection) as ctx, eventos_empresa_en_lote():
+            for e in empresas:
+                e.save()
+        self.assertEqual(len([q for q in ctx.captured_queries if "tipocambio" in q["sql"].lower()]), 1)
+        self.assertEqual(Empresa.objects.get(ticker="CHL5").capitalizacion_usd, 0.01)
+
+    def test_ranking_regional_en_usd(self):
+        # en moneda local CHL1 "gana"; en USD la más grande es la peruana
+        Empresa.objects.create(ticker="CHL1", nombre="A", pais=self.chl, moneda="CLP", capitalizacion=Decimal("1000000"))
+        Empresa.objects.create(ticker="PER1", nombre="B", pais=self.per, moneda="PEN", capitalizacion=Decimal("12000"))
+        Empresa.objects.create(ticker="XXX1", nombre="C", pais=self.per, moneda="XXX", capitalizacion=Decimal("1"))
+
+        r = self.client.get("/api/top-empresas/?n=3").json()
+        self.assertEqual([e["ticker"] for e in r["resultados"]], ["PER1", "CHL1", "XXX1"])
+        self.assertEqual(r["total_usd"], 5000.0)
+        self.assertEqual(r["resultados"][0]["percentil"], 100.0)
+        self.assertEqual(r["resultados"][0]["participacion"], 60.0)
+        self.assertIsNone(r["resultados"][2]["capitalizacion_usd"])
+
+
+class ConversionLoteTests(SimpleTestCase):
+    """Conversión por lotes de fx_service: mismo orden que la entrada y errores por ítem."""
+
+    RATES = {"USD": 1.0, "CLP": 950.0, "PEN": 3.8}
+
+    def test_convierte_en_orden_con_errores_por_item(self):
+        montos, monedas, destinos = fx_service.leer_lote(
+            b"monto,moneda,destino\n950,CLP,USD\nabc,CLP,USD\n10,EUR,USD\n1,USD,\n", "text/csv", destino="PEN")
+        resultados, errores = fx_service.convertir_lote(montos, monedas, destinos, self.RATES)
+
+        self.assertEqual(resultados, [1.0, None, None, 3.8])
+        self.assertEqual([e["indice"] for e in errores], [1, 2])
+        self.assertIn("EUR", errores[1]["error"])
+
+    def test_booleanos_listas_y_null_son_errores_del_item(self):
+        montos, monedas, destinos = fx_service.leer_lote(
+            b'[{"monto": true}, {"monto": [1]}, {"monto": "950"}, {"monto": null}, {"monto": {"v": 1}}, 950]',
+            "application/json", moneda="CLP")
+        resultados, errores = fx_service.convertir_lote(montos, monedas, destinos, self.RATES)
+
+        self.assertEqual(resultados, [None, None, 1.0, None, None, 1.0])
+        self.assertEqual([e["indice"] for e in errores], [0, 1, 3, 4])
+        self.assertTrue(all(e["error"] == "El monto debe ser un número válido" for e in errores))
+
+        # lista de montos sin otros tipos: tampoco se cuela un booleano
+        resultados, errores = fx_service.convertir_lote([True, 1900], ["CLP", "CLP"], ["USD", "USD"], self.RATES)
+        self.assertEqual(resultados, [None, 2.0])
+        self.assertEqual([e["indice"] for e in errores], [0])
+
+    def test_cuerpo_json_invalido(self):
+        with self.assertRaises(ValueError):
+            fx_service.leer_lote(b'{"monto": 1}', "application/json")
+
+
+class MatrizCruzadaTests(SimpleTestCase):
+
+    def test_tipos_cruzados_y_version(self):
+        data = {"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 950.0, "PEN": 3.8}}
+        m = fx_service.MatrizCruzada(data, obtenido_en=100.0)
+
+        self.assertAlmostEqual(m.tasa("PEN", "CLP"), 250.0)
+        self.assertAlmostEqual(m.tasa("CLP", "USD"), 1 / 950.0)
+        self.assertEqual(m.columna("PEN")["PEN"], 1.0)
+        self.assertNotEqual(m.version, fx_service.MatrizCruzada(data, obtenido_en=200.0).version)
+
+
+class MatrizEtagTests(SimpleTestCase):
+    """La matriz responde 304 mientras no cambien las tasas, su estado ni el día."""
+
+    def tasas(self, clp, obtenido_en, desactualizado=False):
+        data = {"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": clp}}
+        return fx_service.MatrizCruzada(data, obtenido_en), {**data, "obtenido_en": obtenido_en,
+                                                               "desactualizado": desactualizado}
+
+    def get(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get("/api/tipos-cambio/matriz/?base=CLP", **headers)
+
+    def test_304_con_la_misma_version_y_200_al_cambiar(self):
+        with mock.patch.object(fx_service, "obtener_matriz", return_value=self.tasas(950.0, 100.0)):
+            r = self.get()
+            etag = r["ETag"]
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(self.get(etag).status_code, 304)
+
+        with mock.patch.object(fx_service, "obtener_matriz", return_value=self.tasas(960.0, 200.0)):
+            r = self.get(etag)
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.json()["valores"]["USD"], 960.0)
+
+        # mismas tasas, ahora vencidas: el cuerpo cambia (`desactualizado`) y el ETag también
+        with mock.patch.object(fx_service, "obtener_matriz", return_value=self.tasas(950.0, 100.0, True)):
+            self.assertEqual(self.get(etag).status_code, 200)
+
+
+class CircuitoTests(SimpleTestCase):
+
+    def test_abre_tras_fallos_y_deja_pasar_una_prueba(self):
+        c = cliente_http.Circuito("api", fallos_max=2, abierto_s=0)
+        c.fallo()
+        self.assertEqual(c.estado()["estado"], cliente_http.CERRADO)
+        c.fallo()
+        self.assertEqual(c.estado()["estado"], cliente_http.ABIERTO)
+
+        # vencido el plazo: una sola llamada de prueba a la vez
+        self.assertTrue(c.permitir())
+        self.assertFalse(c.permitir())
+        c.exito()
+        self.assertEqual(c.estado()["estado"], cliente_http.CERRADO)
+        self.assertTrue(c.permitir())
+
+
+class SesionStub:
+    """Session falsa: cada get() devuelve (o lanza) lo siguiente de `respuestas` y anota el timeout."""
+
+    def __init__(self, *respuestas):
+        self.respuestas = list(respuestas)
+        self.timeouts = []
+
+    def get(self, url, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        r = self.respuestas.pop(0) if len(self.respuestas) > 1 else self.respuestas[0]
+        if isinstance(r, BaseException):
+            raise r
+        return mock.Mock(status_code=r)
+
+
+class ClienteHTTPTests(SimpleTestCase):
+    """Reintentos dentro del presupuesto, circuito abierto y liberación de la llamada de prueba."""
+    URL = "http://proveedor.test/usd"
+
+    def cliente(self, *respuestas, **kwargs):
+        c = cliente_http.ClienteHTTP(**{"backoff_s": 0.01, "fallos_max": 2, "abierto_s": 30, **kwargs})
+        c.session = SesionStub(*respuestas)
+        return c
+
+    def test_reintenta_errores_transitorios(self):
+        c = self.cliente(503, cliente_http.requests.ConnectionError("reset"), 200)
+        self.assertEqual(c.get(self.URL, timeout=5).status_code, 200)
+        self.assertEqual(len(c.session.timeouts), 3)
+        self.assertEqual(c.circuito(self.URL).estado()["fallos_seguidos"], 0)
+
+    def test_no_pasa_del_presupuesto_y_los_timeouts_son_positivos(self):
+        c = self.cliente(cliente_http.requests.ConnectionError("caído"), reintentos=100)
+        t0 = time.monotonic()
+        with self.assertRaises(cliente_http.requests.ConnectionError):
+            c.get(self.URL, timeout=0.5)
+        self.assertLess(time.monotonic() - t0, 0.6)
+        self.assertLess(len(c.session.timeouts), 100)
+
+        c = self.cliente(200)
+        for presupuesto in (0, -1):
+            c.get(self.URL, timeout=presupuesto)
+        self.assertTrue(all(conectar > 0 and leer > 0 for conectar, leer in c.session.timeouts))
+
+    def test_circuito_abierto_no_toca_la_red(self):
+        c = self.cliente(503, reintentos=0)
+        for _ in range(2):
+            with self.assertRaises(cliente_http.requests.HTTPError):
+                c.get(self.URL)
+        with self.assertRaises(cliente_http.CircuitoAbierto):
+            c.get(self.URL)
+        self.assertEqual(len(c.session.timeouts), 2)
+
+    def test_la_prueba_se_libera_ante_una_excepcion_inesperada(self):
+        c = self.cliente(503, reintentos=0, fallos_max=1, abierto_s=0)
+        with self.assertRaises(cliente_http.requests.HTTPError):
+            c.get(self.URL)
+        c.session = SesionStub(KeyboardInterrupt())
+        with self.assertRaises(KeyboardInterrupt):
+            c.get(self.URL)  # era la llamada de prueba (semiabierto)
+        self.assertTrue(c.circuito(self.URL).permitir())
+
+
+class TasasAsyncTests(SimpleTestCase):
+
+    def test_requests_concurrentes_comparten_una_descarga(self):
+        llamadas = []
+
+        async def proveedor_lento(url, timeout=None):
+            llamadas.append(url)
+            await asyncio.sleep(0.05)
+            return {"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 950.0}}
+
+        with tempfile.TemporaryDirectory() as directorio:
+            cache = fx_service.CacheTasas("http://proveedor.test/usd", directorio=directorio,
+                                          proveedor_async=proveedor_lento)
+
+            async def muchos():
+                return await asyncio.gather(*[cache.tasas_async() for _ in range(200)])
+
+            respuestas = asyncio.run(muchos())
+
+        self.assertEqual(len(llamadas), 1)
+        self.assertTrue(all(r["rates"]["CLP"] == 950.0 and not r["desactualizado"] for r in respuestas))
+
+
+class CacheTasasTests(SimpleTestCase):
+    """Caché de tasas: una sola descarga entre hilos y workers, lockfile viejo y espera tras fallar."""
+    DATA = {"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 950.0}}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directorio = tmp.name
+
+    def cache(self, proveedor, **kwargs):
+        return fx_service.CacheTasas("http://proveedor.test/usd", directorio=self.directorio,
+                                     proveedor=proveedor, timeout_s=1, **kwargs)
+
+    def test_primer_uso_concurrente_descarga_una_vez(self):
+        llamadas = []
+
+        def proveedor_lento(url, timeout=None):
+            llamadas.append(url)
+            time.sleep(0.1)
+            return self.DATA
+
+        # dos instancias sobre el mismo directorio hacen de dos workers
+        caches = [self.cache(proveedor_lento), self.cache(proveedor_lento)]
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            respuestas = list(pool.map(lambda i: caches[i % 2].tasas(), range(32)))
+        self.assertEqual(len(llamadas), 1)
+        self.assertTrue(all(r["rates"]["CLP"] == 950.0 for r in respuestas))
+
+    def test_lockfile_viejo_se_saca_y_uno_vigente_se_respeta(self):
+        cache = self.cache(lambda url, timeout=None: self.DATA)
+        with open(cache.lock_path, "w") as f:
+            f.write("99999")
+        self.assertFalse(cache._tomar_lock())  # vigente: otro worker está refrescando
+
+        viejo = time.time() - 60
+        os.utime(cache.lock_path, (viejo, viejo))
+        otros = [self.cache(None) for _ in range(8)]
+        barrera = threading.Barrier(len(otros))
+
+        def tomar(c):
+            barrera.wait()
+            return c._tomar_lock()
+
+        with ThreadPoolExecutor(max_workers=len(otros)) as pool:
+            tomados = list(pool.map(tomar, otros))
+        self.assertEqual(tomados.count(True), 1)
+        with open(cache.lock_path) as f:
+            self.assertEqual(f.read(), str(os.getpid()))
+        self.assertEqual(os.listdir(self.directorio), [os.path.basename(cache.lock_path)])
+
+    def test_tras_un_fallo_no_reintenta_hasta_el_plazo(self):
+        llamadas = []
+
+        def proveedor_caido(url, timeout=None):
+            llamadas.append(url)
+            raise OSError("sin red")
+
+        cache = self.cache(proveedor_caido, reintento_s=30)
+        with self.assertLogs("fx_service", "ERROR"):
+            for _ in range(3):
+                with self.assertRaises(fx_service.TasasNoDisponibles):
+                    cache.tasas()
+        self.assertEqual(len(llamadas), 1)
+
+        # con copia vencida tampoco se lanza el refresco en segundo plano
+        cache._memoria = (time.time() - 700, self.DATA)
+        cache._fallo_en = time.monotonic()
+        self.assertTrue(cache.tasas()["desactualizado"])
+        self.assertEqual(len(llamadas), 1)
+
+        cache._fallo_en -= 30  # pasó el plazo: se vuelve a intentar
+        cache.proveedor = lambda url, timeout=None: self.DATA
+        cache._memoria = None
+        self.assertFalse(cache.tasas()["desactualizado"])
+        self.assertIsNone(cache._fallo_en)
+
+    def test_async_tras_un_fallo_sirve_la_copia_sin_reintentar(self):
+        llamadas = []
+
+        async def proveedor_caido(url, timeout=None):
+            llamadas.append(url)
+            raise OSError("sin red")
+
+        cache = fx_service.CacheTasas("http://proveedor.test/usd", directorio=self.directorio,
+                                      proveedor_async=proveedor_caido, timeout_s=1)
+        cache._memoria = (time.time() - 700, self.DATA)
+
+        async def varias():
+            primera = await cache.tasas_async()
+            await cache._tarea
+            return [primera] + [await cache.tasas_async() for _ in range(5)]
+
+        with self.assertLogs("fx_service", "ERROR"):
+            respuestas = asyncio.run(varias())
+        self.assertEqual(len(llamadas), 1)
+        self.assertTrue(all(r["desactualizado"] for r in respuestas))
+
+
+class TasasStreamTests(SimpleTestCase):
+
+    def _leer(self, difusor, ultimo_id=None, n=2):
+        async def leer():
+            chunks = sse.stream_async(ultimo_id, difusor=difusor, heartbeat_s=0.01, max_s=5)
+            leidos = [await chunks.__anext__() for _ in range(n)]
+            await chunks.aclose()
+            return leidos
+        return asyncio.run(leer())
+
+    def test_envia_solo_cambios_y_heartbeat_sin_cambios(self):
+        difusor = sse.Difusor(poll_s=1, obtener=None)
+        data = {"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 950.0}}
+        self.assertTrue(difusor.publicar(data))
+        self.assertFalse(difusor.publicar(dict(data)))  # mismas tasas: no hay evento nuevo
+
+        retry, evento, ping = self._leer(difusor, n=3)
+        self.assertTrue(retry.startswith(b"retry:"))
+        evento = evento.decode()
+        self.assertIn("event: tasas", evento)
+        self.assertIn('"CLP":950.0', evento)
+        self.assertEqual(ping, b": ping\n\n")
+
+        # reconexión con Last-Event-ID de las tasas vigentes: no se reenvían
+        evento_id = evento.split("\n")[0].removeprefix("id: ")
+        self.assertEqual(self._leer(difusor, evento_id)[1], b": ping\n\n")
+        self.assertEqual(difusor.metricas["abiertas"], 0)
+
+    def test_con_las_tasas_anteriores_recibe_solo_las_que_cambiaron(self):
+        difusor = sse.Difusor(poll_s=1, obtener=None)
+        difusor.publicar({"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 950.0, "PEN": 3.7}})
+        anterior = difusor._ultimo["id"]
+        difusor.publicar({"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 955.0}})
+
+        payload = lambda chunk: json.loads(chunk.decode().split("data: ")[1])
+        delta = payload(self._leer(difusor, anterior)[1])
+        self.assertEqual(delta["cambios"], {"CLP": 955.0, "PEN": None})
+        self.assertNotIn("tasas", delta)
+
+        completo = payload(self._leer(difusor, "otro-id")[1])
+        self.assertEqual(completo["tasas"], {"USD": 1.0, "CLP": 955.0})
+
+    def test_bajo_wsgi_responde_503_para_volver_a_consultar(self):
+        with mock.patch.object(sse, "get_difusor") as get_difusor:
+            r = self.client.get("/api/tipos-cambio/stream/")
+        get_difusor.assert_not_called()
+        self.assertEqual(r.status_code, 503)
+        self.assertGreaterEqual(int(r["Retry-After"]), 1)
+        self.assertIn("poll_s", r.json())
+
+    def test_stream_async_despierta_con_publicar_desde_otro_hilo(self):
+        difusor = sse.Difusor(poll_s=1, obtener=None)
+        data = {"date": "2025-01-02", "rates": {"USD": 1.0, "CLP": 950.0}}
+
+        async def leer():
+            chunks = sse.stream_async(difusor=difusor, heartbeat_s=5, max_s=10)
+            self.assertTrue((await chunks.__anext__()).startswith(b"retry:"))
+            threading.Timer(0.05, difusor.publicar, args=(data,)).start()
+            t0 = time.monotonic()
+            evento = await chunks.__anext__()
+            espera = time.monotonic() - t0
+            self.assertEqual(len(difusor._suscriptores), 1)
+            await chunks.aclose()
+            return evento, espera
+
+        evento, espera = asyncio.run(leer())
+        self.assertIn(b"event: tasas", evento)
+        self.assertLess(espera, 2)  # lo despertó publicar, no el heartbeat
+        self.assertEqual(difusor._suscriptores, set())
+        self.assertEqual(difusor.metricas["abiertas"], 0)
+
+    def test_fx_estado_no_pone_en_marcha_el_difusor(self):
+        with mock.patch.multiple(sse, _difusor=None, _difusor_pid=None):
+            r = self.client.get("/api/fx/estado/")
+            self.assertIsNone(sse._difusor)
+        self.assertEqual(r.json()["sse"]["abiertas"], 0)
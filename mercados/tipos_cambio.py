@@ -0,0 +1,149 @@
+# mercados/tipos_cambio.py
+"""
+Histórico de tipos de cambio (TipoCambio, tasas diarias contra USD).
+
+Un proveedor es una función que devuelve filas (fecha, moneda, tasa):
+
+- "api": la API de tipo de cambio (FX_URL de fx_service), una fila por moneda para la
+  fecha que informa la respuesta.
+- "archivo": un CSV o JSON local, para correr sin conexión o para cargar histórico.
+
+`guardar` escribe por lotes con upsert sobre (moneda, fecha): volver a cargar un día o un
+archivo no duplica filas; al terminar recalcula `Empresa.capitalizacion_usd` de las monedas
+escritas (ver mercados/capitalizacion.py). `serie` lee un rango de fechas de varias monedas en una sola
+consulta (usa el índice único de moneda + fecha).
+"""
+import csv
+import json
+import logging
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Max
+
+import fx_service
+from . import capitalizacion
+from .models import TipoCambio
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------ lectura de archivos ------------------
+
+def _fecha(valor):
+    return valor if isinstance(valor, date) else date.fromisoformat(str(valor).strip()[:10])
+
+
+def _filas_csv(path):
+    # columnas: fecha, moneda, tasa (encabezado obligatorio, en cualquier orden)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for n, fila in enumerate(csv.DictReader(f), start=2):
+            try:
+                yield _fecha(fila["fecha"]), fila["moneda"].strip().upper(), float(fila["tasa"])
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Tipo de cambio: fila %s inválida en %s: %s", n, path, fila)
+
+
+def _filas_json(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "rates" in data:
+        # mismo formato que la API: {"date": ..., "rates": {moneda: tasa}}
+        fecha = _fecha(data.get("date") or date.today())
+        return [(fecha, m, float(t)) for m, t in data["rates"].items()]
+    if isinstance(data, dict):
+        # {fecha: {moneda: tasa}}
+        return [(_fecha(d), m, float(t)) for d, tasas in data.items() for m, t in tasas.items()]
+    # [{"fecha", "moneda", "tasa"}, ...]
+    return [(_fecha(x["fecha"]), x["moneda"].upper(), float(x["tasa"])) for x in data]
+
+
+def leer_archivo(path):
+    """Filas (fecha, moneda, tasa) de un CSV o JSON. Los CSV se leen de a una fila."""
+    return _filas_json(path) if str(path).lower().endswith(".json") else _filas_csv(path)
+
+
+# ------------------ proveedores ------------------
+
+def proveedor_api(url=None, **opciones):
+    data = fx_service.descargar(url)
+    fecha = _fecha(data.get("date") or date.today())
+    return [(fecha, m, float(t)) for m, t in data["rates"].items()]
+
+
+def proveedor_archivo(archivo=None, **opciones):
+    archivo = archivo or getattr(settings, "NUAM_FX_ARCHIVO", "")
+    if not archivo:
+        raise ValueError("El proveedor 'archivo' necesita una ruta (--archivo o NUAM_FX_ARCHIVO).")
+    return leer_archivo(archivo)
+
+
+PROVEEDORES = {"api": proveedor_api, "archivo": proveedor_archivo}
+
+
+def obtener(nombre=None, **opciones):
+    """Filas del proveedor `nombre` (NUAM_FX_PROVEEDOR por defecto)."""
+    nombre = nombre or getattr(settings, "NUAM_FX_PROVEEDOR", "api")
+    if nombre not in PROVEEDORES:
+        raise ValueError(f"Proveedor de tipo de cambio desconocido: {nombre} (opciones: {', '.join(PROVEEDORES)})")
+    return PROVEEDORES[nombre](**opciones)
+
+
+# ------------------ escritura y lectura ------------------
+
+def guardar(filas, fuente="", monedas=None, lote=1000):
+    """
+    Upsert de (fecha, moneda, tasa) por lotes de `lote`; acepta cualquier iterable (un CSV
+    grande no se carga entero en memoria). `monedas` filtra cuáles guardar. Devuelve cuántas filas escribió.
+    """
+    monedas = {m.upper() for m in monedas} if monedas else None
+    total = 0
+    bloque = {}
+    escritas = set()
+
+    def escribir():
+        TipoCambio.objects.bulk_create(
+            bloque.values(), update_conflicts=True,
+            unique_fields=["moneda", "fecha"], update_fields=["tasa", "fuente", "actualizado_en"],
+        )
+
+    for fecha, moneda, tasa in filas:
+        if monedas is not None and moneda not in monedas:
+            continue
+        # dentro de un lote gana la última fila de cada (moneda, fecha)
+        bloque[(moneda, fecha)] = TipoCambio(moneda=moneda, fecha=fecha, tasa=tasa, fuente=fuente)
+        escritas.add(moneda)
+        if len(bloque) >= lote:
+            escribir()
+            total += len(bloque)
+            bloque = {}
+    if bloque:
+        escribir()
+        total += len(bloque)
+    if escritas:
+        empresas = capitalizacion.recalcular(escritas)
+        logger.info("Capitalización en USD recalculada: %s empresas (%s)", empresas, ", ".join(sorted(escritas)))
+    return total
+
+
+def serie(monedas, desde, hasta):
+    """
+    Tasas de `monedas` entre `desde` y `hasta` (inclusive) en una sola consulta.
+    Devuelve (fechas ordenadas, {moneda: {fecha: tasa}}).
+    """
+    filas = (TipoCambio.objects
+             .filter(moneda__in=list(monedas), fecha__gte=desde, fecha__lte=hasta)
+             .order_by("fecha")
+             .values_list("fecha", "moneda", "tasa"))
+    fechas, tasas = [], {m: {} for m in monedas}
+    for fecha, moneda, tasa in filas:
+        if not fechas or fechas[-1] != fecha:
+            fechas.append(fecha)
+        tasas[moneda][fecha] = tasa
+    return fechas, tasas
+
+
+def version():
+    """Marca del último cambio en el histórico (para ETags de respuestas que lo incluyen)."""
+    ultimo = TipoCambio.objects.aggregate(m=Max("actualizado_en"))["m"]
+    return ultimo.strftime("%Y%m%d%H%M%S%f") if ultimo else "0"
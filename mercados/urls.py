@@ -6,6 +6,10 @@ from .views import (
     TopEmpresasPorPais,
     empresas_sin_paginacion,
     convertir_moneda,
+    convertir_moneda_lote,
+    matriz_tipos_cambio,
+    fx_estado,
+    tasas_stream,
 )
 
 router = DefaultRouter()
@@ -17,6 +21,10 @@ urlpatterns = [
     path("empresas-sin-paginacion/", empresas_sin_paginacion,
          name="empresas-sin-paginacion"),
     path("convertir/", convertir_moneda, name="convertir-moneda"),
+    path("convertir/lote/", convertir_moneda_lote, name="convertir-moneda-lote"),
+    path("tipos-cambio/matriz/", matriz_tipos_cambio, name="tipos-cambio-matriz"),
+    path("fx/estado/", fx_estado, name="fx-estado"),
+    path("tipos-cambio/stream/", tasas_stream, name="tipos-cambio-stream"),
 ]
 
 urlpatterns += router.urls
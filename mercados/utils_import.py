@@ -1,8 +1,27 @@
 # mercados/utils_import.py
-import os, re, unicodedata
+import hashlib, math, os, re, time, unicodedata
+import importlib.util
 from datetime import datetime
+from decimal import Decimal
+from itertools import repeat
+import numpy as np
 import pandas as pd
-from .models import Empresa, Pais
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Empresa, LayoutHoja, Pais
+from .signals import vaciar_lote
+from . import outbox
+from .eventos import delta_activo
+from .capitalizacion import en_usd, tasas_vigentes
+
+# Motores de lectura disponibles:
+#   auto     -> calamine si está instalado, si no openpyxl
+#   openpyxl -> pandas + openpyxl (read-only)
+#   stream   -> openpyxl read-only iterando valores directamente, sin el parser de pandas
+#   calamine -> pandas + python-calamine (bastante más rápido en libros grandes)
+EXCEL_ENGINES = ("auto", "openpyxl", "stream", "calamine")
 
 # ------------------ helpers ------------------
 
@@ -48,155 +67,792 @@ def _combine_two_header_rows(raw: pd.DataFrame, header_row: int):
             out.append(a or b)
     return out
 
+# ------------------ lectura del libro (una pasada por hoja) ------------------
+
+def calamine_available():
+    return importlib.util.find_spec("python_calamine") is not None
+
+def resolve_engine(engine=None):
+    engine = (engine or getattr(settings, "NUAM_EXCEL_ENGINE", "auto")).lower()
+    if engine not in EXCEL_ENGINES:
+        raise ValueError(f"Motor de lectura desconocido: {engine} (opciones: {', '.join(EXCEL_ENGINES)})")
+    if engine == "auto":
+        return "calamine" if calamine_available() else "openpyxl"
+    return engine
+
+def _stream_cell(v):
+    # Misma conversión que aplica pandas sobre openpyxl: floats enteros -> int, "" -> vacío
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if v == "":
+        return None
+    return v
+
+class WorkbookReader:
+    """
+    Abre el libro una sola vez y entrega cada hoja en crudo (equivalente a header=None).
+    Las vistas con encabezado se arman en memoria con `frame_from_raw`, sin volver a leer el archivo.
+    `parse_seconds` acumula el tiempo gastado leyendo.
+    """
+
+    def __init__(self, path, engine=None):
+        self.path = path
+        self.engine = resolve_engine(engine)
+        self.parse_seconds = 0.0
+        t0 = time.perf_counter()
+        if self.engine == "stream":
+            from openpyxl import load_workbook
+            self._book = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+            self.sheet_names = list(self._book.sheetnames)
+        else:
+            self._book = pd.ExcelFile(path, engine=self.engine)
+            self.sheet_names = list(self._book.sheet_names)
+        self.parse_seconds += time.perf_counter() - t0
+
+    def raw(self, sheet):
+        t0 = time.perf_counter()
+        try:
+            if self.engine == "stream":
+                return self._raw_stream(sheet)
+            return self._book.parse(sheet, header=None)
+        finally:
+            self.parse_seconds += time.perf_counter() - t0
+
+    def _raw_stream(self, sheet):
+        ws = self._book[sheet]
+        ws.reset_dimensions()
+        rows = []
+        last = -1
+        for i, values in enumerate(ws.iter_rows(values_only=True)):
+            row = [_stream_cell(v) for v in values]
+            while row and row[-1] is None:
+                row.pop()
+            if row:
+                last = i
+            rows.append(row)
+        return pd.DataFrame(rows[: last + 1])
+
+    def close(self):
+        self._book.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _column_labels(values):
+    """Nombres de columna como los genera read_excel(header=n): 'Unnamed: i' y sufijo en duplicados."""
+    labels, seen = [], {}
+    for i, v in enumerate(values):
+        label = f"Unnamed: {i}" if pd.isna(v) else v
+        if label in seen:
+            seen[label] += 1
+            label = f"{label}.{seen[label]}"
+        else:
+            seen[label] = 0
+        labels.append(label)
+    return labels
+
+def frame_from_raw(raw: pd.DataFrame, header_row: int, columns=None):
+    """
+    Equivalente en memoria a `read_excel(header=header_row).dropna(how="all")`
+    a partir de la hoja ya leída en crudo. Si se entregan `columns` se usan como encabezado.
+    """
+    if header_row >= len(raw):
+        return None
+    df = raw.iloc[header_row + 1:].copy()
+    df.columns = columns if columns is not None else _column_labels(list(raw.iloc[header_row].values))
+    return df.dropna(how="all").infer_objects().reset_index(drop=True)
+
+# ------------------ caché de layouts (fila de encabezado / modo / columnas) ------------------
+
+def layout_huella(importador, sheet, raw: pd.DataFrame, header_row: int):
+    """
+    Huella de las primeras filas de la hoja hasta el encabezado (incluida la segunda fila del modo B).
+    De las filas de título solo cuenta qué celdas tienen contenido (suelen traer el mes del
+    informe); las de encabezado cuentan con su texto exacto.
+    """
+    h = hashlib.sha256(f"{importador}|{sheet}|{raw.shape[1]}|{header_row}".encode("utf-8"))
+    for i in range(min(header_row + 2, len(raw))):
+        vals = raw.iloc[i].values
+        if i < header_row:
+            h.update(bytes(0 if pd.isna(v) else 1 for v in vals))
+        else:
+            h.update("\x1f".join("" if pd.isna(v) else str(v).strip() for v in vals).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+def layout_cache_enabled():
+    return getattr(settings, "NUAM_LAYOUT_CACHE", True)
+
+def buscar_layout(importador, sheet, raw: pd.DataFrame, registrar_uso=True):
+    """
+    LayoutHoja guardado cuya huella coincide con esta hoja, o None (hay que detectar).
+    Se prueba la fila de encabezado de cada layout conocido para la hoja: son pocos y solo
+    se leen las filas hasta el encabezado.
+    """
+    if not layout_cache_enabled():
+        return None
+    candidatos = LayoutHoja.objects.filter(importador=importador, hoja=sheet).order_by("-usado_en")
+    for header_row in dict.fromkeys(candidatos.values_list("header_row", flat=True)):
+        if header_row >= len(raw):
+            continue
+        layout = LayoutHoja.objects.filter(huella=layout_huella(importador, sheet, raw, header_row)).first()
+        if layout is not None:
+            if registrar_uso:
+                LayoutHoja.objects.filter(pk=layout.pk).update(usos=F("usos") + 1, usado_en=timezone.now())
+            return layout
+    return None
+
+def registrar_layout(huella, importador, hoja, header_row, modo, columnas):
+    if not layout_cache_enabled():
+        return None
+    layout, _ = LayoutHoja.objects.update_or_create(
+        huella=huella,
+        defaults=dict(importador=importador, hoja=hoja, header_row=header_row, modo=modo,
+                      columnas=columnas, usado_en=timezone.now()),
+    )
+    return layout
+
+def guardar_layout(importador, sheet, raw: pd.DataFrame, header_row: int, modo: str, columnas: dict):
+    return registrar_layout(layout_huella(importador, sheet, raw, header_row), importador, sheet,
+                            header_row, modo, columnas)
+
+# ------------------ escritura masiva (upsert por lotes) ------------------
+
+EMPRESA_UPSERT_FIELDS = ["nombre", "pais", "sector", "moneda", "capitalizacion", "mercado", "fuente", "fecha_reporte"]
+
+def paises_por_clave():
+    """
+    Mapa en memoria para resolver Pais sin consultar por fila.
+    Claves en minúsculas por nombre y por código (el código tiene prioridad).
+    """
+    paises = list(Pais.objects.all())
+    mapa = {p.nombre.lower(): p for p in paises}
+    mapa.update({p.codigo.lower(): p for p in paises})
+    return mapa
+
+def _chunks(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+_CENTAVOS = Decimal("0.01")
+
+def _no_finito(v):
+    """inf / -inf / NaN (float o Decimal): no se pueden guardar en un DecimalField."""
+    return isinstance(v, (float, Decimal)) and not math.isfinite(v)
+
+def _fingerprint_value(campo, v):
+    """Valor normalizado tal como queda guardado en la BD, para comparar sin falsos cambios."""
+    if v is None:
+        return None
+    if campo == "pais":
+        return v.pk if isinstance(v, Pais) else v
+    if campo == "capitalizacion":
+        if _no_finito(v):
+            return None  # se guarda como sin dato (ver upsert_empresas)
+        return Empresa._meta.get_field("capitalizacion").to_python(v).quantize(_CENTAVOS)
+    return v
+
+def empresa_fingerprint(values):
+    """Huella de una Empresa: tupla de EMPRESA_UPSERT_FIELDS normalizados (dict o valores en orden)."""
+    if isinstance(values, dict):
+        values = [values.get(c) for c in EMPRESA_UPSERT_FIELDS]
+    return tuple(_fingerprint_value(c, v) for c, v in zip(EMPRESA_UPSERT_FIELDS, values))
+
+def _existing_state(tickers=None):
+    """
+    Estado actual {ticker: (id, huella)}. Sin `tickers` lee la tabla completa en una consulta;
+    con `tickers` solo esos (en bloques, para cargas por lotes que no deben crecer en memoria).
+    """
+    campos = ("ticker", "id", *EMPRESA_UPSERT_FIELDS)
+    if tickers is None:
+        filas = Empresa.objects.values_list(*campos)
+    else:
+        filas = (f for chunk in _chunks(list(tickers), 500)
+                 for f in Empresa.objects.filter(ticker__in=chunk).values_list(*campos))
+    return {ticker: (pk, empresa_fingerprint(valores)) for ticker, pk, *valores in filas}
+
+def upsert_empresas(rows, batch_size=None, progress=None, lookup="table"):
+    """
+    Crea/actualiza Empresas en lote. `rows` son dicts con "ticker" y los campos de
+    EMPRESA_UPSERT_FIELDS (pais como instancia o None).
+    Lee el estado actual en una sola consulta y compara la huella de cada ticker:
+    solo se escriben (y notifican) las filas nuevas o que cambiaron. Escribe en bloques
+    de `batch_size` dentro de una única transacción. Si un ticker se repite en el archivo
+    gana la última fila y las anteriores se cuentan como repetidas.
+    `progress(pct, etapa)` se llama tras cada bloque escrito (pct de 0 a 100).
+    `lookup="rows"` consulta solo los tickers recibidos en vez de la tabla completa
+    (lo usan los importadores por streaming, que llaman una vez por lote).
+    Una capitalización infinita o NaN se guarda como NULL.
+    Devuelve dict con creadas, actualizadas, sin_cambios y repetidas.
+    """
+    batch_size = batch_size or getattr(settings, "NUAM_IMPORT_BATCH_SIZE", 1000)
+
+    latest = {}
+    repetidas = 0
+    for row in rows:
+        if row["ticker"] in latest:
+            repetidas += 1
+        if _no_finito(row.get("capitalizacion")):
+            row = {**row, "capitalizacion": None}
+        latest[row["ticker"]] = row
+
+    state = _existing_state(latest.keys() if lookup == "rows" else None)
+    existing = {ticker: pk for ticker, (pk, _) in state.items()}
+
+    new_objs, old_objs = [], []
+    sin_cambios = 0
+    for ticker, row in latest.items():
+        if ticker not in existing:
+            new_objs.append(Empresa(**row))
+        elif state[ticker][1] != empresa_fingerprint(row):
+            old_objs.append(Empresa(**row))
+        else:
+            sin_cambios += 1
+
+    conteo = {"creadas": len(new_objs), "actualizadas": len(old_objs), "sin_cambios": sin_cambios, "repetidas": repetidas}
+    objs = new_objs + old_objs
+    if not objs:
+        return conteo
+
+    # bulk_create/bulk_update no pasan por Empresa.save: la capitalización en USD se calcula
+    # aquí con las tasas vigentes leídas una vez para toda la carga
+    tasas = tasas_vigentes({o.moneda for o in objs})
+    for o in objs:
+        o.capitalizacion_usd = en_usd(o.capitalizacion, o.moneda, tasas)
+    campos = [*EMPRESA_UPSERT_FIELDS, "capitalizacion_usd"]
+
+    total = len(objs)
+    escritas = 0
+
+    def avance(n):
+        nonlocal escritas
+        escritas += n
+        if progress:
+            progress(int(100 * escritas / total), f"Escribiendo empresas ({escritas}/{total})")
+
+    with transaction.atomic():
+        if connection.features.supports_update_conflicts_with_target:
+            for chunk in _chunks(objs, batch_size):
+                Empresa.objects.bulk_create(
+                    chunk, update_conflicts=True, unique_fields=["ticker"], update_fields=campos,
+                )
+                avance(len(chunk))
+        else:
+            for o in old_objs:
+                o.pk = existing[o.ticker]
+            for chunk in _chunks(new_objs, batch_size):
+                Empresa.objects.bulk_create(chunk)
+                avance(len(chunk))
+            for chunk in _chunks(old_objs, batch_size):
+                Empresa.objects.bulk_update(chunk, campos)
+                avance(len(chunk))
+
+        # eventos en el outbox dentro de la misma transacción que los cambios
+        # (la huella previa da los valores anteriores para los eventos delta); antes, los de
+        # saves sueltos anotados en un `eventos_empresa_en_lote` en curso, para no desordenarlos
+        vaciar_lote()
+        outbox.registrar_tickers(
+            [o.ticker for o in new_objs], [o.ticker for o in old_objs], chunk=batch_size,
+            anteriores={o.ticker: dict(zip(EMPRESA_UPSERT_FIELDS, state[o.ticker][1])) for o in old_objs}
+            if delta_activo() else None,
+        )
+
+    return conteo
+
+def format_conteo(conteo, omitidas=0):
+    return (f"Creadas: {conteo['creadas']}, actualizadas: {conteo['actualizadas']}, "
+            f"sin cambios: {conteo['sin_cambios']}, repetidas: {conteo['repetidas']}, omitidas: {omitidas}")
+
+# ------------------ bloques BCS/BVC/BVL en forma columnar ------------------
+
+# Mapeo por bolsa -> país / moneda
+BOLSA_META = {
+    "bcs": {"pais": "CHL", "moneda": "CLP"},
+    "bvc": {"pais": "COL", "moneda": "COP"},
+    "bvl": {"pais": "PER", "moneda": "PEN"},
+}
+
+def _melt_blocks(df: pd.DataFrame, blocks: dict):
+    """
+    Apila los tríos (emisor, ticker, cap) de cada bolsa en un frame largo con columnas
+    bolsa / ticker / nombre / cap, en el mismo orden que el recorrido fila a fila
+    (fila 0: BCS, BVC, BVL; fila 1: ...).
+    """
+    n = len(df)
+    vacia = np.full(n, None, dtype=object)
+    partes = []
+    for orden, (bolsa, idxs) in enumerate(blocks.items()):
+        def col(key):
+            i = idxs.get(key)
+            return vacia if i is None else df.iloc[:, i].to_numpy(dtype=object)
+        partes.append(pd.DataFrame({
+            "fila": np.arange(n),
+            "orden": orden,
+            "bolsa": bolsa,
+            "ticker": col("ticker"),
+            "nombre": col("emisor"),
+            "cap": col("cap"),
+        }))
+    if not partes:
+        return pd.DataFrame(columns=["bolsa", "ticker", "nombre", "cap"])
+    largo = pd.concat(partes, ignore_index=True)
+    largo = largo.sort_values(["fila", "orden"], kind="stable")
+    return largo.drop(columns=["fila", "orden"]).reset_index(drop=True)
+
+def _clean_text(s: pd.Series):
+    """str(x).strip() para celdas con valor, "" para vacías."""
+    out = pd.Series("", index=s.index, dtype=object)
+    mask = s.notna()
+    out[mask] = s[mask].astype(str).str.strip()
+    return out
+
+def _parse_cap(s: pd.Series):
+    """Capitalización numérica (quita separadores de miles y espacios); None si no se puede leer o no es finita."""
+    num = pd.to_numeric(s, errors="coerce")
+    # solo las celdas con texto que no es número directo pasan por la limpieza de separadores
+    pendientes = num.isna() & s.notna()
+    if pendientes.any():
+        texto = s[pendientes].astype(str).str.replace(",", "", regex=False).str.replace(" ", "", regex=False)
+        num[pendientes] = pd.to_numeric(texto.str.strip(), errors="coerce")
+    num = num.where(np.isfinite(num.astype(float)))  # "inf" / "-Infinity" leídos como número
+    return num.astype(object).where(num.notna(), None)
+
+def _rows_from_melted(largo: pd.DataFrame, paises: dict):
+    """
+    Normaliza el frame largo con operaciones vectorizadas y entrega las filas listas
+    para `upsert_empresas`. Filas sin ticker ni nombre se descartan; si falta el ticker
+    se genera uno simple desde el nombre (no ideal, pero evita perder el registro).
+    """
+    ticker = _clean_text(largo["ticker"])
+    nombre = _clean_text(largo["nombre"])
+
+    keep = (ticker != "") | (nombre != "")
+    ticker, nombre, largo = ticker[keep], nombre[keep], largo[keep]
+
+    sin_ticker = ticker == ""
+    if sin_ticker.any():
+        ticker[sin_ticker] = (
+            nombre[sin_ticker].str.normalize("NFKD").str.upper()
+            .str.replace(r"[^A-Z0-9]", "", regex=True).str[:10]
+        )
+
+    bolsa = largo["bolsa"].tolist()
+    pais_por_bolsa = {b: paises.get(m["pais"].lower()) for b, m in BOLSA_META.items()}
+    columnas = {
+        "ticker": ticker.tolist(),
+        "nombre": nombre.where(nombre != "", None).tolist(),
+        "pais": [pais_por_bolsa[b] for b in bolsa],
+        "moneda": [BOLSA_META[b]["moneda"] for b in bolsa],
+        "capitalizacion": _parse_cap(largo["cap"]).tolist(),
+        "mercado": [b.upper() for b in bolsa],  # BCS / BVC / BVL
+    }
+    fijos = {
+        "sector": None,  # el Excel no lo trae; puedes poblarlo después
+        "fuente": "Excel NUAM",
+        "fecha_reporte": None,
+    }
+    claves = list(columnas) + list(fijos)
+    valores = list(columnas.values()) + [repeat(v) for v in fijos.values()]
+    return [dict(zip(claves, fila)) for fila in zip(*valores)]
+
+# ------------------ detección de layout (bloques BCS/BVC/BVL) ------------------
+
+def _detect_blocks(cols_norm):
+    """
+    Para cada bolsa, índices de Ticker, Cap y Emisor dentro de las columnas normalizadas.
+    Devuelve {"bcs": {"ticker": idx, "cap": idx, "emisor": idx}, ...} (solo bolsas encontradas).
+    """
+    blocks = {}  # ej: {"bcs": {"ticker": idx, "cap": idx, "emisor": idx}}
+    for bolsa in ["bcs", "bvc", "bvl"]:
+        # Ticker: columna que contenga 'ticker' y el nombre de la bolsa
+        t_idx = next((i for i, c in enumerate(cols_norm) if "ticker" in c and bolsa in c), None)
+        # Cap: preferimos la columna contigua con "cap" (suele estar a +1)
+        c_idx = None
+        if t_idx is not None:
+            # primero probar +1 y +2, luego cualquier columna con cap y esa bolsa
+            for k in (t_idx + 1, t_idx + 2):
+                if 0 <= k < len(cols_norm) and ("cap" in cols_norm[k] or "capital" in cols_norm[k]):
+                    c_idx = k; break
+            if c_idx is None:
+                c_idx = next((i for i, c in enumerate(cols_norm) if ("cap" in c or "capital" in c) and bolsa in c), None)
+
+        # Emisor: suele estar justo antes del ticker
+        e_idx = None
+        if t_idx is not None:
+            cand = t_idx - 1
+            if 0 <= cand < len(cols_norm) and ("emisor" in cols_norm[cand] or "issuer" in cols_norm[cand] or "nombre" in cols_norm[cand]):
+                e_idx = cand
+            else:
+                # fallback: busca el 'emisor' más cercano a la izquierda
+                for k in range(t_idx - 1, max(-1, t_idx - 4), -1):
+                    if 0 <= k < len(cols_norm) and ("emisor" in cols_norm[k] or "issuer" in cols_norm[k] or "nombre" in cols_norm[k]):
+                        e_idx = k; break
+
+        if t_idx is not None or e_idx is not None or c_idx is not None:
+            blocks[bolsa] = {"ticker": t_idx, "cap": c_idx, "emisor": e_idx}
+    return blocks
+
+def _detect_layout(raw: pd.DataFrame):
+    """
+    Detección completa: fila de encabezado, modo A (una fila) o B (dos filas combinadas)
+    y bloques por bolsa. Devuelve (header_row, modo, df, blocks).
+    """
+    header_row = _find_header_row(raw, scan_limit=200)
+
+    # Intento A (header_row), armado desde el crudo en memoria
+    dfA = frame_from_raw(raw, header_row)
+    colsA = list(dfA.columns) if dfA is not None else []
+    colsA_norm = [_norm(c) for c in colsA]
+
+    # Intento B (combinar 2 encabezados)
+    dfB = frame_from_raw(raw, header_row + 1, columns=_combine_two_header_rows(raw, header_row))
+    colsB = list(dfB.columns) if dfB is not None else []
+    colsB_norm = [_norm(c) for c in colsB]
+
+    # Elegir la versión con más señales (preferimos B si existe)
+    useB = dfB is not None and any("ticker" in c and ("bcs" in c or "bvc" in c or "bvl" in c) for c in colsB_norm)
+    df = dfB if useB else dfA
+    cols_norm = colsB_norm if useB else colsA_norm
+    if df is None:
+        return header_row, None, None, {}
+    return header_row, "B" if useB else "A", df, _detect_blocks(cols_norm)
+
 # ------------------ importador principal ------------------
 
-def import_empresas_from_excel(path: str):
+# Filas compactas: tuplas en este orden, con el país como código. Es lo que viaja desde los
+# procesos de lectura al proceso que escribe (mucho más liviano de serializar que dicts con Pais).
+ROW_FIELDS = ["ticker", *EMPRESA_UPSERT_FIELDS]
+_PAIS_IDX = ROW_FIELDS.index("pais")
+
+def compact_rows(rows):
+    return [
+        tuple(r[c].pk if c == "pais" and r[c] is not None else r[c] for c in ROW_FIELDS)
+        for r in rows
+    ]
+
+def expand_rows(tuplas, paises=None):
+    """Inverso de `compact_rows`: dicts listos para `upsert_empresas` (Pais resuelto en memoria)."""
+    por_codigo = {p.pk: p for p in (paises or Pais.objects.all())}
+    out = []
+    for t in tuplas:
+        row = dict(zip(ROW_FIELDS, t))
+        row["pais"] = por_codigo.get(t[_PAIS_IDX])
+        out.append(row)
+    return out
+
+def sheet_order(sheet_names):
+    # probar primero hojas tipo 'Nemo ... Cap'
+    return sorted(sheet_names, key=lambda s: (0 if ("Nemo" in s and "Cap" in s) else 1, s))
+
+def import_empresas_from_excel(path: str, engine: str = None, progress=None, procesos=1):
     """
     Lee un Excel NUAM en formato ancho con 3 bloques (BCS/bvc/BVL):
       [Emisor] [Ticker] [Cap]   [Emisor] [Ticker] [Cap]   [Emisor] [Ticker] [Cap]
     Detecta encabezados, identifica índices por bolsa y crea/actualiza Empresas.
     Asigna país/moneda por defecto según la bolsa.
+    Cada hoja se lee una sola vez; `engine` elige el motor de lectura (ver EXCEL_ENGINES).
+    `progress(pct, etapa)` es opcional y recibe el avance global (0-100), p.ej. para la cola de cargas.
+    Con `procesos` > 1 las hojas se leen en paralelo, una por proceso (ver `parse_excel`).
+    """
+    progress = progress or (lambda pct, etapa: None)
+    parsed = parse_excel(path, engine=engine, progress=progress, procesos=procesos)
+    return write_parsed(parsed, progress=progress)
+
+def parse_excel(path: str, engine: str = None, progress=None, procesos=1, sheets=None):
+    """
+    Etapa de lectura del importador (sin escribir en la BD): devuelve un dict con `ok`, la hoja
+    usada, las filas compactas (`compact_rows`) y los datos del layout, para `write_parsed`.
+    Solo prueba las hojas de `sheets` si se indican. Con `procesos` > 1 cada hoja candidata se
+    lee en un proceso distinto y se usa la primera válida en el orden de prioridad.
     """
     if not os.path.exists(path):
         return {"ok": False, "msg": f"No existe el archivo: {path}"}
+    progress = progress or (lambda pct, etapa: None)
 
     try:
-        xls = pd.ExcelFile(path)
+        xls = WorkbookReader(path, engine=engine)
     except Exception as e:
         return {"ok": False, "msg": f"Error leyendo Excel: {e}"}
 
-    # probar primero hojas tipo 'Nemo ... Cap'
-    sheets = sorted(xls.sheet_names, key=lambda s: (0 if ("Nemo" in s and "Cap" in s) else 1, s))
+    candidatas = [s for s in sheet_order(xls.sheet_names) if sheets is None or s in sheets]
+    if procesos > 1 and len(candidatas) > 1:
+        xls.close()
+        return _parse_sheets_parallel(path, xls.engine, candidatas, procesos, progress)
+
+    try:
+        for sheet in candidatas:
+            parsed = _parse_sheet(xls, sheet, progress)
+            if parsed is not None:
+                parsed["parse_seconds"] = round(xls.parse_seconds, 3)
+                return parsed
+        return {"ok": False, "msg": "No se identificó ninguna tabla válida (bloques BCS/bvc/BVL).",
+                "parse_seconds": round(xls.parse_seconds, 3)}
+    finally:
+        xls.close()
 
-    created = updated = skipped = 0
-    used_sheet = None
+def _parse_sheet(xls: WorkbookReader, sheet, progress):
+    # 1) Crudo (única lectura de la hoja)
+    progress(5, f"Leyendo hoja {sheet}")
+    try:
+        raw = xls.raw(sheet)
+    except Exception:
+        return None
 
-    # Mapeo por bolsa -> país / moneda
-    bolsa_meta = {
-        "bcs": {"pais": "CHL", "moneda": "CLP"},
-        "bvc": {"pais": "COL", "moneda": "COP"},
-        "bvl": {"pais": "PER", "moneda": "PEN"},
+    # 2) Layout ya conocido (misma huella que un archivo anterior): sin detección
+    layout = buscar_layout(LayoutHoja.BLOQUES, sheet, raw, registrar_uso=False)
+    layout_nuevo = None
+    if layout is not None:
+        header_row, modo, blocks = layout.header_row, layout.modo, layout.columnas
+        if modo == "B":
+            df = frame_from_raw(raw, header_row + 1, columns=_combine_two_header_rows(raw, header_row))
+        else:
+            df = frame_from_raw(raw, header_row)
+        if df is None:
+            return None
+    else:
+        # 3) Detección completa (encabezado, modo A/B, índices por bolsa); el escritor la guarda
+        header_row, modo, df, blocks = _detect_layout(raw)
+        if df is None or not blocks:
+            return None
+        layout_nuevo = dict(huella=layout_huella(LayoutHoja.BLOQUES, sheet, raw, header_row),
+                            importador=LayoutHoja.BLOQUES, hoja=sheet, header_row=header_row,
+                            modo=modo, columnas=blocks)
+
+    # ---------- Apilar bloques y normalizar en forma columnar ----------
+    progress(40, f"Normalizando hoja {sheet}")
+    largo = _melt_blocks(df, blocks)
+    return {
+        "ok": True,
+        "sheet": sheet,
+        "rows": compact_rows(_rows_from_melted(largo, paises_por_clave())),
+        "skipped": 0,
+        "engine": xls.engine,
+        "header_row": header_row,
+        "modo": modo,
+        "layout_id": layout.pk if layout is not None else None,
+        "layout_nuevo": layout_nuevo,
     }
 
-    for sheet in sheets:
-        # 1) Crudo + detección encabezado
-        try:
-            raw = pd.read_excel(path, sheet_name=sheet, header=None, engine="openpyxl")
-        except Exception:
-            continue
+def _parse_sheet_task(path, engine, sheet):
+    """Tarea del pool: abre el libro en este proceso y lee una sola hoja."""
+    with WorkbookReader(path, engine=engine) as xls:
+        parsed = _parse_sheet(xls, sheet, lambda pct, etapa: None)
+        if parsed is not None:
+            parsed["parse_seconds"] = round(xls.parse_seconds, 3)
+        return parsed
 
-        header_row = _find_header_row(raw, scan_limit=200)
+def _parse_sheets_parallel(path, engine, sheets, procesos, progress):
+    progress(5, f"Leyendo {len(sheets)} hojas en {min(procesos, len(sheets))} procesos")
+    pool = parse_pool(min(procesos, len(sheets)))
+    try:
+        futuros = [pool.submit(_parse_sheet_task, path, engine, s) for s in sheets]
+        # Se respeta la prioridad de las hojas: gana la primera válida en ese orden
+        for fut in futuros:
+            parsed = fut.result()
+            if parsed is not None:
+                return parsed
+    finally:
+        # no esperar a las hojas que ya no se necesitan
+        pool.shutdown(wait=False, cancel_futures=True)
+    return {"ok": False, "msg": "No se identificó ninguna tabla válida (bloques BCS/bvc/BVL).", "parse_seconds": 0.0}
 
-        # 2) Intento A (header_row)
-        try:
-            dfA = pd.read_excel(path, sheet_name=sheet, header=header_row, engine="openpyxl").dropna(how="all")
-            colsA = list(dfA.columns); colsA_norm = [_norm(c) for c in colsA]
-        except Exception:
-            dfA = None; colsA = []; colsA_norm = []
+def parse_pool(procesos):
+    """Pool de procesos de lectura. Solo leen de la BD (layouts, países); escribe quien los usa."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import django
+    # Con "spawn" el proceso parte sin Django configurado: el initializer no puede vivir en un
+    # módulo que importe modelos, por eso se usa django.setup directamente.
+    return ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=django.setup)
 
-        # 3) Intento B (combinar 2 encabezados)
-        try:
-            combined = _combine_two_header_rows(raw, header_row)
-            dfB = pd.read_excel(path, sheet_name=sheet, header=header_row+1, engine="openpyxl").dropna(how="all")
-            if dfB is not None and len(dfB.columns) == len(combined):
-                dfB.columns = combined
-            colsB = list(dfB.columns); colsB_norm = [_norm(c) for c in colsB]
-        except Exception:
-            dfB = None; colsB = []; colsB_norm = []
-
-        # Elegir la versión con más señales (preferimos B si existe)
-        useB = dfB is not None and any("ticker" in c and ("bcs" in c or "bvc" in c or "bvl" in c) for c in colsB_norm)
-        df = dfB if useB else dfA
-        cols = colsB if useB else colsA
-        cols_norm = colsB_norm if useB else colsA_norm
-        if df is None:
-            continue
+def write_parsed(parsed, progress=None):
+    """
+    Etapa de escritura: recibe el resultado de `parse_excel`, guarda/actualiza el layout y
+    hace el upsert de las filas. Devuelve el dict de resultado del importador.
+    """
+    parse_s = parsed.get("parse_seconds", 0.0)
+    if not parsed.get("ok"):
+        return {"ok": False, "msg": parsed.get("msg", "Error leyendo Excel"), "parse_seconds": parse_s}
+    progress = progress or (lambda pct, etapa: None)
+    used_sheet = parsed["sheet"]
 
-        # ---------- Identificar índices por bolsa ----------
-        # Buscamos, para cada bolsa, el índice del Ticker y de la Cap dentro del bloque.
-        blocks = {}  # ej: {"bcs": {"ticker": idx, "cap": idx, "emisor": idx}}
-        for bolsa in ["bcs", "bvc", "bvl"]:
-            # Ticker: columna que contenga 'ticker' y el nombre de la bolsa
-            t_idx = next((i for i, c in enumerate(cols_norm) if "ticker" in c and bolsa in c), None)
-            # Cap: preferimos la columna contigua con "cap" (suele estar a +1)
-            c_idx = None
-            if t_idx is not None:
-                # primero probar +1 y +2, luego cualquier columna con cap y esa bolsa
-                for k in (t_idx + 1, t_idx + 2):
-                    if 0 <= k < len(cols_norm) and ("cap" in cols_norm[k] or "capital" in cols_norm[k]):
-                        c_idx = k; break
-                if c_idx is None:
-                    c_idx = next((i for i, c in enumerate(cols_norm) if ("cap" in c or "capital" in c) and bolsa in c), None)
-
-            # Emisor: suele estar justo antes del ticker
-            e_idx = None
-            if t_idx is not None:
-                cand = t_idx - 1
-                if 0 <= cand < len(cols_norm) and ("emisor" in cols_norm[cand] or "issuer" in cols_norm[cand] or "nombre" in cols_norm[cand]):
-                    e_idx = cand
-                else:
-                    # fallback: busca el 'emisor' más cercano a la izquierda
-                    for k in range(t_idx - 1, max(-1, t_idx - 4), -1):
-                        if 0 <= k < len(cols_norm) and ("emisor" in cols_norm[k] or "issuer" in cols_norm[k] or "nombre" in cols_norm[k]):
-                            e_idx = k; break
-
-            if t_idx is not None or e_idx is not None or c_idx is not None:
-                blocks[bolsa] = {"ticker": t_idx, "cap": c_idx, "emisor": e_idx}
-
-        # Si no encontramos ningún bloque, intentar fallback genérico
-        if not blocks:
-            continue
+    if parsed.get("layout_nuevo"):
+        registrar_layout(**parsed["layout_nuevo"])
+    elif parsed.get("layout_id"):
+        LayoutHoja.objects.filter(pk=parsed["layout_id"]).update(usos=F("usos") + 1, usado_en=timezone.now())
+    layout_cache = parsed.get("layout_id") is not None
+
+    try:
+        conteo = upsert_empresas(
+            expand_rows(parsed["rows"]), progress=lambda pct, etapa: progress(50 + pct // 2, etapa),
+        )
+    except Exception as e:
+        return {"ok": False, "msg": f"Error guardando empresas de la hoja {used_sheet}: {e}",
+                "parse_seconds": parse_s}
+
+    return {
+        "ok": True,
+        "msg": f"Hoja usada: {used_sheet}. {format_conteo(conteo, parsed['skipped'])}. "
+               f"Lectura: {parse_s:.2f} s ({parsed['engine']}). "
+               f"Layout: {'en caché' if layout_cache else 'detectado'} (fila {parsed['header_row']}, modo {parsed['modo']})",
+        "parse_seconds": parse_s,
+        "engine": parsed["engine"],
+        "layout_cache": layout_cache,
+        **conteo,
+    }
+
+# ------------------ importadores por streaming (CSV / Parquet) ------------------
+
+# Columnas del formato plano (una empresa por fila); el primer encabezado que calce gana
+FLAT_COLUMNS = {
+    "ticker": ("ticker", "nemo", "nemotecnico"),
+    "nombre": ("nombre emisor", "nombre", "emisor", "issuer", "company"),
+    "pais": ("pais", "country"),
+    "sector": ("sector", "industria"),
+    "moneda": ("moneda", "currency"),
+    "capitalizacion": ("market cap", "cap bursatil", "cap. bursatil", "capitalizacion", "capitalization"),
+    "fecha_reporte": ("fecha reporte", "fecha", "date"),
+    "mercado": ("mercado", "exchange", "bolsa"),
+}
+
+CSV_EXTENSIONS = (".csv", ".txt")
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+def _map_flat_columns(columns):
+    cols_norm = [_norm(c) for c in columns]
+    mapping = {}
+    for campo, candidatos in FLAT_COLUMNS.items():
+        mapping[campo] = next(
+            (columns[i] for i, c in enumerate(cols_norm) if any(cand in c for cand in candidatos)), None,
+        )
+    return mapping
+
+def _rows_from_flat(df: pd.DataFrame, mapping: dict, paises: dict, fuente: str):
+    """
+    Normaliza un lote del formato plano con operaciones columnares.
+    Devuelve (filas para upsert_empresas, cantidad omitida por falta de ticker o nombre).
+    """
+    def col(campo):
+        c = mapping.get(campo)
+        return df[c] if c is not None else pd.Series(None, index=df.index, dtype=object)
+
+    ticker = _clean_text(col("ticker"))
+    nombre = _clean_text(col("nombre"))
+    keep = (ticker != "") & (nombre != "")
+    omitidas = int((~keep).sum())
+    df = df[keep]
+
+    def texto_o_none(campo):
+        t = _clean_text(col(campo)[keep])
+        return t.where(t != "", None).tolist()
+
+    pais = [paises.get(p.lower()) if p else None for p in texto_o_none("pais")]
+    fecha = pd.to_datetime(col("fecha_reporte")[keep], errors="coerce")
+    columnas = {
+        "ticker": ticker[keep].tolist(),
+        "nombre": nombre[keep].tolist(),
+        "pais": pais,
+        "sector": texto_o_none("sector"),
+        "moneda": texto_o_none("moneda"),
+        "capitalizacion": _parse_cap(col("capitalizacion")[keep]).tolist(),
+        "mercado": texto_o_none("mercado"),
+        "fecha_reporte": [d.date() if pd.notna(d) else None for d in fecha],
+    }
+    claves = list(columnas) + ["fuente"]
+    valores = list(columnas.values()) + [repeat(fuente)]
+    return [dict(zip(claves, fila)) for fila in zip(*valores)], omitidas
+
+def _sniff_csv(path):
+    """Separador y encoding a partir de los primeros KB del archivo."""
+    with open(path, "rb") as fh:
+        muestra = fh.read(64 * 1024)
+    try:
+        texto = muestra.decode("utf-8-sig")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        texto = muestra.decode("latin-1")
+        encoding = "latin-1"
+    primera = texto.splitlines()[0] if texto else ""
+    sep = max([",", ";", "\t", "|"], key=primera.count)
+    return sep, encoding
+
+def _csv_batches(path, chunk_size):
+    """Lotes del CSV leídos con chunksize; el avance es la posición en bytes del archivo."""
+    sep, encoding = _sniff_csv(path)
+    total = os.path.getsize(path) or 1
+    with open(path, "rb") as fh:
+        reader = pd.read_csv(fh, sep=sep, encoding=encoding, dtype=str, keep_default_na=False,
+                             na_values=[""], chunksize=chunk_size)
+        for chunk in reader:
+            yield chunk, min(1.0, fh.tell() / total)
+
+def _parquet_batches(path, chunk_size):
+    """Lotes del Parquet iterando row groups (pyarrow), sin cargar el archivo completo."""
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(path)
+    total = pf.metadata.num_rows or 1
+    leidas = 0
+    for batch in pf.iter_batches(batch_size=chunk_size):
+        leidas += batch.num_rows
+        yield batch.to_pandas(), min(1.0, leidas / total)
+
+def import_empresas_streaming(path: str, progress=None, chunk_size=None):
+    """
+    Importa un CSV o Parquet en formato plano (una empresa por fila, columnas como en
+    seed_empresas) leyendo y escribiendo por lotes de `chunk_size` filas: la memoria
+    no depende del tamaño del archivo. Cada lote se confirma en su propia transacción.
+    """
+    if not os.path.exists(path):
+        return {"ok": False, "msg": f"No existe el archivo: {path}"}
+    progress = progress or (lambda pct, etapa: None)
+    chunk_size = chunk_size or getattr(settings, "NUAM_STREAM_CHUNK_SIZE", 50_000)
+
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        if importlib.util.find_spec("pyarrow") is None:
+            return {"ok": False, "msg": "Para cargar Parquet se necesita pyarrow (pip install pyarrow)."}
+        batches, fuente = _parquet_batches(path, chunk_size), "Carga masiva Parquet"
+    else:
+        batches, fuente = _csv_batches(path, chunk_size), "Carga masiva CSV"
+
+    paises = paises_por_clave()
+    conteo = {"creadas": 0, "actualizadas": 0, "sin_cambios": 0, "repetidas": 0}
+    omitidas = lotes = 0
+    mapping = None
+    t0 = time.perf_counter()
+    try:
+        # cada lote deja sus eventos en el outbox dentro de su propia transacción
+        for df, avance in batches:
+            if mapping is None:
+                mapping = _map_flat_columns(list(df.columns))
+                if mapping["ticker"] is None or mapping["nombre"] is None:
+                    return {"ok": False, "msg": f"No se identificaron columnas de ticker y nombre: {list(df.columns)}"}
+            rows, om = _rows_from_flat(df, mapping, paises, fuente)
+            omitidas += om
+            parcial = upsert_empresas(rows, lookup="rows")
+            for k in conteo:
+                conteo[k] += parcial[k]
+            lotes += 1
+            progress(int(100 * avance), f"Lote {lotes} escrito")
+    except Exception as e:
+        return {"ok": False, "msg": f"Error en el lote {lotes + 1}: {e}. Lotes anteriores ya guardados: {lotes}."}
+
+    segundos = round(time.perf_counter() - t0, 3)
+    return {
+        "ok": True,
+        "msg": f"{fuente}: {lotes} lotes. {format_conteo(conteo, omitidas)}. Tiempo: {segundos:.2f} s",
+        "seconds": segundos,
+        **conteo,
+    }
+
+def es_tabular(path: str):
+    return path.lower().endswith(CSV_EXTENSIONS + PARQUET_EXTENSIONS)
 
-        # ---------- Procesar filas: hasta 3 empresas por fila ----------
-        for _, r in df.iterrows():
-            for bolsa, idxs in blocks.items():
-                t_i, e_i, c_i = idxs.get("ticker"), idxs.get("emisor"), idxs.get("cap")
-                # al menos ticker o nombre debe existir
-                ticker = str(r.iloc[t_i]).strip() if (t_i is not None and pd.notna(r.iloc[t_i])) else ""
-                nombre = str(r.iloc[e_i]).strip() if (e_i is not None and pd.notna(r.iloc[e_i])) else ""
-
-                if not ticker and not nombre:
-                    continue  # nada que crear
-
-                # si falta ticker pero hay nombre, generamos uno simple (no ideal, pero evita perder el registro)
-                if not ticker and nombre:
-                    ticker = re.sub(r"[^A-Z0-9]", "", unicodedata.normalize("NFKD", nombre).upper())[:10]
-
-                # capitalización
-                cap = None
-                if c_i is not None and pd.notna(r.iloc[c_i]):
-                    try:
-                        cap = float(str(r.iloc[c_i]).replace(",", "").replace(" ", ""))
-                    except Exception:
-                        cap = None
-
-                # país/moneda por defecto según bolsa
-                meta = bolsa_meta[bolsa]
-                pais_codigo = meta["pais"]
-                moneda_def = meta["moneda"]
-                pais_obj = Pais.objects.filter(codigo=pais_codigo).first()
-
-                defaults = {
-                    "nombre": nombre or None,
-                    "pais": pais_obj,
-                    "sector": None,  # el Excel no lo trae; puedes poblarlo después
-                    "moneda": moneda_def,
-                    "capitalizacion": cap,
-                    "mercado": bolsa.upper(),  # BCS / BVC / BVL
-                    "fuente": "Excel NUAM",
-                    "fecha_reporte": None,
-                }
-
-                obj, created_flag = Empresa.objects.update_or_create(ticker=ticker, defaults=defaults)
-                if created_flag:
-                    created += 1
-                else:
-                    updated += 1
-
-        used_sheet = sheet
-        break  # ya importamos desde esta hoja
-
-    if used_sheet is None:
-        return {"ok": False, "msg": "No se identificó ninguna tabla válida (bloques BCS/bvc/BVL)."}
-
-    return {"ok": True, "msg": f"Hoja usada: {used_sheet}. Creadas: {created}, actualizadas: {updated}, omitidas: {skipped}"}
+def importar_archivo(path: str, progress=None):
+    """Elige el importador según el tipo de archivo: CSV/Parquet por streaming, Excel NUAM en otro caso."""
+    if es_tabular(path):
+        return import_empresas_streaming(path, progress=progress)
+    return import_empresas_from_excel(path, progress=progress)
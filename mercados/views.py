@@ -1,16 +1,25 @@
 from django.shortcuts import render, redirect
-from django.db.models import F
+from django.db.models import F, Sum, Window
+from django.db.models.functions import PercentRank
+from django.db.models.lookups import IsNull
 from rest_framework import viewsets, filters
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-import requests
-from .models import Empresa, empresa_a_dict
-from kafka_service import publicar_evento_empresa
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+import fx_service
+import numpy as np
+from datetime import timedelta
+from django.utils import timezone
+from . import sse, tipos_cambio
 from .forms import SignupForm, UserUpdateForm
 from .models import Pais, Empresa
 import logging
@@ -18,7 +27,9 @@ logger = logging.getLogger(__name__)
 from django.shortcuts import render
 
 def dashboard_monedas(request):
-    return render(request, "dashboard_monedas.html")
+    # sin SSE (servidor WSGI) el dashboard revalida las tasas cada NUAM_SSE_POLL_S
+    return render(request, "dashboard_monedas.html",
+                  {"poll_ms": int(getattr(settings, "NUAM_SSE_POLL_S", 5.0) * 1000)})
 from .serializers import PaisSerializer, EmpresaSerializer
 
 
@@ -32,20 +43,36 @@ def home(request):
             "convertidor": "/convertir-moneda/",
         }
     })
-from django.http import JsonResponse
-import requests
+def _etag_matriz(request, *args, **kwargs):
+    # la respuesta también depende de `desactualizado` y, en el dashboard, de la fecha de hoy
+    try:
+        matriz, data = fx_service.obtener_matriz()
+    except fx_service.TasasNoDisponibles:
+        return None  # sin ETag: la vista responde el 502
+    return f"{matriz.version}-{'d' if data['desactualizado'] else 'v'}-{timezone.localdate():%Y%m%d}"
+
+
+def _etag_dashboard(request, *args, **kwargs):
+    # el histórico cambia aparte de las tasas del día (actualizar/importar_tipos_cambio)
+    version = _etag_matriz(request)
+    return version and f"{version}-{tipos_cambio.version()}"
 
+
+@cache_control(no_cache=True)  # el navegador revalida siempre con If-None-Match
+@condition(etag_func=_etag_dashboard)
 def datos_dashboard_monedas(request):
     base = request.GET.get("base", "USD")  # "USD", "CLP", "COP", "PEN", "UF"
     try:
         periodo = int(request.GET.get("periodo", "7"))
     except ValueError:
         periodo = 7
+    periodo = min(max(periodo, 1), 3660)
 
-    url = "https://api.exchangerate-api.com/v4/latest/USD"
-    r = requests.get(url, timeout=5)
-    data = r.json()
-    rates = data.get("rates", {})
+    try:
+        matriz, data = fx_service.obtener_matriz()
+    except fx_service.TasasNoDisponibles:
+        logger.error("Sin tipos de cambio para el dashboard", exc_info=True)
+        return JsonResponse({"error": "No se pudo contactar la API de tipo de cambio"}, status=502)
 
     # Códigos reales en la API
     monedas = ["CLP", "COP", "PEN", "CLF"]  # CLF = UF en la API
@@ -54,55 +81,53 @@ def datos_dashboard_monedas(request):
     valores = []
     valores_para_ranking = {}
 
-    # ---- comparación actual, respetando la base elegida ----
+    # moneda base elegida por el usuario (si la API no la trae, caer a USD)
+    base_code = "CLF" if base == "UF" else base
+    base_matriz = base_code if base_code in matriz else "USD"
+
+    # ---- comparación actual: lectura directa de la matriz de tipos cruzados ----
     for m in monedas:
-        if m in rates:
+        if m in matriz:
             etiqueta = "UF" if m == "CLF" else m
             labels.append(etiqueta)
-
-            # valor de 1 unidad de esa moneda en USD
-            valor_usd = 1 / rates[m]
-
-            # moneda base elegida por el usuario
-            base_code = "CLF" if base == "UF" else base
-            if base_code == "USD":
-                valor = valor_usd
-            elif base_code in rates:
-                # valor de 1 unidad de la base en USD
-                valor_base_usd = 1 / rates[base_code]
-                # cuánto vale 1 unidad de m en unidades de la base
-                valor = valor_usd / valor_base_usd
-            else:
-                # si la base no existe en la API, caer a USD
-                valor = valor_usd
-
-            valor_red = round(valor, 4)
+            # cuánto vale 1 unidad de m en unidades de la base
+            valor_red = round(matriz.tasa(m, base_matriz), 4)
             valores.append(valor_red)
             valores_para_ranking[etiqueta] = valor_red
 
-    # ---- histórico simulado (solo cambia etiqueta de base) ----
-    labels_hist = [f"Día {i}" for i in range(1, periodo + 1)]
+    # ---- histórico real (TipoCambio): una consulta por rango para todas las monedas ----
+    hasta = timezone.localdate()  # día en TIME_ZONE, no el del reloj del servidor
+    desde = hasta - timedelta(days=periodo - 1)
+    fechas, historico = tipos_cambio.serie(set(monedas) | {base_code}, desde, hasta)
+    labels_hist = [f.isoformat() for f in fechas]
     colores = {
         "CLP": "#4e79a7",
         "COP": "#f28e2b",
         "PEN": "#e15759",
         "CLF": "#76b7b2",
     }
+    base_hist_usd = base_code == "USD" or not historico[base_code]
+    # etiquetas con la base que realmente se usó (USD si no hay tasa de la pedida)
+    base_actual = "UF" if base_matriz == "CLF" else base_matriz
+    base_historico = "USD" if base_hist_usd else base
     series = []
     for m in monedas:
-        if m in rates:
-            base_val = 1 / rates[m]  # valor en USD, solo para forma de la curva
-            puntos = []
-            for i in range(periodo):
-                factor = 1 + (i - periodo / 2) * 0.005
-                puntos.append(round(base_val * factor, 4))
-            series.append({
-                "label": f"{'UF' if m=='CLF' else m} vs {base}",
-                "data": puntos,
-                "borderColor": colores[m],
-                "fill": False,
-                "tension": 0.2,
-            })
+        tasas_m = historico[m]
+        if not tasas_m:
+            continue
+        puntos = []
+        for f in fechas:
+            # igual que la comparación actual: 1 unidad de m expresada en la base (USD si no hay tasa de la base)
+            tasa_base = 1 if base_hist_usd else historico[base_code].get(f)
+            puntos.append(round(tasa_base / tasas_m[f], 4) if f in tasas_m and tasa_base else None)
+        series.append({
+            "label": f"{'UF' if m=='CLF' else m} vs {base_historico}",
+            "data": puntos,
+            "borderColor": colores[m],
+            "fill": False,
+            "tension": 0.2,
+            "spanGaps": True,
+        })
 
     max_moneda = min_moneda = None
     if valores_para_ranking:
@@ -110,7 +135,7 @@ def datos_dashboard_monedas(request):
         min_moneda = min(valores_para_ranking, key=valores_para_ranking.get)
 
     return JsonResponse({
-        "base": base,
+        "base": base_actual,
         "labels": labels,
         "valores": valores,
         "labels_historico": labels_hist,
@@ -136,24 +161,23 @@ def convertidor_view(request):
 
 # -------- API convertidor de moneda (JSON) --------
 def convertir_moneda(request):
-    # Validar monto
     monto_str = request.GET.get("monto", "").strip()
     if not monto_str:
+        logger.warning("Intento de conversión sin monto")
         return JsonResponse({"error": "Debe indicar un monto numérico"}, status=400)
     try:
         monto = float(monto_str)
     except ValueError:
+        logger.warning("Monto inválido: %s", monto_str)
         return JsonResponse({"error": "El monto debe ser un número válido"}, status=400)
 
     moneda = request.GET.get("moneda", "CLP")  # CLP, PEN, COP, etc.
 
-    # Llamar API externa con manejo de errores
-    url = "https://api.exchangerate-api.com/v4/latest/USD"
+    # Tasas desde la caché compartida (fx_service): no se llama a la API en cada request
     try:
-        r = requests.get(url, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-    except requests.RequestException:
+        data = fx_service.obtener_tasas()
+    except fx_service.TasasNoDisponibles:
+        logger.error("Sin tipos de cambio disponibles", exc_info=True)
         return JsonResponse(
             {"error": "No se pudo contactar la API de tipo de cambio"},
             status=502,
@@ -161,6 +185,7 @@ def convertir_moneda(request):
 
     rates = data.get("rates", {})
     if moneda not in rates:
+        logger.warning("Moneda no soportada: %s", moneda)
         return JsonResponse(
             {"error": f"Moneda no soportada: {moneda}"},
             status=400,
@@ -170,6 +195,7 @@ def convertir_moneda(request):
     usd_por_moneda = 1 / tasa_moneda
     resultado = monto * usd_por_moneda
 
+    logger.info("Conversión exitosa %s %s -> %s USD", monto, moneda, round(resultado, 4))
     return JsonResponse(
         {
             "monto": monto,
@@ -178,6 +204,100 @@ def convertir_moneda(request):
             "usd_por_moneda": usd_por_moneda,
             "fecha": data.get("date"),
             "tasa_base": "USD",
+            "desactualizado": data["desactualizado"],
+        }
+    )
+
+# -------- Tasas en vivo para el dashboard (Server-Sent Events) --------
+def tasas_stream(request):
+    """Stream SSE con las tasas vigentes; reenvía solo si cambiaron desde Last-Event-ID."""
+    if not isinstance(request, ASGIRequest):
+        # bajo WSGI cada conexión ocuparía un hilo del pool hasta NUAM_SSE_MAX_S
+        poll_s = getattr(settings, "NUAM_SSE_POLL_S", 5.0)
+        respuesta = JsonResponse({"error": "Tasas en vivo solo bajo ASGI; consultar de nuevo más tarde",
+                                  "poll_s": poll_s}, status=503)
+        respuesta["Retry-After"] = str(max(1, round(poll_s)))
+        return respuesta
+    respuesta = StreamingHttpResponse(sse.stream_async(request.headers.get("Last-Event-ID")),
+                                      content_type="text/event-stream")
+    respuesta["Cache-Control"] = "no-cache"
+    respuesta["X-Accel-Buffering"] = "no"  # que un proxy no acumule los eventos
+    return respuesta
+
+
+# -------- Estado del proveedor de tipo de cambio (monitoreo) --------
+def fx_estado(request):
+    """Circuit breaker del cliente HTTP, métricas de la caché de tasas y conexiones SSE de este proceso."""
+    return JsonResponse({**fx_service.estado(), "sse": sse.metricas()})
+
+
+# -------- Matriz de tipos cruzados (JSON, con ETag) --------
+@cache_control(no_cache=True)
+@condition(etag_func=_etag_matriz)
+def matriz_tipos_cambio(request):
+    """
+    Tipos cruzados entre todas las monedas del proveedor. Con ?base=XXX devuelve el valor de
+    1 unidad de cada moneda en XXX; sin base, la matriz completa (filas = desde, columnas = hacia).
+    ?monedas=CLP,PEN,... limita la matriz completa a esas monedas.
+    """
+    try:
+        matriz, data = fx_service.obtener_matriz()
+    except fx_service.TasasNoDisponibles:
+        logger.error("Sin tipos de cambio para la matriz", exc_info=True)
+        return JsonResponse({"error": "No se pudo contactar la API de tipo de cambio"}, status=502)
+
+    respuesta = {"fecha": matriz.fecha, "version": matriz.version, "desactualizado": data["desactualizado"]}
+    base = request.GET.get("base")
+    if base:
+        if base not in matriz:
+            return JsonResponse({"error": f"Moneda no soportada: {base}"}, status=400)
+        respuesta.update(base=base, valores=matriz.columna(base))
+        return JsonResponse(respuesta)
+
+    monedas = [m for m in request.GET.get("monedas", "").split(",") if m] or matriz.monedas
+    faltantes = [m for m in monedas if m not in matriz]
+    if faltantes:
+        return JsonResponse({"error": f"Moneda no soportada: {', '.join(faltantes)}"}, status=400)
+    idx = [matriz.indice[m] for m in monedas]
+    respuesta.update(monedas=monedas, matriz=matriz.valores[np.ix_(idx, idx)].round(8).tolist())
+    return JsonResponse(respuesta)
+
+
+# -------- API convertidor de moneda por lotes (POST JSON o CSV) --------
+@csrf_exempt
+@require_POST
+def convertir_moneda_lote(request):
+    """
+    Convierte muchos montos en un solo request (ver fx_service.leer_lote para el formato).
+    ?moneda= y ?destino= fijan los valores por defecto de los ítems (CLP y USD).
+    """
+    try:
+        montos, monedas, destinos = fx_service.leer_lote(
+            fx_service.cuerpo_lote(request), request.content_type,
+            moneda=request.GET.get("moneda", "CLP"), destino=request.GET.get("destino", "USD"),
+        )
+    except ValueError as e:
+        logger.warning("Lote de conversión inválido: %s", e)
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        data = fx_service.obtener_tasas()
+    except fx_service.TasasNoDisponibles:
+        logger.error("Sin tipos de cambio disponibles", exc_info=True)
+        return JsonResponse(
+            {"error": "No se pudo contactar la API de tipo de cambio"},
+            status=502,
+        )
+
+    resultados, errores = fx_service.convertir_lote(montos, monedas, destinos, data.get("rates", {}))
+    logger.info("Conversión por lotes: %s ítems, %s con error", len(resultados), len(errores))
+    return JsonResponse(
+        {
+            "resultados": resultados,
+            "errores": errores,
+            "fecha": data.get("date"),
+            "tasa_base": "USD",
+            "desactualizado": data["desactualizado"],
         }
     )
 
@@ -206,6 +326,12 @@ class PaisViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class TopEmpresasPorPais(APIView):
+    """
+    Top-N por capitalización en USD (`capitalizacion_usd`), comparable entre bolsas: sin
+    ?pais= es el ranking regional. El percentil se calcula sobre las empresas con valor en
+    USD del mismo filtro; top-N + percentil es una consulta y el total regional otra.
+    """
+
     def get(self, request):
         pais = request.GET.get("pais")
         try:
@@ -217,19 +343,37 @@ class TopEmpresasPorPais(APIView):
         if pais:
             qs = qs.filter(pais__codigo__iexact=pais)
 
-        qs = qs.order_by(F("capitalizacion").desc(nulls_last=True))[:n]
+        total_usd = qs.aggregate(total=Sum("capitalizacion_usd"))["total"]
+        top = (
+            qs.annotate(percentil=Window(
+                PercentRank(),
+                partition_by=[IsNull(F("capitalizacion_usd"), True)],
+                order_by=F("capitalizacion_usd").asc(),
+            ))
+            .order_by(F("capitalizacion_usd").desc(nulls_last=True), "ticker")[:n]
+        )
 
         data = [
             {
                 "ticker": e.ticker,
                 "nombre": e.nombre,
-                "pais": e.pais.codigo if e.pais else None,
+                "pais": e.pais_id,
                 "capitalizacion": float(e.capitalizacion) if e.capitalizacion is not None else None,
                 "moneda": e.moneda,
+                "capitalizacion_usd": round(e.capitalizacion_usd, 2) if e.capitalizacion_usd is not None else None,
+                "percentil": round(e.percentil * 100, 1) if e.capitalizacion_usd is not None else None,
+                "participacion": round(100 * e.capitalizacion_usd / total_usd, 2)
+                if e.capitalizacion_usd is not None and total_usd else None,
             }
-            for e in qs
+            for e in top
         ]
-        return Response({"pais": pais, "n": n, "resultados": data})
+        return Response({
+            "pais": pais,
+            "n": n,
+            "moneda": "USD",
+            "total_usd": round(total_usd, 2) if total_usd is not None else None,
+            "resultados": data,
+        })
 
 
 # -------- Endpoint SIN paginación para el front /catalogo-data/ --------
@@ -305,51 +449,3 @@ def error_404(request, exception):
 
 def error_500(request):
     return render(request, "errors/500.html", status=500)
-def convertir_moneda(request):
-    monto_str = request.GET.get("monto", "").strip()
-    if not monto_str:
-        logger.warning("Intento de conversión sin monto")
-        return JsonResponse({"error": "Debe indicar un monto numérico"}, status=400)
-    try:
-        monto = float(monto_str)
-    except ValueError:
-        logger.warning("Monto inválido: %s", monto_str)
-        return JsonResponse({"error": "El monto debe ser un número válido"}, status=400)
-
-    moneda = request.GET.get("moneda", "CLP")
-
-    url = "https://api.exchangerate-api.com/v4/latest/USD"
-    try:
-        r = requests.get(url, timeout=5)
-        r.raise_for_status()
-        data = r.json()
-    except requests.RequestException:
-        logger.error("Fallo al llamar API de tipo de cambio", exc_info=True)
-        return JsonResponse(
-            {"error": "No se pudo contactar la API de tipo de cambio"},
-            status=502,
-        )
-
-    rates = data.get("rates", {})
-    if moneda not in rates:
-        logger.warning("Moneda no soportada: %s", moneda)
-        return JsonResponse(
-            {"error": f"Moneda no soportada: {moneda}"},
-            status=400,
-        )
-
-    tasa_moneda = rates[moneda]
-    usd_por_moneda = 1 / tasa_moneda
-    resultado = monto * usd_por_moneda
-
-    logger.info("Conversión exitosa %s %s -> %s USD", monto, moneda, round(resultado, 4))
-    return JsonResponse(
-        {
-            "monto": monto,
-            "moneda": moneda,
-            "resultado_usd": round(resultado, 4),
-            "usd_por_moneda": usd_por_moneda,
-            "fecha": data.get("date"),
-            "tasa_base": "USD",
-        }
-    )
\ No newline at end of file
@@ -96,6 +96,9 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 # (puedes borrar SPECTACULAR_SETTINGS; ya no se usa con drf-yasg)
 
+# logs/ no se versiona: se crea al arrancar
+(BASE_DIR / "logs").mkdir(exist_ok=True)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -149,3 +152,30 @@ LOGIN_URL = "/cuenta/login/"
 LOGIN_REDIRECT_URL = "home"   # que vuelva al menú después de login
 LOGOUT_REDIRECT_URL = "home"  # que vuelva al menú después de logout (incluido admin)
 
+
+# Importación de planillas (auto | openpyxl | stream | calamine)
+NUAM_EXCEL_ENGINE = os.getenv("NUAM_EXCEL_ENGINE", "auto")
+NUAM_IMPORT_BATCH_SIZE = int(os.getenv("NUAM_IMPORT_BATCH_SIZE", "1000"))
+NUAM_STREAM_CHUNK_SIZE = int(os.getenv("NUAM_STREAM_CHUNK_SIZE", "50000"))
+NUAM_LAYOUT_CACHE = os.getenv("NUAM_LAYOUT_CACHE", "1") == "1"
+# Cola de cargas: cada cuántos segundos el worker marca sus trabajos como vivos y tope de intentos
+NUAM_CARGAS_LATIDO_S = float(os.getenv("NUAM_CARGAS_LATIDO_S", "30"))
+NUAM_CARGAS_MAX_INTENTOS = int(os.getenv("NUAM_CARGAS_MAX_INTENTOS", "3"))
+# Cada cuántos segundos un worker en marcha revisa si hay trabajos de workers caídos para reencolar
+NUAM_CARGAS_REVISAR_S = float(os.getenv("NUAM_CARGAS_REVISAR_S", "60"))
+
+# Eventos de Empresa hacia Kafka: formato (json | msgpack) y ediciones solo con campos cambiados
+NUAM_EVENTOS_FORMATO = os.getenv("NUAM_EVENTOS_FORMATO", "json")
+NUAM_EVENTOS_DELTA = os.getenv("NUAM_EVENTOS_DELTA", "0") == "1"
+# Ventana del relay para fusionar ediciones seguidas de un mismo ticker (0 = sin coalescencia)
+NUAM_EVENTOS_VENTANA_S = float(os.getenv("NUAM_EVENTOS_VENTANA_S", "0"))
+NUAM_EVENTOS_BUFFER_MAX = int(os.getenv("NUAM_EVENTOS_BUFFER_MAX", "10000"))
+
+# Histórico de tipos de cambio (manage.py actualizar_tipos_cambio): api (FX_URL) | archivo (CSV/JSON local)
+NUAM_FX_PROVEEDOR = os.getenv("NUAM_FX_PROVEEDOR", "api")
+NUAM_FX_ARCHIVO = os.getenv("NUAM_FX_ARCHIVO", "")
+
+# Tasas en vivo por SSE (/api/tipos-cambio/stream/): revisión de la caché, heartbeat y vida máxima de cada conexión
+NUAM_SSE_POLL_S = float(os.getenv("NUAM_SSE_POLL_S", "5"))
+NUAM_SSE_HEARTBEAT_S = float(os.getenv("NUAM_SSE_HEARTBEAT_S", "15"))
+NUAM_SSE_MAX_S = float(os.getenv("NUAM_SSE_MAX_S", "300"))
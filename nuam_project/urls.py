@@ -17,6 +17,7 @@ from mercados.views import (
     eliminar_cuenta,
     convertidor_view,
     convertir_moneda,
+    convertir_moneda_lote,
     dashboard_monedas,
     datos_dashboard_monedas,
 )
@@ -57,6 +58,7 @@ urlpatterns = [
     # Convertidor
     path("convertir-moneda/", convertidor_view, name="convertidor"),
     path("api/convertir-moneda/", convertir_moneda, name="convertir-moneda-api"),
+    path("api/convertir-moneda/lote/", convertir_moneda_lote, name="convertir-moneda-lote-api"),
 
     # Dashboard monedas
     path("dashboard-monedas/", dashboard_monedas, name="dashboard-monedas"),